@@ -0,0 +1,234 @@
+"""
+Benchmarks for the hot paths of the extension.
+
+Generates a synthetic model library and times the preview search, preview rendering, tag collection,
+filtering, choice lookup and .civitai.info rendering of the modelpreview_xd engine in each name matching mode.
+The engine doesn't need the webui so it is imported directly. The results are written as JSON so they can be
+compared between releases.
+
+Run it with the python environment of the webui (it needs Pillow, lxml_html_clean and requests):
+
+	python benchmarks/benchmark.py --models 2000 --output benchmark_results.json
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from io import BytesIO
+
+repository_directory = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, repository_directory)
+import modelpreview_xd # noqa: E402
+
+matching_modes = ["Loose", "Strict", "Folder", "Index"]
+tag_words = ["anime", "realistic", "portrait", "landscape", "fantasy", "dragon", "cyberpunk", "watercolor", "sketch", "photo",
+	"character", "style", "concept", "armor", "castle", "forest", "city", "night", "sunset", "ocean"]
+filter_queries = ["dragon", "model_00", "anime, portrait", "zzz_not_found", "e", "castle night"]
+
+def parse_args():
+	parser = argparse.ArgumentParser(description="Benchmark the SD Model Preview XD extension on a synthetic model library.")
+	parser.add_argument("--models", type=int, default=1000, help="number of models to generate")
+	parser.add_argument("--previews", type=int, default=3, help="number of preview images per model")
+	parser.add_argument("--depth", type=int, default=2, help="how many folders deep the models are nested")
+	parser.add_argument("--fanout", type=int, default=4, help="number of subfolders in each folder")
+	parser.add_argument("--index-folders", type=int, default=10, help="number of folders with an index.txt file")
+	parser.add_argument("--folder-fraction", type=float, default=0.1, help="fraction of models with a folder of previews named after them")
+	parser.add_argument("--civitai-fraction", type=float, default=0.1, help="fraction of models with a .civitai.info file")
+	parser.add_argument("--tags-fraction", type=float, default=0.5, help="fraction of models with a .tags file")
+	parser.add_argument("--sample", type=int, default=200, help="number of models the per model benchmarks are run for")
+	parser.add_argument("--repeat", type=int, default=5, help="number of times each benchmark is repeated")
+	parser.add_argument("--modes", default=",".join(matching_modes), help="comma separated name matching modes to benchmark")
+	parser.add_argument("--seed", type=int, default=0, help="seed for the generated library")
+	parser.add_argument("--keep", metavar="DIR", help="generate the library in DIR and keep it instead of using a temporary folder")
+	parser.add_argument("--output", help="file to write the JSON results to, they are printed if this isn't set")
+	return parser.parse_args()
+
+def create_png(width, height):
+	# a small png with prompt data in it like the images the webui saves
+	from PIL import Image
+	from PIL.PngImagePlugin import PngInfo
+	png_info = PngInfo()
+	png_info.add_text("parameters", "a benchmark prompt\nNegative prompt: blurry\nSteps: 20, Sampler: Euler a, CFG scale: 7")
+	output = BytesIO()
+	Image.new("RGB", (width, height), (40, 80, 120)).save(output, format="PNG", pnginfo=png_info)
+	return output.getvalue()
+
+def create_civitai_info(model_name, rng):
+	# a .civitai.info file shaped like the ones civitai helper extensions save
+	description = "".join(f"<p>{' '.join(rng.choices(tag_words, k=30))}</p><script>alert(1)</script>" for _ in range(20))
+	return {
+		"id": rng.randint(1, 10 ** 6),
+		"modelId": rng.randint(1, 10 ** 6),
+		"name": model_name,
+		"createdAt": "2023-01-01T00:00:00.000Z",
+		"updatedAt": "2023-01-02T00:00:00.000Z",
+		"trainedWords": rng.sample(tag_words, 3),
+		"baseModel": "SD 1.5",
+		"description": description,
+		"stats": {"downloadCount": 10, "ratingCount": 2, "rating": 5},
+		"model": {"name": model_name, "type": "Checkpoint", "nsfw": False, "poi": False, "description": description},
+		"files": [{"name": f"{model_name}.safetensors", "id": 1, "sizeKB": 2000000, "type": "Model", "metadata": {"format": "SafeTensor", "fp": "fp16", "size": "pruned"}}],
+		"images": [{"url": f"https://image.civitai.com/benchmark/{model_name}-{i}/width=450/{i}.jpeg", "nsfw": "None", "width": 450, "height": 600,
+			"meta": {"prompt": "a benchmark prompt", "negativePrompt": "blurry", "cfgScale": 7, "steps": 20, "sampler": "Euler a", "seed": i}} for i in range(8)]
+	}
+
+def generate_library(root, args):
+	# create a webui folder with a models/Stable-diffusion folder full of models and preview files, returns the model names
+	rng = random.Random(args.seed)
+	models_directory = os.path.join(root, "models", "Stable-diffusion")
+	os.makedirs(models_directory, exist_ok=True)
+	png_data = create_png(64, 64)
+	model_titles = []
+	for i in range(args.models):
+		model_name = f"model_{i:05d}"
+		# spread the models over nested folders
+		subfolders = [f"group_{(i // args.fanout ** level) % args.fanout}" for level in range(args.depth)]
+		directory = os.path.join(models_directory, *subfolders)
+		os.makedirs(directory, exist_ok=True)
+		open(os.path.join(directory, f"{model_name}.safetensors"), "wb").close()
+		model_titles.append("/".join(subfolders + [f"{model_name}.safetensors [{i:010x}]"]))
+		# the preview images, named every way the matching modes support
+		for preview in range(args.previews):
+			preview_name = f"{model_name}.png" if preview == 0 else f"{model_name}.preview.{preview}.png"
+			with open(os.path.join(directory, preview_name), "wb") as f:
+				f.write(png_data)
+		if i % 2 == 0:
+			with open(os.path.join(directory, f"{model_name}.txt"), "w", encoding="utf8") as f:
+				f.write(f"notes for {model_name}\n" * 5)
+		if rng.random() < args.tags_fraction:
+			with open(os.path.join(directory, f"{model_name}.tags"), "w", encoding="utf8") as f:
+				f.write(", ".join(rng.sample(tag_words, 5)))
+		if rng.random() < args.civitai_fraction:
+			with open(os.path.join(directory, f"{model_name}.civitai.info"), "w", encoding="utf8") as f:
+				json.dump(create_civitai_info(model_name, rng), f)
+		if rng.random() < args.folder_fraction:
+			# a folder named after the model for the Folder matching mode
+			model_folder = os.path.join(directory, model_name)
+			os.makedirs(model_folder, exist_ok=True)
+			for preview in range(args.previews):
+				with open(os.path.join(model_folder, f"sample_{preview}.png"), "wb") as f:
+					f.write(png_data)
+			with open(os.path.join(model_folder, "notes.md"), "w", encoding="utf8") as f:
+				f.write(f"# {model_name}\n")
+	# folders of shared previews listed in an index.txt file for the Index matching mode
+	for j in range(args.index_folders):
+		index_folder = os.path.join(models_directory, f"shared_{j}")
+		os.makedirs(index_folder, exist_ok=True)
+		with open(os.path.join(index_folder, "index.txt"), "w", encoding="utf8") as f:
+			f.write("\n".join(f"model_{rng.randrange(args.models):05d}" for _ in range(5)))
+		for preview in range(args.previews):
+			with open(os.path.join(index_folder, f"shared.{preview}.png"), "wb") as f:
+				f.write(png_data)
+		with open(os.path.join(index_folder, "shared.md"), "w", encoding="utf8") as f:
+			f.write("# shared previews\n")
+	return model_titles
+
+def time_calls(fn, calls, repeat):
+	# time running every call `repeat` times, the first run is reported on its own because it fills the caches
+	run_times = []
+	for _ in range(repeat):
+		start = time.perf_counter()
+		for call in calls:
+			fn(*call)
+		run_times.append(time.perf_counter() - start)
+	result = {
+		"calls": len(calls),
+		"first_ms": run_times[0] * 1000,
+		"median_ms": statistics.median(run_times) * 1000,
+		"min_ms": min(run_times) * 1000,
+		"max_ms": max(run_times) * 1000,
+	}
+	if len(calls) > 0:
+		result["median_per_call_us"] = statistics.median(run_times) / len(calls) * 10 ** 6
+	return result
+
+def run_benchmarks(model_titles, paths, options, args):
+	rng = random.Random(args.seed)
+	results = {}
+	for mode in args.modes.split(","):
+		mode_options = dict(options, name_matching=mode)
+		# start every mode from an empty index so the first run shows the cost of scanning the library
+		modelpreview_xd.preview_index.clear()
+		mode_results = {}
+
+		choices = sorted(model_titles, key=modelpreview_xd.natural_order_number)
+		sample = rng.sample(choices, min(args.sample, len(choices)))
+		sample_names = [modelpreview_xd.clean_modelname(choice) for choice in sample]
+
+		mode_results["search_and_display_previews"] = time_calls(modelpreview_xd.search_and_display_previews, [(name, paths, mode_options) for name in sample_names], args.repeat)
+		# the first run renders every preview, the runs after it are answered from the preview cache
+		mode_results["get_preview"] = time_calls(modelpreview_xd.get_preview, [(name, paths, mode_options, "checkpoints") for name in sample_names], args.repeat)
+		mode_results["search_for_tags"] = time_calls(lambda: modelpreview_xd.search_for_tags(choices, {}, paths, mode), [()], args.repeat)
+
+		# the tags and indexes the filter uses, built the same way the extension builds them when the list is loaded
+		model_tags = {}
+		modelpreview_xd.search_for_tags(choices, model_tags, paths, mode)
+		filter_index = modelpreview_xd.build_filter_index(choices, model_tags)
+		filter_calls = [(choices, query, model_tags) for query in filter_queries]
+		mode_results["filter_choices"] = time_calls(modelpreview_xd.filter_choices, filter_calls, args.repeat)
+		mode_results["filter_choices_indexed"] = time_calls(modelpreview_xd.filter_choices, [call + (filter_index, "Exact") for call in filter_calls], args.repeat)
+		mode_results["filter_choices_fuzzy"] = time_calls(modelpreview_xd.filter_choices, [call + (filter_index, "Fuzzy") for call in filter_calls], args.repeat)
+
+		choice_map = modelpreview_xd.build_choice_map(choices)
+		mode_results["find_choice"] = time_calls(modelpreview_xd.find_choice, [(choices, name, choice_map) for name in sample_names], args.repeat)
+
+		results[mode] = mode_results
+
+	# .civitai.info rendering doesn't depend on the matching mode, the image cache is off so nothing is downloaded
+	civitai_files = [os.path.join(directory, file_name) for directory, _, file_names in os.walk(paths[0]) for file_name in file_names if file_name.endswith(".civitai.info")]
+	results["create_civitai_info_html"] = time_calls(modelpreview_xd.create_civitai_info_html, [(file, options) for file in civitai_files[:args.sample]], args.repeat)
+	return results
+
+def get_git_commit():
+	try:
+		return subprocess.run(["git", "rev-parse", "HEAD"], cwd=repository_directory, capture_output=True, text=True, check=True).stdout.strip()
+	except (OSError, subprocess.CalledProcessError):
+		return None
+
+def main():
+	args = parse_args()
+	work_directory = os.path.abspath(args.keep) if args.keep else tempfile.mkdtemp(prefix="sd-model-preview-xd-benchmark-")
+	webui_directory = os.path.join(work_directory, "webui")
+	# the engine saves thumbnails and caches to the cache folder, keep them out of the repository
+	cache_directory = os.path.join(work_directory, "cache")
+	os.makedirs(cache_directory, exist_ok=True)
+	options = modelpreview_xd.get_options(cache_directory=cache_directory, webui_directory=webui_directory)
+	try:
+		start = time.perf_counter()
+		model_titles = generate_library(webui_directory, args)
+		generate_seconds = time.perf_counter() - start
+		results = run_benchmarks(model_titles, [os.path.join(webui_directory, "models", "Stable-diffusion")], options, args)
+		# the engine's own timings of each stage
+		stages = modelpreview_xd.get_timing_stats()
+	finally:
+		if not args.keep:
+			shutil.rmtree(work_directory, ignore_errors=True)
+
+	output = {
+		"meta": {
+			"timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+			"commit": get_git_commit(),
+			"python": platform.python_version(),
+			"platform": platform.platform(),
+			"arguments": vars(args),
+			"generate_seconds": generate_seconds,
+		},
+		"results": results,
+		"stages": stages,
+	}
+	output_json = json.dumps(output, indent=2)
+	if args.output:
+		with open(args.output, "w", encoding="utf8") as f:
+			f.write(output_json + "\n")
+	else:
+		print(output_json)
+
+if __name__ == "__main__":
+	main()
@@ -0,0 +1,151 @@
+"""
+Checks the .civitai.info image downloads against a local HTTP server.
+
+Starts an http.server on localhost with endpoints that answer right away, answer slowly, fail with an error status,
+drop the connection or never answer, then checks that download_image gives up after its per-request timeout,
+that fetch_concurrently runs the downloads at the same time and returns by its deadline, and that a failing
+download doesn't affect the others. Nothing is downloaded from the internet.
+
+Run it with the python environment of the webui (it needs Pillow, lxml_html_clean and requests):
+
+	python benchmarks/check_civitai_fetch.py
+
+It exits with a non-zero status if any check fails.
+"""
+import argparse
+import os
+import socket
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+repository_directory = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, repository_directory)
+from modelpreview_xd import civitai # noqa: E402
+
+# how much longer than expected a request may take before a check fails, for slow machines
+timing_margin = 0.5
+image_data = b"\x89PNG\r\n\x1a\n" + b"\x00" * 64
+
+def parse_args():
+	parser = argparse.ArgumentParser(description="Check the civitai image downloads of SD Model Preview XD against a local server.")
+	parser.add_argument("--slow", type=float, default=0.5, help="seconds the slow endpoint takes to answer")
+	parser.add_argument("--timeout", type=float, default=2.0, help="per-request timeout given to download_image, longer than --slow")
+	parser.add_argument("--deadline", type=float, default=1.0, help="deadline given to fetch_concurrently, shorter than --timeout")
+	args = parser.parse_args()
+	if not args.slow < args.timeout or not args.deadline < args.timeout:
+		parser.error("--slow and --deadline must be shorter than --timeout")
+	return args
+
+def create_handler(args, stop_event):
+	class Handler(BaseHTTPRequestHandler):
+		def do_GET(self):
+			endpoint = self.path.strip("/").split("/")[0]
+			if endpoint == "slow":
+				time.sleep(args.slow)
+			elif endpoint == "hang":
+				# never answer, until the server is stopped
+				stop_event.wait()
+				return
+			elif endpoint == "error":
+				self.send_error(500)
+				return
+			elif endpoint == "reset":
+				# close the connection without sending a response
+				self.connection.shutdown(socket.SHUT_RDWR)
+				self.close_connection = True
+				return
+			self.send_response(200)
+			self.send_header("Content-Type", "image/png")
+			self.send_header("Content-Length", str(len(image_data)))
+			self.end_headers()
+			self.wfile.write(image_data)
+
+		def log_message(self, format, *log_args):
+			pass
+	return Handler
+
+failures = []
+
+def check(condition, description):
+	print(f"{'ok' if condition else 'FAILED'}: {description}")
+	if not condition:
+		failures.append(description)
+
+def timed(fn, *fn_args, **fn_kwargs):
+	# run fn and return its result and how long it took in seconds
+	start = time.perf_counter()
+	result = fn(*fn_args, **fn_kwargs)
+	return result, time.perf_counter() - start
+
+def raising_fetch(url, session, timeout):
+	# a fetch function that fails for one url, to check that an exception only loses that url
+	if "raise" in url:
+		raise RuntimeError("fetch failed on purpose")
+	return civitai.download_image(url, session, timeout)
+
+def main():
+	args = parse_args()
+	stop_event = threading.Event()
+	server = ThreadingHTTPServer(("127.0.0.1", 0), create_handler(args, stop_event))
+	server.daemon_threads = True
+	threading.Thread(target=server.serve_forever, daemon=True).start()
+	base_url = f"http://127.0.0.1:{server.server_address[1]}"
+	session = civitai.get_civitai_session()
+
+	try:
+		# single downloads
+		result, _ = timed(civitai.download_image, f"{base_url}/ok", session, args.timeout)
+		check(result == image_data, "download_image returns the image")
+		result, _ = timed(civitai.download_image, f"{base_url}/error", session, args.timeout)
+		check(result is None, "download_image returns None for an error status")
+		result, _ = timed(civitai.download_image, f"{base_url}/reset", session, args.timeout)
+		check(result is None, "download_image returns None when the connection is dropped")
+		result, elapsed = timed(civitai.download_image, f"{base_url}/hang/1", session, args.timeout)
+		check(result is None and elapsed < args.timeout + timing_margin,
+			f"download_image gives up on a server that doesn't answer after its timeout ({elapsed:.2f}s, timeout {args.timeout}s)")
+
+		# slow downloads run at the same time, and the ones that fail don't affect the others
+		# (the quick ones go first so they don't wait for a free thread behind the slow ones)
+		slow_urls = [f"{base_url}/slow/{i}" for i in range(civitai.civitai_fetch_workers - 1)]
+		urls = [f"{base_url}/ok/1", f"{base_url}/error/1", f"{base_url}/reset/1", f"{base_url}/raise/1"] + slow_urls
+		results, elapsed = timed(civitai.fetch_concurrently, urls, raising_fetch, (session, args.timeout), deadline=args.slow * len(slow_urls) + timing_margin)
+		check(all(results.get(url) == image_data for url in slow_urls + [f"{base_url}/ok/1"]), "fetch_concurrently returns every image that downloaded")
+		check(results.get(f"{base_url}/error/1", b"") is None and results.get(f"{base_url}/reset/1", b"") is None,
+			"fetch_concurrently returns None for the downloads that failed")
+		check(f"{base_url}/raise/1" not in results, "fetch_concurrently leaves out a fetch that raised")
+		check(elapsed < args.slow * 2,
+			f"fetch_concurrently downloads at the same time ({elapsed:.2f}s for {len(slow_urls)} requests of {args.slow}s)")
+
+		# a download that doesn't finish by the deadline is left running in the background and isn't started twice
+		hang_url = f"{base_url}/hang/2"
+		results, elapsed = timed(civitai.fetch_concurrently, [hang_url, f"{base_url}/ok/2"], civitai.download_image, (session, args.timeout), deadline=args.deadline)
+		check(hang_url not in results and results.get(f"{base_url}/ok/2") == image_data,
+			"fetch_concurrently returns the finished downloads without the one still running")
+		check(elapsed < args.deadline + timing_margin, f"fetch_concurrently returns by its deadline ({elapsed:.2f}s, deadline {args.deadline}s)")
+		pending_key = (civitai.download_image, (session, args.timeout), hang_url)
+		with civitai.civitai_pending_fetches_lock:
+			pending_fetch = civitai.civitai_pending_fetches.get(pending_key)
+		check(pending_fetch is not None and not pending_fetch.done(), "the late download keeps running in the background")
+		civitai.fetch_concurrently([hang_url], civitai.download_image, (session, args.timeout), deadline=0)
+		with civitai.civitai_pending_fetches_lock:
+			check(civitai.civitai_pending_fetches.get(pending_key) is pending_fetch, "fetching the same url again waits on the running download")
+		if pending_fetch is not None:
+			pending_fetch.exception(timeout=args.timeout + timing_margin)
+			# the done callback that removes the download from the pending downloads runs right after it finishes
+			time.sleep(0.1)
+		with civitai.civitai_pending_fetches_lock:
+			check(pending_key not in civitai.civitai_pending_fetches, "the late download is forgotten once it times out")
+	finally:
+		stop_event.set()
+		server.shutdown()
+		server.server_close()
+
+	if failures:
+		print(f"{len(failures)} check(s) failed")
+		sys.exit(1)
+	print("all checks passed")
+
+if __name__ == "__main__":
+	main()
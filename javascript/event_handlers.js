@@ -156,12 +156,15 @@ onUiUpdate(function() {
         break;
       }
 
+      // the path and hash of the model, these pick the right model if there are models with the same name in different folders
+      let modelHint = mp_getCardHint(card);
+
       // build out a new button to link to the preview tab
       let previewXD_Btn = document.createElement("div");
       previewXD_Btn.className = "previewXD-button card-button info";
       previewXD_Btn.title = "Go To Preview";
       previewXD_Btn.onclick = function(event) {
-          doCardClick(event, modelName, modelToSelect);
+          doCardClick(event, modelName, modelToSelect, modelHint);
       };
       buttonRow.prepend(previewXD_Btn);
 
@@ -208,7 +211,29 @@ onUiUpdate(function() {
    //########################################################################################
 })
 
-function doCardClick(event, name, modelType) {
+// While the model lists are still being indexed in the background, poll the server so the lists fill in once ready
+onUiLoaded(function() {
+  function pollIndexing() {
+    // click the hidden poll button, it updates the status and the model lists
+    const pollButton = gradioApp().querySelector('#modelpreview_xd_indexing_poll');
+    if (typeof pollButton != "undefined" && pollButton != null) {
+      pollButton.click();
+    }
+  }
+  // the lists were created before indexing finished, so always poll once when the page loads
+  pollIndexing();
+  const pollInterval = setInterval(() => {
+    // the status element only carries the data-indexing attribute while a list is still being built
+    const indexingElement = gradioApp().querySelector('#modelpreview_xd_indexing_status [data-indexing]');
+    if (typeof indexingElement == "undefined" || indexingElement == null) {
+      clearInterval(pollInterval);
+      return;
+    }
+    pollIndexing();
+  }, 2000);
+})
+
+function doCardClick(event, name, modelType, hint = "") {
   // prevent the <a> tag from linking anywhere and prevent the default click action for clicking on a card
   event.stopPropagation();
   event.preventDefault();
@@ -289,10 +314,10 @@ function doCardClick(event, name, modelType) {
           typeof modelUpdate != "undefined" && modelUpdate != null &&
           typeof modelList != "undefined" && modelList != null) {
         
-        // only update the preview if its a different model
-        if(name != mp_cleanModelName(modelList.value)) {
-          // set the textarea's value
-          modelName.value = name;
+        // only update the preview if its a different model, if the card has a path or hash it could be a model with the same name in another folder
+        if(name != mp_cleanModelName(modelList.value) || hint != "") {
+          // set the textarea's value, the path and hash go on the next line
+          modelName.value = hint != "" ? `${name}\n${hint}` : name;
           
           // dispatch an event to trigger the gradio update for the textarea
           const inputEvent = new Event("input");
@@ -310,6 +335,21 @@ function doCardClick(event, name, modelType) {
   }
 }
 
+function mp_getCardHint(card) {
+  // get the path and hash of the model from the card, which of these the card has depends on the version of the webui
+  let hints = [];
+  card.querySelectorAll('.search_terms, .search_term').forEach(searchTerm => {
+    hints.push(searchTerm.textContent);
+  });
+  ['data-sort-path', 'data-path', 'data-hash'].forEach(attribute => {
+    let value = card.getAttribute(attribute);
+    if (typeof value != "undefined" && value != null) {
+      hints.push(value);
+    }
+  });
+  return hints.join(' ').replace(/\s+/g, ' ').trim();
+}
+
 function mp_cleanModelName(modelname) {
 	// Remove the extension and the hash if it exists at the end of the model name (this is added by a1111)
 	// If the model name contains a path (which happens when a checkpoint is in a subdirectory) just return the model name portion
@@ -329,12 +369,14 @@ function imageZoomIn(event) {
   
   // get the image that was clicked on
   const image = event.target;
+  // gallery images show a thumbnail, if there is one use the full size image for the overlay instead
+  const imageSrc = image.dataset.fullSrc || image.src;
   // create the overlay div to black out the rest of the website
   const overlay = document.createElement("div");
   // add styling to the overlay div
   overlay.style = "position: fixed; top: 0; left: 0; width: 100%; height: 100%; background: rgba(0, 0, 0, 0.9); z-index: 999;	transition: all 0.2s ease-in-out;	cursor: zoom-out;"
   // create a copy of the image in the overlay div
-  overlay.innerHTML = `<img src="${image.src}" style="width: 90%;	height: 90%; position: absolute;	top: 50%;	left: 50%; transform: translate(-50%, -50%);	object-fit: contain;">`;
+  overlay.innerHTML = `<img src="${imageSrc}" style="width: 90%;	height: 90%; position: absolute;	top: 50%;	left: 50%; transform: translate(-50%, -50%);	object-fit: contain;">`;
   // add an click event to the overlay that will delete the overlay when its clicked
   overlay.addEventListener("click", function() {
 		overlay.remove();
@@ -343,6 +385,52 @@ function imageZoomIn(event) {
   document.body.appendChild(overlay);
 }
 
+function mp_loadMoreImages(event) {
+  // load the next page of a gallery and put it in place of the button
+  const button = event.target;
+  if (button.disabled) {
+    return;
+  }
+  button.disabled = true;
+  const moreContainer = button.closest('.img-container-more');
+  fetch(button.dataset.moreSrc)
+    .then(response => {
+      if (!response.ok) {
+        throw new Error(`${response.status} ${response.statusText}`);
+      }
+      return response.text();
+    })
+    .then(pageHtml => {
+      // the page has the next images and a new button if there are still more
+      moreContainer.insertAdjacentHTML('beforebegin', pageHtml);
+      moreContainer.remove();
+    })
+    .catch(error => {
+      console.error('SD Model Preview unable to load more images', error);
+      button.disabled = false;
+    });
+}
+
+// load the next page of a gallery when its button is scrolled into view
+const mp_moreImagesObserver = typeof IntersectionObserver != "undefined" ? new IntersectionObserver(entries => {
+  entries.forEach(entry => {
+    if (entry.isIntersecting) {
+      mp_moreImagesObserver.unobserve(entry.target);
+      entry.target.click();
+    }
+  });
+}, { rootMargin: '200px' }) : null;
+
+onUiUpdate(function() {
+  if (mp_moreImagesObserver == null) {
+    return;
+  }
+  gradioApp().querySelectorAll('.modelpreview_xd_more_button:not([mp-observed])').forEach(button => {
+    button.setAttribute('mp-observed', 'true');
+    mp_moreImagesObserver.observe(button);
+  });
+})
+
 function copyToClipboard(x) {
   // used to copy prompts from .prompt files to clipboard
   navigator.clipboard.writeText(x.join(', '));
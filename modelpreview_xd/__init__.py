@@ -0,0 +1,25 @@
+"""
+The preview matching, indexing and rendering engine of SD Model Preview XD.
+
+Nothing here imports gradio or the webui. Every function is given the model folders, matching mode and model names
+it works on and returns plain data (strings, lists and dicts), so the engine can be used from scripts and worker
+processes as well as from the extension. scripts/modelpreview.py is the webui side: it reads the settings into the
+options (see get_options) and turns the results into gradio updates.
+
+	import modelpreview_xd
+
+	options = modelpreview_xd.get_options(name_matching="Strict")
+	html_code, md_text, txt_text, prompts = modelpreview_xd.get_preview("mymodel", ["models/Stable-diffusion"], options)
+"""
+from .catalog import build_preview_catalog, default_preview_catalog_path, load_preview_catalog
+from .civitai import civitai_cache_key_pattern, civitai_cache_route, create_civitai_info_html, get_civitai_cache_directory, sanitize_html
+from .diskcache import read_disk_cache
+from .filters import build_choice_map, build_filter_index, filter_choices, find_choice, get_fuzzy_index
+from .index import (check_preview_index, find_preview_files, get_mtime, get_preview_index, get_preview_index_generation, is_in_directory,
+	preview_index)
+from .names import clean_modelname, natural_order_number
+from .options import default_options, get_options
+from .render import (gallery_route, get_gallery_page, get_preview, get_preview_cache_info, get_rendered_preview_size, preview_file_route,
+	search_and_display_previews)
+from .tags import search_for_tags
+from .timing import get_timing_stats, label_request, record_bytes, timed_request, timing_span
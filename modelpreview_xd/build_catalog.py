@@ -0,0 +1,53 @@
+"""
+Build the preview catalog (see catalog.py) without starting the webui. Run it from the extension folder with
+
+	python -m modelpreview_xd.build_catalog
+
+passing the same --ckpt-dir, --lora-dir, ... options the webui is started with.
+"""
+import argparse
+import os
+import time
+
+from .catalog import build_preview_catalog, default_preview_catalog_path
+from .options import extension_directory
+
+def get_catalog_roots(args):
+	# the folders the extension looks for each type of model in, relative to the webui folder (see get_*_dirs in scripts/modelpreview.py)
+	# the paths must be given the same way the webui is given them since the catalog is keyed by the folder paths
+	roots = {}
+	model_dirs = {
+		"checkpoints": [os.path.join('models', 'Stable-diffusion')] + (args.ckpt_dir or []),
+		"embeddings": ['embeddings', os.path.join('models', 'embeddings')] + (args.embeddings_dir or []),
+		"hypernetworks": [os.path.join('models', 'hypernetworks')] + (args.hypernetwork_dir or []),
+		"loras": [os.path.join('models', 'Lora')] + (args.lora_dir or []) + [os.path.join('models', 'LyCORIS')],
+		"lycoris": [os.path.join('models', 'LyCORIS')] + (args.lyco_dir or []),
+	}
+	for model_type, dirs in model_dirs.items():
+		for dirpath in dirs:
+			if os.path.isdir(dirpath):
+				roots.setdefault(dirpath, []).append(model_type)
+	return roots
+
+def main():
+	parser = argparse.ArgumentParser(description="Build the SD Model Preview XD preview catalog so the extension starts without walking every model folder")
+	parser.add_argument("--webui", default=os.path.dirname(os.path.dirname(extension_directory)),
+		help="the webui folder, defaults to the folder the extension is installed in")
+	parser.add_argument("--output", default=default_preview_catalog_path, help="where to write the catalog")
+	parser.add_argument("--ckpt-dir", action="append", help="the webui --ckpt-dir, can be given more than once")
+	parser.add_argument("--embeddings-dir", action="append", help="the webui --embeddings-dir")
+	parser.add_argument("--hypernetwork-dir", action="append", help="the webui --hypernetwork-dir")
+	parser.add_argument("--lora-dir", action="append", help="the webui --lora-dir, add any other lora folders here as well")
+	parser.add_argument("--lyco-dir", action="append", help="the webui --lyco-dir")
+	args = parser.parse_args()
+
+	catalog_path = os.path.abspath(args.output)
+	# the model folders are relative to the webui folder the same way they are when the webui is running
+	os.chdir(args.webui)
+	roots = get_catalog_roots(args)
+	start = time.perf_counter()
+	file_count = build_preview_catalog(catalog_path, roots)
+	print(f"SD Model Preview cataloged {file_count} preview files in {len(roots)} model folders to {catalog_path} in {time.perf_counter() - start:.1f} s")
+
+if __name__ == "__main__":
+	main()
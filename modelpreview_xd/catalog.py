@@ -0,0 +1,256 @@
+"""
+The preview catalog: a SQLite database holding everything the extension learns by walking the model folders.
+
+It is built ahead of time by `python -m modelpreview_xd.build_catalog` (see build_catalog.py) and the extension reads it
+back when it starts, so only the folders that changed since are scanned again.
+"""
+import json
+import os
+import re
+import sqlite3
+import time
+
+from .civitai import civitai_info_cache_limit, read_civitai_info, seed_civitai_info
+from .images import get_image_info, image_info_cache_limit, seed_image_info
+from .index import (create_dir_entry, create_file_entry, create_root_index, find_preview_files, get_preview_index,
+	rebuild_preview_lookups, seed_preview_index)
+from .names import natural_order_number
+from .options import extension_directory
+from .tags import get_loose_owners, read_tags_file
+from .timing import timing_span
+
+# a catalog written with a different version of the tables (or of what is read into them) is ignored until it is built again
+catalog_schema_version = 4
+# where the catalog is written to and read from unless told otherwise
+default_preview_catalog_path = os.path.join(extension_directory, 'preview_catalog.sqlite')
+# the files that are models, used to list the models in each folder
+model_file_pattern = re.compile(r'(?i)\.(?:safetensors|ckpt|pt|bin)$')
+# the matched preview files of each model are saved for every matching mode
+catalog_matching_modes = ["Loose", "Strict", "Folder", "Index"]
+
+catalog_schema = """
+CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT);
+CREATE TABLE IF NOT EXISTS roots (path TEXT PRIMARY KEY, model_types TEXT, scanned_at REAL);
+CREATE TABLE IF NOT EXISTS dirs (root TEXT, path TEXT, mtime INTEGER, identity TEXT, subdirs TEXT, index_path TEXT, index_mtime INTEGER,
+	PRIMARY KEY (root, path));
+CREATE TABLE IF NOT EXISTS files (root TEXT, dir TEXT, position INTEGER, name TEXT, path TEXT, type TEXT, stem TEXT, mtime INTEGER,
+	PRIMARY KEY (root, dir, position));
+CREATE TABLE IF NOT EXISTS index_models (root TEXT, dir TEXT, position INTEGER, model TEXT, PRIMARY KEY (root, dir, position));
+CREATE INDEX IF NOT EXISTS index_models_model ON index_models (model);
+CREATE TABLE IF NOT EXISTS models (root TEXT, name TEXT, path TEXT, PRIMARY KEY (root, path));
+CREATE TABLE IF NOT EXISTS matches (root TEXT, mode TEXT, model TEXT, position INTEGER, path TEXT, generic INTEGER,
+	PRIMARY KEY (root, mode, model, position));
+CREATE TABLE IF NOT EXISTS tags (path TEXT PRIMARY KEY, mtime INTEGER, text TEXT);
+CREATE TABLE IF NOT EXISTS images (path TEXT PRIMARY KEY, mtime INTEGER, size INTEGER, format TEXT, width INTEGER, height INTEGER,
+	prompt TEXT);
+CREATE TABLE IF NOT EXISTS civitai (path TEXT PRIMARY KEY, mtime INTEGER, size INTEGER, name TEXT, version_id INTEGER, model_id INTEGER,
+	model_name TEXT, model_type TEXT, base_model TEXT, trained_words TEXT, nsfw INTEGER, image_urls TEXT, data TEXT);
+"""
+# every table filled in by build_preview_catalog, emptied before it is written again
+catalog_tables = ["roots", "dirs", "files", "index_models", "models", "matches", "tags", "images", "civitai"]
+
+def open_preview_catalog(catalog_path):
+	# open the catalog, creating its tables if needed
+	# write-ahead logging lets the extension read the catalog while it is being built again
+	connection = sqlite3.connect(catalog_path)
+	connection.execute("PRAGMA journal_mode=WAL")
+	connection.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)")
+	version = connection.execute("SELECT value FROM meta WHERE key = 'schema_version'").fetchone()
+	if version is not None and version[0] != str(catalog_schema_version):
+		# the tables of a catalog built by a different version may not have the same columns so start over
+		for table in catalog_tables:
+			connection.execute(f"DROP TABLE IF EXISTS {table}")
+	connection.executescript(catalog_schema)
+	return connection
+
+def read_civitai_fields(file_path):
+	# read the fields of a civitai.info file worth looking up without opening the file, and its whole contents for the extension's cache
+	try:
+		data = read_civitai_info(file_path)
+	except (OSError, ValueError) as e:
+		print(f"SD Model Preview could not read {file_path} for the catalog: {e}")
+		return None
+	if not isinstance(data, dict):
+		return None
+	model = data.get('model') if isinstance(data.get('model'), dict) else {}
+	image_urls = [image.get('url') for image in data.get('images') or [] if isinstance(image, dict)]
+	return (data.get('name'), data.get('id'), data.get('modelId'), model.get('name'), model.get('type'), data.get('baseModel'),
+		json.dumps(data.get('trainedWords') or []), int(bool(model.get('nsfw'))), json.dumps(image_urls), json.dumps(data))
+
+def list_model_names(dirpath):
+	# the names of the model files in a folder, the same names the extension cleans the model titles down to
+	try:
+		filenames = os.listdir(dirpath)
+	except OSError:
+		return []
+	return [(os.path.splitext(filename)[0], os.path.join(dirpath, filename))
+		for filename in sorted(filenames, key=natural_order_number) if model_file_pattern.search(filename)]
+
+def find_loose_matches(root_index, model_names):
+	# match every file to the models whose names are part of the file name
+	# going from the files to the models is far faster than searching all the files once per model
+	owners_by_name = {name: [name] for name in model_names if len(name) > 0}
+	name_lengths = sorted(set(len(name) for name in owners_by_name))
+	matches = {}
+	for dir_entry in root_index["ordered_dirs"]:
+		for file_entry in dir_entry["files"]:
+			for owner in dict.fromkeys(get_loose_owners(file_entry["stem"], owners_by_name, name_lengths)):
+				matches.setdefault(owner, []).append((file_entry, False))
+	return matches
+
+def write_catalog_root(connection, root, model_types):
+	# scan a model folder and write everything found in it, returns the number of preview files written
+	root_index = get_preview_index(root, force_check=True)
+	connection.execute("INSERT OR REPLACE INTO roots VALUES (?, ?, ?)", (root, ",".join(model_types), time.time()))
+	model_names = {}
+	file_count = 0
+	for dir_entry in root_index["ordered_dirs"]:
+		dirpath = dir_entry["path"]
+		# the identity is saved as text since inode numbers can be too big for an sqlite integer
+		identity = json.dumps(dir_entry["identity"]) if dir_entry["identity"] is not None else None
+		connection.execute("INSERT INTO dirs VALUES (?, ?, ?, ?, ?, ?, ?)",
+			(root, dirpath, dir_entry["mtime"], identity, json.dumps(dir_entry["subdirs"]), dir_entry["index_path"], dir_entry["index_mtime"]))
+		if dir_entry["index_models"] is not None:
+			connection.executemany("INSERT INTO index_models VALUES (?, ?, ?, ?)",
+				[(root, dirpath, position, model) for position, model in enumerate(dir_entry["index_models"])])
+		for position, file_entry in enumerate(dir_entry["files"]):
+			file_path = file_entry["path"]
+			connection.execute("INSERT INTO files VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+				(root, dirpath, position, file_entry["name"], file_path, file_entry["type"], file_entry["stem"], file_entry["mtime"]))
+			file_count += 1
+			if file_entry["type"] == "tags":
+				try:
+					connection.execute("INSERT OR REPLACE INTO tags VALUES (?, ?, ?)", (file_path, file_entry["mtime"], read_tags_file(file_entry)))
+				except (OSError, UnicodeDecodeError) as e:
+					print(f"SD Model Preview could not read {file_path} for the catalog: {e}")
+			elif file_entry["type"] == "img":
+				try:
+					file_stat = os.stat(file_path)
+				except OSError:
+					continue
+				info = get_image_info(file_path)
+				connection.execute("INSERT OR REPLACE INTO images VALUES (?, ?, ?, ?, ?, ?, ?)",
+					(file_path, file_stat.st_mtime_ns, file_stat.st_size, info["format"], info["width"], info["height"], info["prompt"]))
+			elif file_entry["type"] == "civitai":
+				try:
+					file_stat = os.stat(file_path)
+				except OSError:
+					continue
+				fields = read_civitai_fields(file_path)
+				if fields is not None:
+					connection.execute("INSERT OR REPLACE INTO civitai VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+						(file_path, file_stat.st_mtime_ns, file_stat.st_size) + fields)
+		for model_name, model_path in list_model_names(dirpath):
+			connection.execute("INSERT OR REPLACE INTO models VALUES (?, ?, ?)", (root, model_name, model_path))
+			model_names[model_name] = None
+
+	# save which preview files each model matches in every matching mode
+	for matching_mode in catalog_matching_modes:
+		if matching_mode == "Loose":
+			matches = find_loose_matches(root_index, model_names)
+		else:
+			matches = {model_name: find_preview_files(model_name, [root], matching_mode) for model_name in model_names}
+		connection.executemany("INSERT INTO matches VALUES (?, ?, ?, ?, ?, ?)",
+			[(root, matching_mode, model_name, position, file_entry["path"], int(generic))
+			for model_name, files in matches.items() for position, (file_entry, generic) in enumerate(files)])
+	return file_count
+
+@timing_span("catalog_build")
+def build_preview_catalog(catalog_path, roots):
+	# write the catalog for `roots`, a dict of the model folders and the model types found in each
+	# returns the number of preview files written
+	connection = open_preview_catalog(catalog_path)
+	try:
+		file_count = 0
+		# write everything in one transaction so the extension never reads a half written catalog
+		with connection:
+			for table in catalog_tables:
+				connection.execute(f"DELETE FROM {table}")
+			connection.execute("INSERT OR REPLACE INTO meta VALUES ('schema_version', ?)", (str(catalog_schema_version),))
+			for root, model_types in roots.items():
+				file_count += write_catalog_root(connection, root, model_types)
+		return file_count
+	finally:
+		connection.close()
+
+def read_catalog_root(connection, root):
+	# rebuild the preview index of a root from the catalog, returns None if the root isn't in the catalog
+	dir_rows = connection.execute("SELECT path, mtime, identity, subdirs, index_path, index_mtime FROM dirs WHERE root = ?", (root,)).fetchall()
+	if len(dir_rows) == 0:
+		return None
+	index_models = {}
+	for dirpath, model in connection.execute("SELECT dir, model FROM index_models WHERE root = ? ORDER BY dir, position", (root,)):
+		index_models.setdefault(dirpath, []).append(model)
+	# only use the text of tags files that haven't changed since it was saved
+	tags_texts = dict(connection.execute("SELECT tags.path, tags.text FROM files JOIN tags ON tags.path = files.path AND tags.mtime = files.mtime "
+		"WHERE files.root = ? AND files.type = 'tags'", (root,)))
+
+	root_index = create_root_index(root)
+	for dirpath, mtime, identity, subdirs, index_path, index_mtime in dir_rows:
+		dir_entry = create_dir_entry(dirpath, mtime)
+		if identity is not None:
+			dir_entry["identity"] = tuple(json.loads(identity))
+		dir_entry["subdirs"] = json.loads(subdirs)
+		if index_path is not None:
+			dir_entry["index_path"] = index_path
+			dir_entry["index_mtime"] = index_mtime
+			dir_entry["index_models"] = index_models.get(dirpath, [])
+		root_index["dirs"][dirpath] = dir_entry
+	for dirpath, filename, file_path, preview_type, stem, mtime in connection.execute(
+		"SELECT dir, name, path, type, stem, mtime FROM files WHERE root = ? ORDER BY dir, position", (root,)):
+		dir_entry = root_index["dirs"].get(dirpath)
+		if dir_entry is None:
+			continue
+		file_entry = create_file_entry(dir_entry, filename, file_path, preview_type, stem, mtime)
+		if file_path in tags_texts:
+			file_entry["text"] = tags_texts[file_path]
+		dir_entry["files"].append(file_entry)
+	rebuild_preview_lookups(root_index)
+
+	# the loose matches of the models in the root, so the first loose lookup of a model doesn't search every file
+	# (they are thrown away with the rest of the lookups if any folder changed since the catalog was built)
+	file_entries = {file_entry["path"]: file_entry for dir_entry in root_index["ordered_dirs"] for file_entry in dir_entry["files"]}
+	loose_lookup = root_index["loose"]
+	for (model_name,) in connection.execute("SELECT DISTINCT name FROM models WHERE root = ?", (root,)):
+		loose_lookup[model_name] = []
+	for model_name, file_path in connection.execute("SELECT model, path FROM matches WHERE root = ? AND mode = 'Loose' ORDER BY model, position", (root,)):
+		if model_name in loose_lookup and file_path in file_entries:
+			loose_lookup[model_name].append(file_entries[file_path])
+	return root_index
+
+def read_catalog_caches(connection, root):
+	# fill the image info and civitai.info caches with what the catalog read from the files of a root
+	# so the first previews after a restart don't read every image header and civitai.info file again
+	# the entries are keyed by the modified time and size of each file so a file changed since then is read again
+	seed_image_info(((file_path, mtime, size, {"format": image_format, "width": width, "height": height, "prompt": prompt})
+		for file_path, mtime, size, image_format, width, height, prompt in connection.execute(
+		"SELECT images.path, images.mtime, images.size, images.format, images.width, images.height, images.prompt FROM files "
+		"JOIN images ON images.path = files.path WHERE files.root = ? AND files.type = 'img' LIMIT ?", (root, image_info_cache_limit))))
+	seed_civitai_info(((file_path, mtime, size, json.loads(data)) for file_path, mtime, size, data in connection.execute(
+		"SELECT civitai.path, civitai.mtime, civitai.size, civitai.data FROM files "
+		"JOIN civitai ON civitai.path = files.path WHERE files.root = ? AND files.type = 'civitai' LIMIT ?", (root, civitai_info_cache_limit))))
+
+@timing_span("catalog_load")
+def load_preview_catalog(catalog_path, roots):
+	# seed the preview index of each root from the catalog, the folders that changed since it was built are scanned again
+	# returns the number of roots read from the catalog
+	if not os.path.isfile(catalog_path):
+		return 0
+	loaded = 0
+	try:
+		connection = sqlite3.connect(catalog_path)
+		try:
+			version = connection.execute("SELECT value FROM meta WHERE key = 'schema_version'").fetchone()
+			if version is None or version[0] != str(catalog_schema_version):
+				print(f"SD Model Preview ignored {catalog_path} because it was built by a different version, build it again to use it")
+				return 0
+			for root in roots:
+				root_index = read_catalog_root(connection, root)
+				if root_index is not None and seed_preview_index(root, root_index):
+					read_catalog_caches(connection, root)
+					loaded += 1
+		finally:
+			connection.close()
+	except sqlite3.Error as e:
+		print(f"SD Model Preview could not read the catalog {catalog_path}: {e}")
+	return loaded
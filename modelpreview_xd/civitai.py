@@ -0,0 +1,458 @@
+import base64
+import concurrent.futures
+import hashlib
+import json
+import os
+import re
+import threading
+from collections import OrderedDict
+from io import BytesIO
+
+import requests
+import requests.adapters
+from PIL import Image
+
+from .diskcache import get_disk_cache, read_disk_cache, write_disk_cache
+from .timing import timing_span
+
+# the Cleaner instance with specific options for sanitization, it is created the first time html is sanitized
+# so the engine can be imported without lxml
+cleaner = None
+
+def get_cleaner():
+	global cleaner
+	if cleaner is None:
+		from lxml_html_clean.clean import Cleaner
+		cleaner = Cleaner(
+		    safe_attrs_only=True,  # Only allow safe attributes
+		    host_whitelist=set(['www.youtube.com'])
+		)
+	return cleaner
+
+def clean_html_content(html_content):
+    # check if the HTML content is empty, if so we dont have to do anything, return an empty string
+    if html_content is None or not html_content.strip():
+        return ""
+
+    # check if the entire HTML string is surrounded in comment tags (This is done by some civitai extensions)
+    if html_content.strip().startswith('<!--') and html_content.strip().endswith('-->'):
+        # Remove the comment tags
+        html_content = html_content.strip()[4:-3].strip()
+
+    try:
+        # clean the HTML content using the global Cleaner instance
+        cleaned_html = get_cleaner().clean_html(html_content)
+    except Exception as e:
+        # if there is an error cleaning the HTML, return "Unable to parse HTML"
+        return "Unable to parse HTML"
+
+	# return the cleaned HTML
+    return cleaned_html
+
+# the sanitized html of descriptions that were seen before, keyed by a hash of the html before it was sanitized
+# recently used results are kept in memory and all results are saved to a folder so they survive restarts
+sanitize_cache = OrderedDict()
+sanitize_cache_lock = threading.Lock()
+sanitize_cache_limit = 256
+sanitize_cache_max_size = 32 * 1024 * 1024
+# change this when the cleaner options change so html sanitized with the old options isn't used
+sanitize_cache_version = 1
+
+@timing_span("sanitize_html")
+def sanitize_html(html_content, cache_directory=None):
+	# sanitize html with the cleaner, each distinct piece of html is only parsed once
+	# the results are also saved to the sanitize_cache folder in `cache_directory` if it is given
+	if html_content is None or not html_content.strip():
+		return ""
+	cache_key = hashlib.sha256(f'{sanitize_cache_version}|{html_content}'.encode("utf8", "surrogatepass")).hexdigest()
+	with sanitize_cache_lock:
+		cleaned_html = sanitize_cache.get(cache_key)
+		if cleaned_html is not None:
+			sanitize_cache.move_to_end(cache_key)
+			return cleaned_html
+
+	# check the results saved by earlier sessions before parsing the html
+	cleaned_html = None
+	sanitize_cache_directory = os.path.join(cache_directory, 'sanitize_cache') if cache_directory is not None else None
+	data_path, _ = read_disk_cache(sanitize_cache_directory, cache_key) if sanitize_cache_directory is not None else (None, None)
+	if data_path is not None:
+		try:
+			with open(data_path, "rb") as f:
+				cleaned_html = f.read().decode("utf8", "surrogatepass")
+		except (OSError, UnicodeDecodeError):
+			cleaned_html = None
+	if cleaned_html is None:
+		cleaned_html = clean_html_content(html_content)
+		if sanitize_cache_directory is not None:
+			try:
+				write_disk_cache(sanitize_cache_directory, cache_key, cleaned_html.encode("utf8", "surrogatepass"), {"length": len(html_content)}, sanitize_cache_max_size)
+			except OSError as e:
+				print(f"SD Model Preview unable to save sanitized html to the cache: {e}")
+
+	with sanitize_cache_lock:
+		sanitize_cache[cache_key] = cleaned_html
+		sanitize_cache.move_to_end(cache_key)
+		while len(sanitize_cache) > sanitize_cache_limit:
+			sanitize_cache.popitem(last=False)
+	return cleaned_html
+
+def extract_civitai_image_key(url):
+    pattern = r"https?://(?:image(?:cache)?\.civitai\.com)/xG1nkqKTMzGDvpLrqFT7WA/([a-f0-9-]+)"
+    match = re.match(pattern, url)
+    if match:
+        return match.group(1)
+    return None
+
+# images from .civitai.info files are downloaded by a small pool of threads sharing one session so connections are reused
+civitai_fetch_workers = 4
+# seconds to wait for a single image request
+civitai_request_timeout = 10
+# seconds to wait for all the images of a preview before using the remote URLs for the ones that aren't ready
+civitai_fetch_deadline = 5
+civitai_executor = concurrent.futures.ThreadPoolExecutor(max_workers=civitai_fetch_workers, thread_name_prefix="sd-model-preview-xd")
+civitai_session = None
+civitai_session_lock = threading.Lock()
+# downloads that are still running, so viewing a preview again doesn't start the same download twice
+civitai_pending_fetches = {}
+civitai_pending_fetches_lock = threading.Lock()
+
+def get_civitai_session():
+	# create the shared session the first time it is needed
+	global civitai_session
+	with civitai_session_lock:
+		if civitai_session is None:
+			civitai_session = requests.Session()
+			# keep enough connections open for every worker
+			adapter = requests.adapters.HTTPAdapter(pool_connections=civitai_fetch_workers, pool_maxsize=civitai_fetch_workers)
+			civitai_session.mount("http://", adapter)
+			civitai_session.mount("https://", adapter)
+		return civitai_session
+
+def download_image(url, session=None, timeout=None):
+	# download an image and return its bytes, or None if the download failed
+	session = session if session is not None else get_civitai_session()
+	try:
+		response = session.get(url, timeout=timeout if timeout is not None else civitai_request_timeout)
+	except requests.RequestException as e:
+		print(f"SD Model Preview unable to download {url}: {e}")
+		return None
+	# Check if the request was successful
+	if response.status_code != 200:
+		return None
+	return response.content
+
+def fetch_concurrently(urls, fetch_fn, fetch_args=(), deadline=None):
+	# run fetch_fn(url, *fetch_args) for each url on the thread pool and return {url: result} for the ones that finish before the deadline
+	# fetches that don't finish in time keep running in the background so their result is ready the next time
+	futures = {}
+	started_fetches = []
+	with civitai_pending_fetches_lock:
+		for url in dict.fromkeys(urls):
+			future = civitai_pending_fetches.get((fetch_fn, fetch_args, url))
+			if future is None:
+				future = civitai_executor.submit(fetch_fn, url, *fetch_args)
+				civitai_pending_fetches[(fetch_fn, fetch_args, url)] = future
+				started_fetches.append(((fetch_fn, fetch_args, url), future))
+			futures[future] = url
+	# a fetch that already finished calls its callback right away, and the callback takes the lock, so add them after it is released
+	for key, future in started_fetches:
+		future.add_done_callback(lambda _, key=key: remove_pending_fetch(key))
+	done, _ = concurrent.futures.wait(futures, timeout=deadline if deadline is not None else civitai_fetch_deadline)
+	results = {}
+	for future in done:
+		try:
+			results[futures[future]] = future.result()
+		except Exception as e:
+			print(f"SD Model Preview unable to fetch {futures[future]}: {e}")
+	return results
+
+def remove_pending_fetch(key):
+	with civitai_pending_fetches_lock:
+		civitai_pending_fetches.pop(key, None)
+
+# the route images from .civitai.info previews are served from
+civitai_cache_route = "/sd-model-preview-xd/civitai/"
+civitai_cache_key_pattern = re.compile(r'^[a-f0-9-]+$')
+# the cache folders that were checked for images saved by older versions
+civitai_cache_migrated = set()
+# set while rendering a preview if part of it isn't final yet, like a .civitai.info image still downloading
+preview_render_state = threading.local()
+
+def get_civitai_cache_directory(options):
+	# the folder images from .civitai.info previews are cached to
+	return os.path.join(options["cache_directory"], 'civit_cache')
+
+def get_civitai_cache_max_size(options):
+	# the option is in megabytes
+	return int(options["civitai_cache_size"]) * 1024 * 1024
+
+def migrate_civitai_cache(civitai_cache_directory, max_size):
+	# older versions saved each image as a base64 data uri in a text file named after its key, convert them to the binary cache
+	if civitai_cache_directory in civitai_cache_migrated:
+		return
+	civitai_cache_migrated.add(civitai_cache_directory)
+	if not os.path.isdir(civitai_cache_directory):
+		return
+	disk_cache = get_disk_cache(civitai_cache_directory)
+	for filename in os.listdir(civitai_cache_directory):
+		old_path = os.path.join(civitai_cache_directory, filename)
+		if not civitai_cache_key_pattern.match(filename) or not os.path.isfile(old_path):
+			continue
+		try:
+			with open(old_path, "r") as f:
+				data_uri = f.read()
+			with disk_cache["lock"]:
+				disk_cache["size"] -= os.path.getsize(old_path)
+				os.remove(old_path)
+			header, _, base64_data = data_uri.partition(",")
+			content_type = header[len("data:"):].split(";")[0].lower()
+			write_disk_cache(civitai_cache_directory, filename, base64.b64decode(base64_data), {"content_type": content_type}, max_size)
+		except (OSError, ValueError) as e:
+			print(f"SD Model Preview unable to convert cached image {old_path}: {e}")
+
+def get_civitai_image_key(url):
+	# get the key the image is cached under, or None if the image can't be cached
+	image_key = extract_civitai_image_key(url)
+	if image_key is None or not civitai_cache_key_pattern.match(image_key):
+		# Can't find the image key, the given url isn't in an expected form
+		return None
+	return image_key
+
+def get_civitai_cache_url(image_key):
+	# the link is relative so it works if the webui is served from a subpath
+	return civitai_cache_route.lstrip("/") + image_key
+
+def cache_civitai_image(url, civitai_cache_directory, max_size):
+	# download an image and save it to the cache, returns the link to the cached image or None if it couldn't be downloaded
+	image_key = get_civitai_image_key(url)
+	image_data = download_image(url)
+	if image_data is None:
+		return None
+
+	try:
+		# Attempt to open the image using PIL
+		image = Image.open(BytesIO(image_data))
+	except Image.UnidentifiedImageError:
+		# If the image format is not recognized, don't cache it
+		return None
+
+	# Determine the image type
+	content_type = Image.MIME.get(image.format, "image/png") if image.format else "image/png"
+
+	try:
+		write_disk_cache(civitai_cache_directory, image_key, image_data, {"url": url, "content_type": content_type}, max_size)
+	except OSError as e:
+		print(f"SD Model Preview unable to cache image {url}: {e}")
+		return None
+
+	print(f"SD Model Preview caching image {image_key}")
+
+	# the image may have been removed right away if it is bigger than the cache
+	if read_disk_cache(civitai_cache_directory, image_key)[0] is None:
+		return None
+	return get_civitai_cache_url(image_key)
+
+@timing_span("civitai_images")
+def get_civitai_image_srcs(urls, options):
+	# get the src to use for each image url, returns {url: src}
+	# Only cache the images if setting is on
+	if not options["cache_images_civitai_info"]:
+		return {url: url for url in urls}
+
+	civitai_cache_directory = get_civitai_cache_directory(options)
+	max_size = get_civitai_cache_max_size(options)
+	migrate_civitai_cache(civitai_cache_directory, max_size)
+	image_srcs = {}
+	urls_to_download = []
+	for url in urls:
+		image_key = get_civitai_image_key(url)
+		if image_key is None:
+			# the url isn't in an expected form, just use the input URL
+			image_srcs[url] = url
+		elif read_disk_cache(civitai_cache_directory, image_key)[0] is not None:
+			# the image is cached, link to it
+			image_srcs[url] = get_civitai_cache_url(image_key)
+		else:
+			urls_to_download.append(url)
+
+	# download the missing images at the same time, any that aren't ready in time use the remote URL
+	downloaded_images = fetch_concurrently(urls_to_download, cache_civitai_image, (civitai_cache_directory, max_size))
+	for url in urls_to_download:
+		image_srcs[url] = downloaded_images.get(url)
+		if image_srcs[url] is None:
+			image_srcs[url] = url
+			# the image may still be downloading, so the preview shouldn't be kept with the remote URL
+			preview_render_state.complete = False
+	return image_srcs
+
+# the parsed contents of civitai.info files, keyed by path and used until the file's modified time or size changes
+# the cache can also be filled from the preview catalog when the extension starts
+civitai_info_cache = OrderedDict()
+civitai_info_cache_lock = threading.Lock()
+civitai_info_cache_limit = 256
+
+def store_civitai_info(file, cache_key, data):
+	with civitai_info_cache_lock:
+		civitai_info_cache[file] = (cache_key, data)
+		civitai_info_cache.move_to_end(file)
+		while len(civitai_info_cache) > civitai_info_cache_limit:
+			civitai_info_cache.popitem(last=False)
+
+def read_civitai_info(file):
+	# read a civitai.info file, parsing it only if it changed since it was last read
+	# returns None if the file doesn't exist, the contents are shared with the cache so they must not be changed
+	try:
+		file_stat = os.stat(file)
+	except OSError:
+		return None
+	cache_key = (file_stat.st_mtime_ns, file_stat.st_size)
+	with civitai_info_cache_lock:
+		cached = civitai_info_cache.get(file)
+		if cached is not None and cached[0] == cache_key:
+			civitai_info_cache.move_to_end(file)
+			return cached[1]
+	with open(file, 'r', encoding='utf8') as f:
+		data = json.load(f)
+	store_civitai_info(file, cache_key, data)
+	return data
+
+def seed_civitai_info(civitai_infos):
+	# fill the cache with civitai.info contents read ahead of time, given as (path, modified time in ns, size, contents)
+	for file, mtime, size, data in civitai_infos:
+		store_civitai_info(file, (mtime, size), data)
+
+@timing_span("civitai_info_html")
+def create_civitai_info_html(file, options):
+	# read the civitai.info file, copying the contents since the descriptions are replaced below
+	data = dict(read_civitai_info(file) or {})
+
+	# Sanitize the HTML content of the description properties
+	data['description'] = sanitize_html(data.get('description', ''), options["cache_directory"])
+	if 'model' in data:
+		data['model'] = dict(data['model'])
+		data['model']['description'] = sanitize_html(data['model'].get('description', ''), options["cache_directory"])
+
+	# build the html
+	civitai_info_html = [f"""<div class='civitai-info'>
+	<h1 id="ci-name">{data.get('name','')}</h1>
+	<ul>
+    <li><strong>ID:</strong> <span id="ci-id">{data.get('id','')}</span></li>
+    <li><strong>Model ID:</strong> <a id="ci-modelId" href="https://civitai.com/models/{data.get('modelId','')}" target="_blank">{data.get('modelId','')}</a></li>
+    <li><strong>Created At:</strong> <span id="ci-createdAt">{data.get('createdAt','')}</span></li>
+    <li><strong>Updated At:</strong> <span id="ci-updatedAt">{data.get('updatedAt','')}</span></li>
+    <li><strong>Base Model:</strong> <span id="ci-baseModel">{data.get('baseModel','')}</span></li>
+	<li><strong>Trained Words:</strong> <span id="ci-trainedWords">{"None Specified" if (not data.get('trainedWords',None) or len(data.get('trainedWords',[])) == 0) else "<ul><li>" + "</li><li>".join(data.get('trainedWords',[])) + "</li></ul>"}</span></li>
+    <li><strong>Early Access Time Frame:</strong> <span id="ci-earlyAccessTimeFrame">{data.get('earlyAccessTimeFrame','')}</span></li>
+    </ul>
+	<details open>
+		<summary><strong>Description:</strong></summary>
+    	<div id="ci-description" class="description">{data.get('description','')}</div>
+	</details>
+	<details>
+  		<summary><strong>Stats:</strong></summary>
+		<ul>
+			<li><strong>Download Count:</strong> <span id="ci-downloadCount">{data.get('stats',{}).get('downloadCount','')}</span></li>
+			<li><strong>Rating Count:</strong> <span id="ci-ratingCount"{data.get('stats',{}).get('ratingCount','')}></span></li>
+			<li><strong>Rating:</strong> <span id="ci-rating">{data.get('stats',{}).get('rating','')}</span></li>
+		</ul>
+	</details>
+	<details>
+  		<summary><strong>Model Information:</strong></summary>
+		<ul>
+			<li><strong>Name:</strong> <span id="ci-modelName">{data.get('model',{}).get('name','')}</span></li>
+			<li><strong>Type:</strong> <span id="ci-modelType">{data.get('model',{}).get('type','')}</span></li>
+			<li><strong>NSFW:</strong> <span id="ci-modelNsfw">{data.get('model',{}).get('nsfw','')}</span></li>
+			<li><strong>POI:</strong> <span id="ci-modelPoi">{data.get('model',{}).get('poi','')}</span></li>
+			<li><strong>Description:</strong> <div id="ci-modelDescription" class="description">{data.get('model',{}).get('description','')}</div></li>
+		</ul>
+	</details>
+	<details>
+		<summary><strong>Files:</strong></summary>
+	"""]
+
+	for i, data_file in enumerate(data.get('files',[])):
+		civitai_info_html.append(f"""<details>
+			<summary><strong id="ci-fileName-{i}">{data_file.get('name','')}</strong></summary>
+			<ul>
+				<li><strong>ID:</strong> <span id="ci-fileId-{i}">{data_file.get('id','')}</span></li>
+				<li><strong>Size (KB):</strong> <span id="ci-fileSizeKB-{i}">{data_file.get('sizeKB','')}</span></li>
+				<li><strong>Type:</strong> <span id="ci-fileType-{i}">{data_file.get('type','')}</span></li>
+				<li><strong>Format:</strong> <span id="ci-fileFormat-{i}">{data_file.get('metadata',{}).get('format','')}</span></li>
+				<li><strong>Fp:</strong> <span id="ci-fileFp-{i}">{data_file.get('metadata',{}).get('fp','')}</span></li>
+				<li><strong>Size:</strong> <span id="ci-fileSize-{i}">{data_file.get('metadata',{}).get('size','')}</span></li>
+				<li><strong>Pickle Scan Result:</strong> <span id="ci-pickleScanResult-{i}">{data_file.get('pickleScanResult','')}</span></li>
+				<li><strong>Pickle Scan Message:</strong> <span id="ci-pickleScanMessage-{i}">{data_file.get('pickleScanMessage','')}</span></li>
+				<li><strong>Virus Scan Result:</strong> <span id="ci-virusScanResult-{i}">{data_file.get('virusScanResult','')}</span></li>
+				<li><strong>Scanned At:</strong> <span id="ci-scannedAt-{i}">{data_file.get('scannedAt','')}</span></li>
+				<li><strong>Download URL:</strong> <a id="ci-downloadUrl-{i}" href="{data_file.get('downloadUrl','')}" target="_blank">{data_file.get('downloadUrl','')}</a></li>
+			</ul>
+		</details>
+		""")
+
+	civitai_info_html.append("""</details>
+		<br>
+		<div id="ci-images" class="img-container-set">
+		""")
+
+	# get all the images at once so any that need to be downloaded are downloaded at the same time
+	image_srcs = get_civitai_image_srcs([image.get('url','') for image in data.get('images',[])], options)
+	
+	for i, image in enumerate(data.get('images',[])):
+
+		# Get the meta data object from the image
+		meta_data = image.get('meta', None)
+
+		# Initialize html meta list as not found incase its empty
+		meta_list_items = "<li>No Meta Data Found</li>"
+
+		image_url = image_srcs[image.get('url','')]
+
+		civitai_info_html.append(f"""<div class='img-prop-container'><div class='img-container'>
+			<img id="ci-image-{i}" src="{image_url}" onclick="imageZoomIn(event)" />
+			""")
+
+		# if there is prompt/meta data
+		if meta_data:
+			# Create the HTML list of all the meta data keys
+			meta_list_items = "\n".join([f"<li><strong>{key}:</strong> {meta_data.get(key,'')}</li>" for key in meta_data])
+
+			# Build the meta data string that will be copied when you press the copy button
+			meta_tags = list(meta_data.keys())
+			meta_out = []
+			if "prompt" in meta_tags:
+				meta_out.append(f"{image['meta']['prompt']}\n")
+			if "negativePrompt" in meta_tags:
+				meta_out.append(f"Negative prompt: {image['meta']['negativePrompt']}\n")
+			for i, tag in enumerate(meta_tags):
+				if tag == "cfgScale":
+					# Add the cfgScale meta data to the output string
+					meta_out.append(f"CFG scale: {image['meta']['cfgScale']}, ")
+				elif tag != "prompt" and tag != "negativePrompt" and tag != "resources" and tag != "hashes":
+					# Add the other meta data to the output string, convert the tag to Proper case
+					meta_out.append(re.sub(r'\b\w', lambda x: x.group(0).upper(), tag, count=1) + ": " + str(image['meta'][tag]) + ", ")
+			# Remove any trailing commas or whitespace
+			meta_out_string = "".join(meta_out).rstrip(", ")
+
+			# Add the button and an invisible textarea that will let you copy the meta data as a prompt
+			if meta_out_string.strip() != "":
+				civitai_info_html.append('<div class="img-meta-ico" title="Copy Metadata" onclick="metaDataCopy(event)"></div>')
+				civitai_info_html.append(f'<textarea class="img-meta">{meta_out_string}</textarea>')
+
+		civitai_info_html.append(f"""</div>
+			<details class='img-properties-list'>
+				<summary><strong>Properties:</strong></summary>
+				<ul>
+					<li><strong>URL:</strong> <a id="ci-image-URL-{i}" href="{image.get('url','')}" target="_blank">{image.get('url','')}</a></li>
+					<li><strong>NSFW:</strong> <span id="ci-image-nsfw-{i}">{image.get('nsfw','')}</span></li>
+					<li><strong>Meta:</strong>
+						<ul id="ci-image-meta-{i}">
+							{meta_list_items}
+						</ul>
+					</li>
+				</ul>
+			</details>
+		</div>
+		""")
+
+	civitai_info_html.append("</div></div>")
+	return "".join(civitai_info_html)
@@ -0,0 +1,95 @@
+import json
+import os
+import tempfile
+import threading
+
+# the on-disk caches written by the extension, keyed by their folder, along with the total size of the files in them
+disk_caches = {}
+disk_caches_lock = threading.Lock()
+
+def get_disk_cache(cache_directory):
+	# get the state of a cache folder, adding up the size of its files the first time it is used
+	with disk_caches_lock:
+		disk_cache = disk_caches.get(cache_directory)
+		if disk_cache is None:
+			os.makedirs(cache_directory, exist_ok=True)
+			total_size = 0
+			with os.scandir(cache_directory) as cache_entries:
+				for cache_entry in cache_entries:
+					if cache_entry.is_file():
+						total_size += cache_entry.stat().st_size
+			disk_cache = {"lock": threading.Lock(), "size": total_size, "evictions": 0}
+			disk_caches[cache_directory] = disk_cache
+		return disk_cache
+
+def read_disk_cache(cache_directory, key):
+	# get the path to the data of a cache entry and its metadata, or (None, None) if the entry doesn't exist
+	data_path = os.path.join(cache_directory, key + ".bin")
+	metadata_path = os.path.join(cache_directory, key + ".json")
+	try:
+		with open(metadata_path, "r", encoding="utf8") as f:
+			metadata = json.load(f)
+		if not os.path.isfile(data_path):
+			return None, None
+		# touch the metadata file so the modified time records when the entry was last used
+		os.utime(metadata_path)
+	except (OSError, ValueError):
+		return None, None
+	return data_path, metadata
+
+def write_file_atomically(path, data):
+	# write to a temporary file in the same folder and then move it into place so nothing reads a half written file
+	file_descriptor, temp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+	try:
+		with os.fdopen(file_descriptor, "wb") as f:
+			f.write(data)
+		os.replace(temp_path, path)
+	except OSError:
+		if os.path.exists(temp_path):
+			os.remove(temp_path)
+		raise
+
+def write_disk_cache(cache_directory, key, data, metadata, max_size):
+	# add an entry to the cache and remove the least recently used entries if the cache is larger than max_size bytes
+	disk_cache = get_disk_cache(cache_directory)
+	data_path = os.path.join(cache_directory, key + ".bin")
+	metadata_path = os.path.join(cache_directory, key + ".json")
+	metadata_bytes = json.dumps(metadata).encode("utf8")
+	with disk_cache["lock"]:
+		# don't count an entry twice if it is being replaced
+		for path in [data_path, metadata_path]:
+			if os.path.isfile(path):
+				disk_cache["size"] -= os.path.getsize(path)
+		# the metadata is written last, an entry isn't read until its metadata exists
+		write_file_atomically(data_path, data)
+		write_file_atomically(metadata_path, metadata_bytes)
+		disk_cache["size"] += len(data) + len(metadata_bytes)
+		if disk_cache["size"] > max_size:
+			evict_disk_cache(cache_directory, disk_cache, max_size)
+
+def evict_disk_cache(cache_directory, disk_cache, max_size):
+	# remove the entries that were used the longest time ago until the cache fits in max_size bytes
+	entries = []
+	with os.scandir(cache_directory) as cache_entries:
+		for cache_entry in cache_entries:
+			if cache_entry.name.endswith(".json"):
+				entries.append((cache_entry.stat().st_mtime, cache_entry.name[:-5]))
+	for _, key in sorted(entries):
+		if disk_cache["size"] <= max_size:
+			break
+		# remove the metadata first so the entry stops being read before its data is removed
+		for path in [os.path.join(cache_directory, key + ".json"), os.path.join(cache_directory, key + ".bin")]:
+			try:
+				file_size = os.path.getsize(path)
+				os.remove(path)
+				disk_cache["size"] -= file_size
+			except OSError:
+				pass
+		# count the evictions so anything linking to the cache knows its links may have gone
+		disk_cache["evictions"] += 1
+
+def get_disk_cache_evictions(cache_directory):
+	# how many entries have been evicted from a cache folder, without creating the folder if it hasn't been used
+	with disk_caches_lock:
+		disk_cache = disk_caches.get(cache_directory)
+	return 0 if disk_cache is None else disk_cache["evictions"]
@@ -0,0 +1,302 @@
+import bisect
+import heapq
+import itertools
+import math
+import re
+from collections import Counter
+from operator import itemgetter
+
+from .names import clean_modelname
+
+filter_token_pattern = re.compile(r'\w+')
+# the fuzzy filter also splits words on underscores, which are often used instead of spaces in model names
+fuzzy_word_pattern = re.compile(r'[^\W_]+')
+# how many token lookups each index remembers, they are forgotten all at once when it is full
+filter_lookup_limit = 1024
+
+def build_token_postings(texts):
+	# map each lowercase token to the positions of the texts it is found in
+	postings = {}
+	for position, text in enumerate(texts):
+		for token in set(filter_token_pattern.findall(text.lower())):
+			postings.setdefault(token, set()).add(position)
+	return {"postings": postings, "vocabulary": sorted(postings)}
+
+def build_filter_index(choices, tags_obj):
+	# build the token index of the model names and of their tags
+	return {
+		"choices": choices,
+		"names": build_token_postings(choices),
+		"tags": build_token_postings([tags_obj.get(choice, '') for choice in choices]),
+		"lookups": {}
+	}
+
+def find_token_positions(filter_index, field, token, match):
+	# get the positions of the texts with a token that matches `token`, `match` is how much of the text token has to match
+	lookup_key = (field, token, match)
+	positions = filter_index["lookups"].get(lookup_key)
+	if positions is not None:
+		return positions
+	token_postings = filter_index[field]
+	vocabulary = token_postings["vocabulary"]
+	if match == "exact":
+		matching_tokens = [token] if token in token_postings["postings"] else []
+	elif match == "prefix":
+		# the vocabulary is sorted so the tokens starting with `token` are next to each other
+		matching_tokens = []
+		start = bisect.bisect_left(vocabulary, token)
+		for vocabulary_token in vocabulary[start:]:
+			if not vocabulary_token.startswith(token):
+				break
+			matching_tokens.append(vocabulary_token)
+	elif match == "suffix":
+		matching_tokens = [vocabulary_token for vocabulary_token in vocabulary if vocabulary_token.endswith(token)]
+	else:
+		matching_tokens = [vocabulary_token for vocabulary_token in vocabulary if token in vocabulary_token]
+	positions = set()
+	for matching_token in matching_tokens:
+		positions.update(token_postings["postings"][matching_token])
+	if len(filter_index["lookups"]) >= filter_lookup_limit:
+		filter_index["lookups"].clear()
+	filter_index["lookups"][lookup_key] = positions
+	return positions
+
+def find_filter_candidates(filter_index, field, filter_tags):
+	# get the positions of the texts that could contain every filter tag, None means every text could
+	# a filter tag can start or end part way through a word, so only the words inside it must match a whole token
+	candidates = None
+	for filter_tag in filter_tags:
+		tag_tokens = list(filter_token_pattern.finditer(filter_tag))
+		for token_index, tag_token in enumerate(tag_tokens):
+			starts_at_word = token_index > 0 or tag_token.start() > 0
+			ends_at_word = token_index < len(tag_tokens) - 1 or tag_token.end() < len(filter_tag)
+			if starts_at_word and ends_at_word:
+				match = "exact"
+			elif starts_at_word:
+				match = "prefix"
+			elif ends_at_word:
+				match = "suffix"
+			else:
+				match = "substring"
+			positions = find_token_positions(filter_index, field, tag_token.group(), match)
+			candidates = set(positions) if candidates is None else candidates & positions
+			if len(candidates) == 0:
+				return candidates
+	return candidates
+
+# how many models the fuzzy filter shows, and how much of the filter has to be found in a model's name or tags to show it
+fuzzy_filter_limit = 50
+fuzzy_filter_min_coverage = 0.3
+# the pieces found in the tags of at least this share of the models are kept as bits from when the index is built
+fuzzy_common_gram_share = 1 / 16
+
+def get_fuzzy_grams(text):
+	# get the three letter pieces of each word, the words are padded so the start and end of a word count as well
+	grams = set()
+	for word in fuzzy_word_pattern.findall(text.lower()):
+		padded_word = f' {word} '
+		grams.update(padded_word[i:i + 3] for i in range(len(padded_word) - 2))
+	return grams
+
+def build_gram_postings(texts):
+	# map each three letter piece to the positions of the texts it is found in, and count the pieces of each text
+	postings = {}
+	sizes = []
+	for position, text in enumerate(texts):
+		grams = get_fuzzy_grams(text)
+		sizes.append(len(grams))
+		for gram in grams:
+			postings.setdefault(gram, []).append(position)
+	return {"postings": postings, "sizes": sizes, "common_bits": {}, "bits": {}}
+
+def get_positions_bits(positions, size):
+	# turn a list of positions into the bits of a number (bit n is set when n is in the list)
+	flags = bytearray((size + 7) // 8)
+	for position in positions:
+		flags[position >> 3] |= 1 << (position & 7)
+	return int.from_bytes(flags, "little")
+
+def build_common_gram_bits(gram_postings):
+	# the pieces found in many of the texts take the longest to turn into bits, so do it for them when the index is built
+	# instead of in the first filter that uses them, the others are quick to do when they are needed
+	size = len(gram_postings["sizes"])
+	min_length = max(1, size * fuzzy_common_gram_share)
+	gram_postings["common_bits"] = {gram: get_positions_bits(positions, size) for gram, positions in gram_postings["postings"].items() if len(positions) >= min_length}
+
+def get_gram_bits(gram_postings, gram):
+	# get the positions of the texts with a three letter piece as the bits of a number (bit n is set when text n has it)
+	# a piece found in most of the texts is a long list, but as bits it is combined with the other pieces in one step
+	bits = gram_postings["common_bits"].get(gram)
+	if bits is None:
+		bits = gram_postings["bits"].get(gram)
+	if bits is None:
+		bits = get_positions_bits(gram_postings["postings"].get(gram, ()), len(gram_postings["sizes"]))
+		if len(gram_postings["bits"]) >= filter_lookup_limit:
+			gram_postings["bits"].clear()
+		gram_postings["bits"][gram] = bits
+	return bits
+
+def count_gram_bits(gram_bits):
+	# count how many of the pieces each text has, for all the texts at once: digit d of the binary count of every text
+	# is kept as the bits of counts[d], and each piece is added with a carry like adding binary numbers by hand
+	counts = []
+	for carry in gram_bits:
+		for digit, count in enumerate(counts):
+			counts[digit], carry = count ^ carry, count & carry
+			if carry == 0:
+				break
+		if carry != 0:
+			counts.append(carry)
+	return counts
+
+def get_count_bits(counts, value, all_bits):
+	# get the texts that have exactly `value` of the pieces as bits
+	if value >> len(counts) != 0:
+		return 0
+	bits = all_bits
+	for digit, count in enumerate(counts):
+		bits &= count if value >> digit & 1 else all_bits ^ count
+	return bits
+
+def get_fuzzy_index(choices, tags_obj, filter_index):
+	# the fuzzy index is only built the first time the fuzzy filter is used, it is kept with the token index
+	if filter_index is None or filter_index["choices"] is not choices:
+		filter_index = {"choices": choices}
+	fuzzy_index = filter_index.get("fuzzy")
+	if fuzzy_index is None:
+		fuzzy_index = {
+			"names": build_gram_postings([clean_modelname(choice) for choice in choices]),
+			"tags": build_gram_postings([tags_obj.get(choice, '') for choice in choices])
+		}
+		build_common_gram_bits(fuzzy_index["tags"])
+		filter_index["fuzzy"] = fuzzy_index
+	return fuzzy_index
+
+def fuzzy_filter_choices(choices, filter, tags_obj, filter_index=None):
+	# rank the choices by how many of the three letter pieces of the filter are in their name and tags
+	# so typos and words in a different order still find the model, the best matches are listed first
+	query_grams = get_fuzzy_grams(filter)
+	if len(query_grams) == 0:
+		return choices
+	fuzzy_index = get_fuzzy_index(choices, tags_obj, filter_index)
+	name_counts = Counter()
+	for gram in query_grams:
+		name_counts.update(fuzzy_index["names"]["postings"].get(gram, ()))
+	# tags are long, so common pieces are in the tags of nearly every model, count them as bits instead of one model at a time
+	tag_counts = count_gram_bits(get_gram_bits(fuzzy_index["tags"], gram) for gram in query_grams)
+	tag_digits = [count.to_bytes((len(choices) + 7) // 8, "little") for count in tag_counts]
+
+	# only score the choices that have enough of the pieces in their name or tags, keeping the best so far in `best_choices`
+	# as a heap of (score, list rank, position) with the worst of them first, choices with the same score are listed in the
+	# order they are in the list so the list rank counts down from the first choice (a higher rank is better, like the score)
+	query_size = len(query_grams)
+	min_count = max(1, math.ceil(fuzzy_filter_min_coverage * query_size))
+	best_choices = []
+	def add_choice(score, position):
+		ranked_choice = (score, len(choices) - position, position)
+		if len(best_choices) < fuzzy_filter_limit:
+			heapq.heappush(best_choices, ranked_choice)
+		elif ranked_choice > best_choices[0]:
+			heapq.heapreplace(best_choices, ranked_choice)
+
+	# the choices without any of the pieces in their name only score on their tags, so the best of them are the ones
+	# with the most pieces in their tags, and the first in the list of those, take them a count at a time until there are enough
+	all_bits = (1 << len(choices)) - 1
+	name_flags = bytearray((len(choices) + 7) // 8)
+	for position in name_counts:
+		name_flags[position >> 3] |= 1 << (position & 7)
+	name_bits = int.from_bytes(name_flags, "little")
+	tag_choices = 0
+	for tag_count in range(query_size, min_count - 1, -1):
+		bits = get_count_bits(tag_counts, tag_count, all_bits) & ~name_bits
+		while bits != 0 and tag_choices < fuzzy_filter_limit:
+			position = (bits & -bits).bit_length() - 1
+			add_choice((tag_count / 2) / query_size, position)
+			tag_choices += 1
+			bits &= bits - 1
+		if tag_choices >= fuzzy_filter_limit:
+			break
+
+	# the most pieces any of the choices with the filter in their name has in its tags, to know how well they could score
+	name_tag_count = next((tag_count for tag_count in range(query_size, 0, -1) if get_count_bits(tag_counts, tag_count, all_bits) & name_bits), 0)
+	name_sizes = fuzzy_index["names"]["sizes"]
+	for name_count, group in itertools.groupby(name_counts.most_common(), key=itemgetter(1)):
+		if len(best_choices) == fuzzy_filter_limit and (2 * name_count + name_tag_count / 2) / query_size < best_choices[0][0]:
+			# none of the names with this many pieces can make the list, even one made of only those pieces
+			continue
+		# names that match the filter closely rank above longer names that only contain it, so go through the shortest names first
+		for position in sorted((position for position, _ in group), key=name_sizes.__getitem__):
+			name_similarity = name_count / (query_size + name_sizes[position] - name_count)
+			if len(best_choices) == fuzzy_filter_limit and (name_count + name_tag_count / 2) / query_size + name_similarity < best_choices[0][0]:
+				# neither this name nor the longer ones after it can make the list
+				break
+			tag_count = sum((digits[position >> 3] >> (position & 7) & 1) << digit for digit, digits in enumerate(tag_digits))
+			if name_count < min_count and tag_count < min_count:
+				continue
+			# tags count for less than names
+			add_choice((name_count + tag_count / 2) / query_size + name_similarity, position)
+	return [choices[position] for _, _, position in sorted(best_choices, reverse=True)]
+
+def filter_choices(choices, filter, tags_obj, filter_index=None, filter_mode="Exact"):
+	# get the choices that match the filter, `filter_mode` is "Exact" or "Fuzzy"
+	filtered_choices = choices
+	if filter is not None and filter.strip() != "" and filter_mode == "Fuzzy":
+		filtered_choices = fuzzy_filter_choices(choices, filter, tags_obj, filter_index)
+	elif filter is not None and filter.strip() != "":
+		# filter the choices based on the provided filter string
+		filter_tags = [tag.strip().lower() for tag in filter.split(",")]
+		if filter_index is not None and filter_index["choices"] is choices:
+			# narrow down the choices with the token index, then check the few that are left the same way as below
+			name_candidates = find_filter_candidates(filter_index, "names", filter_tags)
+			tag_candidates = find_filter_candidates(filter_index, "tags", filter_tags)
+			if name_candidates is None or tag_candidates is None:
+				candidates = range(len(choices))
+			else:
+				candidates = sorted(name_candidates | tag_candidates)
+			filtered_choices = [choices[position] for position in candidates]
+		filtered_choices = [choice for choice in filtered_choices if
+							all(tag in tags_obj.get(choice, '').lower() for tag in filter_tags) or
+							all(tag in choice.lower() for tag in filter_tags)]
+	return filtered_choices
+
+# the hash a1111 adds to the end of some model names
+choice_hash_pattern = re.compile(r"(?i)(?: \[([a-f0-9]{10,12})\]|\(([a-f0-9]{10,12})\))$")
+
+def build_choice_map(choices):
+	# map the cleaned up name of each choice to the choices with that name, in list order
+	choice_names = {}
+	for choice in choices:
+		choice_names.setdefault(clean_modelname(choice), []).append(choice)
+	return {"choices": choices, "names": choice_names}
+
+def pick_choice(candidates, hint):
+	# pick between models with the same name using the path and hash of the card that was clicked
+	hint = hint.lower().replace("\\", "/")
+	picked_choice = None
+	picked_length = -1
+	for candidate in candidates:
+		hash_match = choice_hash_pattern.search(candidate)
+		if hash_match and (hash_match.group(1) or hash_match.group(2)).lower() in hint:
+			return candidate
+		# a model in a subfolder has the folder in its name, the longest path found in the hint is the closest match
+		candidate_path = choice_hash_pattern.sub("", candidate).lower().replace("\\", "/")
+		if candidate_path in hint and len(candidate_path) > picked_length:
+			picked_choice = candidate
+			picked_length = len(candidate_path)
+	return picked_choice
+
+def find_choice(list, name, choice_map=None):
+	# match a choice to the model, the name sent from a card can have the card's path and hash on the next line
+	name, _, hint = name.partition("\n")
+	if choice_map is None or choice_map["choices"] is not list:
+		choice_map = build_choice_map(list)
+	candidates = choice_map["names"].get(name)
+	if not candidates:
+		return name
+	if len(candidates) > 1:
+		# models with the same name in different folders
+		picked_choice = pick_choice(candidates, hint) if hint else None
+		if picked_choice is not None:
+			return picked_choice
+		print(f"SD Model Preview found {len(candidates)} models named {name}, showing {candidates[0]}")
+	return candidates[0]
@@ -0,0 +1,349 @@
+import hashlib
+import html
+import json
+import os
+import re
+import struct
+import threading
+import zlib
+from collections import OrderedDict
+
+from PIL import Image
+
+from .timing import timing_span
+
+# cache of the information read from the headers of preview images, keyed by path and checked against the modified time
+image_info_cache = OrderedDict()
+image_info_cache_lock = threading.Lock()
+image_info_cache_limit = 4096
+
+exif_unicode_prefix = b'UNICODE\x00'
+exif_ascii_prefix = b'ASCII\x00\x00\x00'
+xmp_user_comment_pattern = re.compile(r'<exif:UserComment>\s*(?:<rdf:Alt>\s*<rdf:li[^>]*>)?(.*?)(?:</rdf:li>\s*</rdf:Alt>\s*)?</exif:UserComment>|exif:UserComment="([^"]*)"', re.DOTALL)
+
+def decode_exif_user_comment(data):
+	# the first 8 bytes of a user comment say how the rest of it is encoded
+	prefix, body = data[:8], data[8:]
+	if prefix == exif_unicode_prefix:
+		# the webui writes big endian utf-16 but some tools write little endian, ascii text makes it easy to tell which
+		if len(body) >= 2 and body[0] != 0 and body[1] == 0:
+			return body.decode('utf-16-le', errors='replace').rstrip('\x00')
+		return body.decode('utf-16-be', errors='replace').rstrip('\x00')
+	if prefix == exif_ascii_prefix:
+		return body.decode('ascii', errors='replace').rstrip('\x00')
+	return data.decode('utf8', errors='ignore').rstrip('\x00')
+
+def read_exif_user_comment(tiff_data):
+	# find the UserComment tag in the Exif IFD of a block of exif (tiff formatted) data
+	if tiff_data.startswith(b'Exif\x00\x00'):
+		tiff_data = tiff_data[6:]
+	if len(tiff_data) < 8:
+		return None
+	byte_order = {b'II': '<', b'MM': '>'}.get(tiff_data[:2])
+	if byte_order is None:
+		return None
+
+	def read_ifd(offset):
+		# get the (tag, type, count, value or offset) entries of an ifd
+		if offset + 2 > len(tiff_data):
+			return []
+		entry_count = struct.unpack_from(byte_order + 'H', tiff_data, offset)[0]
+		entries = []
+		for entry in range(entry_count):
+			entry_offset = offset + 2 + entry * 12
+			if entry_offset + 12 > len(tiff_data):
+				break
+			entries.append(struct.unpack_from(byte_order + 'HHII', tiff_data, entry_offset))
+		return entries
+
+	ifd0_offset = struct.unpack_from(byte_order + 'I', tiff_data, 4)[0]
+	# 0x8769 points to the Exif IFD which is where the UserComment tag (0x9286) is kept
+	exif_ifd_offset = next((value for tag, _, _, value in read_ifd(ifd0_offset) if tag == 0x8769), None)
+	if exif_ifd_offset is None:
+		return None
+	for tag, _, count, value in read_ifd(exif_ifd_offset):
+		if tag == 0x9286:
+			# values of 4 bytes or less are stored in the entry itself instead of at an offset
+			comment = tiff_data[value:value + count] if count > 4 else struct.pack(byte_order + 'I', value)[:count]
+			return decode_exif_user_comment(comment)
+	return None
+
+def read_xmp_user_comment(xmp_data):
+	# some tools store the parameters in the xmp packet instead of the exif data
+	match = xmp_user_comment_pattern.search(xmp_data.decode('utf8', errors='ignore'))
+	if match is None:
+		return None
+	return html.unescape(match.group(1) if match.group(1) is not None else match.group(2))
+
+# the samplers novelai names in its settings, by the names the webui gives them
+novelai_samplers = {
+	"k_euler_ancestral": "Euler a", "k_euler_a": "Euler a", "k_euler": "Euler", "k_lms": "LMS", "k_heun": "Heun",
+	"k_dpm_2": "DPM2", "k_dpm_2_a": "DPM2 a", "k_dpmpp_2s_a": "DPM++ 2S a", "k_dpmpp_2m": "DPM++ 2M",
+	"k_dpmpp_sde": "DPM++ SDE", "k_dpm_fast": "DPM fast", "k_dpm_ad": "DPM adaptive", "ddim": "DDIM", "plms": "PLMS"
+}
+
+def read_novelai_prompt(texts, width, height):
+	# novelai keeps the prompt in the Description text and the rest of the settings as json in the Comment text,
+	# write them out as the parameters the webui would have written, the same way the webui does when it reads them
+	try:
+		settings = json.loads(texts["Comment"])
+		sampler = novelai_samplers.get(settings["sampler"], "Euler a")
+		return f"""{texts["Description"]}
+Negative prompt: {settings["uc"]}
+Steps: {settings["steps"]}, Sampler: {sampler}, CFG scale: {settings["scale"]}, Seed: {settings["seed"]}, Size: {width}x{height}, Clip skip: 2, ENSD: 31337"""
+	except (KeyError, TypeError, ValueError):
+		return None
+
+def read_text_prompt(texts, exif_comment, width, height):
+	# pick the prompt out of the text of an image like the webui does, the parameters or else the exif user comment,
+	# unless it was made by novelai which has its own format
+	prompt = texts.get("parameters")
+	if prompt is None:
+		prompt = exif_comment
+	if texts.get("Software") == "NovelAI":
+		prompt = read_novelai_prompt(texts, width, height) or prompt
+	return prompt
+
+def read_png_info(file):
+	# read the size from the IHDR chunk and the parameters from the text chunks, skipping over the image data
+	info = {"format": "PNG", "width": None, "height": None, "prompt": None}
+	texts = {}
+	exif_comment = None
+	file.seek(8)
+	while True:
+		chunk_header = file.read(8)
+		if len(chunk_header) < 8:
+			break
+		length, chunk_type = struct.unpack('>I4s', chunk_header)
+		if chunk_type == b'IEND':
+			break
+		if chunk_type in (b'IHDR', b'tEXt', b'zTXt', b'iTXt', b'eXIf'):
+			data = file.read(length)
+			file.seek(4, os.SEEK_CUR)
+		else:
+			# skip the chunk data and its crc
+			file.seek(length + 4, os.SEEK_CUR)
+			continue
+		if chunk_type == b'IHDR':
+			info["width"], info["height"] = struct.unpack_from('>II', data)
+		elif chunk_type == b'eXIf':
+			exif_comment = read_exif_user_comment(data)
+		else:
+			keyword, _, text = data.partition(b'\x00')
+			# only keep the texts the prompt can be read from
+			keyword = keyword.decode('latin-1')
+			if keyword not in ('parameters', 'Software', 'Description', 'Comment'):
+				continue
+			if chunk_type == b'tEXt':
+				texts[keyword] = text.decode('latin-1')
+			elif chunk_type == b'zTXt':
+				texts[keyword] = zlib.decompress(text[1:]).decode('latin-1')
+			else:
+				# iTXt has a compression flag and method followed by a language tag and translated keyword before the text
+				compressed = text[:1] == b'\x01'
+				text = text[2:].split(b'\x00', 2)[-1]
+				texts[keyword] = (zlib.decompress(text) if compressed else text).decode('utf8', errors='replace')
+	info["prompt"] = read_text_prompt(texts, exif_comment, info["width"], info["height"])
+	return info
+
+def read_jpeg_info(file):
+	# read the size from the start of frame segment and the parameters from the exif or xmp segments, stopping before the image data
+	info = {"format": "JPEG", "width": None, "height": None, "prompt": None}
+	xmp_comment = None
+	file.seek(2)
+	while True:
+		marker = file.read(2)
+		if len(marker) < 2 or marker[0] != 0xFF:
+			break
+		marker_type = marker[1]
+		if marker_type == 0xD8 or 0xD0 <= marker_type <= 0xD7 or marker_type == 0x01:
+			# these markers don't have a length
+			continue
+		if marker_type in (0xD9, 0xDA):
+			# end of image or start of the compressed image data
+			break
+		length_data = file.read(2)
+		if len(length_data) < 2:
+			break
+		length = struct.unpack('>H', length_data)[0] - 2
+		if 0xC0 <= marker_type <= 0xCF and marker_type not in (0xC4, 0xC8, 0xCC):
+			data = file.read(length)
+			info["height"], info["width"] = struct.unpack_from('>HH', data, 1)
+		elif marker_type == 0xE1:
+			data = file.read(length)
+			if data.startswith(b'Exif\x00\x00') and info["prompt"] is None:
+				info["prompt"] = read_exif_user_comment(data)
+			elif data.startswith(b'http://ns.adobe.com/xap/1.0/\x00'):
+				xmp_comment = read_xmp_user_comment(data)
+		else:
+			file.seek(length, os.SEEK_CUR)
+	if info["prompt"] is None:
+		info["prompt"] = xmp_comment
+	return info
+
+def read_webp_info(file):
+	# read the size from the VP8/VP8L/VP8X chunk and the parameters from the EXIF or XMP chunks
+	info = {"format": "WEBP", "width": None, "height": None, "prompt": None}
+	xmp_comment = None
+	file.seek(12)
+	while True:
+		chunk_header = file.read(8)
+		if len(chunk_header) < 8:
+			break
+		chunk_type, length = struct.unpack('<4sI', chunk_header)
+		# chunks are padded to an even length
+		padded_length = length + (length & 1)
+		if chunk_type in (b'VP8X', b'EXIF', b'XMP '):
+			data = file.read(length)
+			file.seek(padded_length - length, os.SEEK_CUR)
+		elif chunk_type in (b'VP8 ', b'VP8L') and info["width"] is None:
+			data = file.read(min(length, 10))
+			file.seek(padded_length - len(data), os.SEEK_CUR)
+		else:
+			file.seek(padded_length, os.SEEK_CUR)
+			continue
+		if chunk_type == b'VP8X' and len(data) >= 10:
+			info["width"] = int.from_bytes(data[4:7], 'little') + 1
+			info["height"] = int.from_bytes(data[7:10], 'little') + 1
+		elif chunk_type == b'VP8 ' and len(data) >= 10:
+			info["width"] = struct.unpack_from('<H', data, 6)[0] & 0x3FFF
+			info["height"] = struct.unpack_from('<H', data, 8)[0] & 0x3FFF
+		elif chunk_type == b'VP8L' and len(data) >= 5:
+			bits = struct.unpack_from('<I', data, 1)[0]
+			info["width"] = (bits & 0x3FFF) + 1
+			info["height"] = ((bits >> 14) & 0x3FFF) + 1
+		elif chunk_type == b'EXIF':
+			info["prompt"] = read_exif_user_comment(data)
+		elif chunk_type == b'XMP ':
+			xmp_comment = read_xmp_user_comment(data)
+	if info["prompt"] is None:
+		info["prompt"] = xmp_comment
+	return info
+
+def read_pillow_prompt(image):
+	# read the prompt of an image pillow opened, its info has the text chunks and exif data or a comment (gif)
+	exif_comment = None
+	if isinstance(image.info.get('exif'), bytes):
+		exif_comment = read_exif_user_comment(image.info['exif'])
+	elif isinstance(image.info.get('comment'), bytes):
+		exif_comment = image.info['comment'].decode('utf8', errors='ignore')
+	return read_text_prompt(image.info, exif_comment, image.width, image.height)
+
+def read_image_info(file_path):
+	# read the format, size, and prompt of an image from its headers without decoding the image
+	info = None
+	try:
+		with open(file_path, 'rb') as file:
+			signature = file.read(12)
+			if signature.startswith(b'\x89PNG\r\n\x1a\n'):
+				info = read_png_info(file)
+			elif signature.startswith(b'\xff\xd8'):
+				info = read_jpeg_info(file)
+			elif signature.startswith(b'RIFF') and signature[8:12] == b'WEBP':
+				info = read_webp_info(file)
+	except (OSError, struct.error, zlib.error) as e:
+		print(f"SD Model Preview unable to read the headers of {file_path}: {e}")
+		info = None
+	if info is None or info["width"] is None:
+		# fall back to pillow for other formats, opening an image only reads its headers until it is loaded
+		try:
+			with Image.open(file_path) as image:
+				prompt = read_pillow_prompt(image) if info is None else info["prompt"]
+				info = {"format": image.format, "width": image.width, "height": image.height, "prompt": prompt}
+		except (OSError, Image.UnidentifiedImageError, Image.DecompressionBombError):
+			# an image too large to open safely (not an OSError) is shown without its size and prompt like any other unreadable image
+			info = {"format": None, "width": None, "height": None, "prompt": None}
+	return info
+
+@timing_span("image_info")
+def get_image_info(file_path):
+	# get the header information of an image, reading it only if the image changed since it was last read
+	try:
+		file_stat = os.stat(file_path)
+	except OSError:
+		return {"format": None, "width": None, "height": None, "prompt": None}
+	cache_key = (file_stat.st_mtime_ns, file_stat.st_size)
+	with image_info_cache_lock:
+		cached = image_info_cache.get(file_path)
+		if cached is not None and cached[0] == cache_key:
+			image_info_cache.move_to_end(file_path)
+			return cached[1]
+	info = read_image_info(file_path)
+	with image_info_cache_lock:
+		image_info_cache[file_path] = (cache_key, info)
+		image_info_cache.move_to_end(file_path)
+		while len(image_info_cache) > image_info_cache_limit:
+			image_info_cache.popitem(last=False)
+	return info
+
+def seed_image_info(image_infos):
+	# fill the cache with image info read ahead of time, given as (path, modified time in ns, size, info)
+	with image_info_cache_lock:
+		for file_path, mtime, size, info in image_infos:
+			image_info_cache[file_path] = ((mtime, size), info)
+			image_info_cache.move_to_end(file_path)
+		while len(image_info_cache) > image_info_cache_limit:
+			image_info_cache.popitem(last=False)
+
+def get_thumbnail_directory(options):
+	# the folder thumbnails of preview images are saved to
+	return os.path.join(options["cache_directory"], 'thumb_cache')
+
+def get_thumbnail_image(image):
+	# thumbnails are saved as 8 bit webp or jpeg images, convert any other mode (16 bit grayscale, 32 bit integer or float, cmyk, ...) first
+	if image.mode in ("RGB", "RGBA", "L", "LA", "P"):
+		return image
+	if image.mode == "I" or image.mode.startswith("I;16"):
+		# scale 16 bit values down to 8 bits instead of clipping everything above 255 to white
+		return image.convert("I").point(lambda value: value / 256).convert("L")
+	return image.convert("RGBA" if "A" in image.mode or "transparency" in image.info else "RGB")
+
+@timing_span("thumbnail")
+def get_thumbnail(file, image_info, options):
+	# get the path to a downscaled copy of the image, creating it if it doesn't exist yet
+	# returns None if the image is already small enough to be shown as is
+	thumbnail_size = int(options["thumbnail_size"])
+	thumbnail_directory = get_thumbnail_directory(options)
+	if image_info["width"] is None or (image_info["width"] <= thumbnail_size and image_info["height"] <= thumbnail_size):
+		return None
+
+	# the thumbnail is named after the path, modified time, and size of the image so an edited image gets a new thumbnail
+	file_stat = os.stat(file)
+	thumbnail_key = f"{os.path.abspath(file)}|{file_stat.st_mtime_ns}|{file_stat.st_size}|{thumbnail_size}"
+	thumbnail_name = hashlib.sha1(thumbnail_key.encode('utf-8')).hexdigest()
+	for extension in ['.webp', '.jpg']:
+		thumbnail_path = os.path.join(thumbnail_directory, thumbnail_name + extension)
+		if os.path.isfile(thumbnail_path):
+			return thumbnail_path
+
+	# check if the thumbnail directory exists, if not, create it
+	if not os.path.exists(thumbnail_directory):
+		os.makedirs(thumbnail_directory, exist_ok=True)
+
+	# save to a temporary file first so the webui never links to a half written thumbnail
+	temp_path = os.path.join(thumbnail_directory, f"{thumbnail_name}.{threading.get_ident()}.tmp")
+	try:
+		# the image only needs to be decoded when its thumbnail is created
+		with Image.open(file) as image:
+			# let jpeg images decode at a reduced size
+			image.draft("RGB", (thumbnail_size, thumbnail_size))
+			thumbnail = get_thumbnail_image(image)
+			thumbnail.thumbnail((thumbnail_size, thumbnail_size))
+			if thumbnail is image:
+				# keep the downscaled image once the file is closed
+				thumbnail = image.copy()
+		# use webp if pillow supports it, otherwise fall back to jpeg
+		thumbnail_path = os.path.join(thumbnail_directory, thumbnail_name + '.webp')
+		try:
+			thumbnail.save(temp_path, format="WEBP", quality=85)
+		except (KeyError, OSError):
+			thumbnail_path = os.path.join(thumbnail_directory, thumbnail_name + '.jpg')
+			thumbnail.convert("RGB").save(temp_path, format="JPEG", quality=85)
+		os.replace(temp_path, thumbnail_path)
+	except (OSError, ValueError, Image.DecompressionBombError) as e:
+		# show the full size image instead
+		print(f"SD Model Preview unable to create a thumbnail for {file}: {e}")
+		if os.path.exists(temp_path):
+			os.remove(temp_path)
+		return None
+	return thumbnail_path
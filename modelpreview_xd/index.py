@@ -0,0 +1,465 @@
+import os
+import threading
+import time
+
+from .names import natural_order_number, split_number_suffix
+from .timing import timing_span
+
+# the preview type of each file extension, a file is classified by looking up its (lowercased) extension once
+preview_type_extensions = {
+	"html": "html",
+	"md": "md",
+	"txt": "txt",
+	"prompt": "prompts",
+	"prompts": "prompts",
+	"png": "img",
+	"jpg": "img",
+	"jpeg": "img",
+	"webp": "img",
+	"jxk": "img",
+	"avif": "img",
+	"tags": "tags",
+}
+# civitai.info files are the only preview files with two extensions so they are picked out before the lookup
+civitai_extension = ".civitai.info"
+# the suffix strictly named preview files can have before their number and extension
+strict_preview_suffix = ".preview"
+
+@timing_span("is_in_directory")
+def is_in_directory(parent_dir, child_path):
+	# get the directory of the child path
+	child_dir = os.path.dirname(child_path)
+
+	# get the absolute paths of both directories
+	parent_dir = os.path.abspath(os.path.realpath(parent_dir))
+	child_dir = os.path.abspath(os.path.realpath(child_dir))
+
+	# return false if either directory is not a valid directory
+	if not os.path.isdir(parent_dir) or not os.path.isdir(child_dir):
+		return False
+
+	# get the common prefix of the paths to see if the child dir is in the parent
+	common_prefix = os.path.commonprefix([parent_dir, child_dir])
+	return common_prefix == parent_dir and child_dir != parent_dir
+
+# directories further below a root than this aren't scanned, this stops a symlink loop on a filesystem without inode numbers
+preview_index_max_depth = 32
+
+# in-memory index of the preview files found in each model directory, keyed by the root path that was scanned
+preview_index = {}
+preview_index_lock = threading.Lock()
+# each root has its own lock so building the index of one root doesn't hold up lookups in the others
+preview_index_root_locks = {}
+# how many seconds to wait before checking the directory modified times of a root again
+preview_index_check_interval = 2.0
+
+def classify_preview_file(filename):
+	# return the preview type and the file name without the extension, or (None, None) if it isn't a preview file
+	if filename.lower().endswith(civitai_extension):
+		return "civitai", filename[:-len(civitai_extension)]
+	stem, dot, extension = filename.rpartition(".")
+	preview_type = preview_type_extensions.get(extension.lower()) if dot else None
+	if preview_type is None:
+		return None, None
+	return preview_type, stem
+
+def get_strict_names(stem):
+	# get every model name that could strictly match a file with this name (without its extension)
+	# this is {model}, {model}.preview, {model}.{number}, or {model}.preview.{number}
+	names = {stem}
+	base, number = split_number_suffix(stem)
+	if number is not None:
+		names.add(base)
+	for name in list(names):
+		if name.lower().endswith(strict_preview_suffix):
+			names.add(name[:-len(strict_preview_suffix)])
+	return names
+
+def get_mtime(path):
+	# get the modified time of a file or directory, or None if it no longer exists
+	try:
+		return os.stat(path).st_mtime_ns
+	except OSError:
+		return None
+
+def read_index_models(index_txt_path):
+	# read the list of models from an index.txt file
+	with open(index_txt_path, "r", encoding="utf8") as file:
+		output_text = file.read()
+	return [model.strip() for model in output_text.replace(",", "\n").splitlines()]
+
+def create_dir_entry(dirpath, mtime):
+	# the record kept for each directory of a root, filled in by scan_preview_dir or read back from the catalog
+	return {
+		"path": dirpath,
+		# get a list of all parent directories
+		"directories": dirpath.split(os.path.sep),
+		"mtime": mtime,
+		"subdirs": [],
+		"files": [],
+		"index_models": None,
+		"index_path": None,
+		"index_mtime": None,
+		# the (device, inode) of the directory, the same for every path (symlink) that leads to it
+		"identity": None,
+		# the answers of is_in_directory for the files of the directory, keyed by the parent directory
+		"in_directory": {},
+	}
+
+def get_stat_identity(path_stat):
+	# the (device, inode) of a file or directory, or None if the filesystem doesn't give inode numbers
+	if path_stat.st_ino == 0:
+		return None
+	return (path_stat.st_dev, path_stat.st_ino)
+
+def create_file_entry(dir_entry, filename, file_path, preview_type, stem, mtime):
+	# the record kept for each preview file of a directory
+	return {
+		"dir": dir_entry,
+		"name": filename,
+		"path": file_path,
+		"type": preview_type,
+		"stem": stem,
+		# the names of the models this file would match using strict naming
+		"strict_names": get_strict_names(stem),
+		# the contents of tags files are collected ahead of time so keep track of when they change
+		"mtime": mtime,
+	}
+
+def scan_preview_dir(dirpath, dir_stat=None):
+	# list a single directory and record its subdirectories and the preview files found in it
+	try:
+		if dir_stat is None:
+			dir_stat = os.stat(dirpath)
+	except OSError:
+		return None
+	dir_entry = create_dir_entry(dirpath, dir_stat.st_mtime_ns)
+	dir_entry["identity"] = get_stat_identity(dir_stat)
+	filenames = []
+	try:
+		with os.scandir(dirpath) as scanned_entries:
+			for scanned_entry in scanned_entries:
+				try:
+					# follow symlinks to directories the same way os.walk(followlinks=True) does
+					is_dir = scanned_entry.is_dir()
+				except OSError:
+					is_dir = False
+				if is_dir:
+					dir_entry["subdirs"].append(scanned_entry.name)
+				else:
+					filenames.append(scanned_entry.name)
+	except OSError:
+		# the directory can't be read (or no longer exists) so leave it out of the index
+		return None
+
+	# sort the file names using a natural sort algorithm
+	for filename in sorted(filenames, key=natural_order_number):
+		file_path = os.path.join(dirpath, filename)
+		if filename.lower() == "index.txt" and dir_entry["index_path"] is None:
+			# read the index file now so index matching doesn't need to open it again
+			# if there is more than one (index.txt and index.TXT on a case sensitive file system) the first one is used
+			dir_entry["index_path"] = file_path
+			dir_entry["index_mtime"] = get_mtime(file_path)
+			dir_entry["index_models"] = read_index_models(file_path)
+		preview_type, stem = classify_preview_file(filename)
+		if preview_type is None:
+			continue
+		mtime = get_mtime(file_path) if preview_type == "tags" else None
+		dir_entry["files"].append(create_file_entry(dir_entry, filename, file_path, preview_type, stem, mtime))
+	return dir_entry
+
+def alias_dir_entry(dir_entry, dirpath):
+	# a directory reached again through another path (a symlink) reuses what was found the first time instead of being listed again
+	# it is still indexed under its own path so folder matching sees the folder names along that path
+	alias_entry = create_dir_entry(dirpath, dir_entry["mtime"])
+	alias_entry["identity"] = dir_entry["identity"]
+	alias_entry["subdirs"] = list(dir_entry["subdirs"])
+	if dir_entry["index_path"] is not None:
+		alias_entry["index_path"] = os.path.join(dirpath, os.path.basename(dir_entry["index_path"]))
+		alias_entry["index_mtime"] = dir_entry["index_mtime"]
+		alias_entry["index_models"] = dir_entry["index_models"]
+	for file_entry in dir_entry["files"]:
+		alias_file_entry = create_file_entry(alias_entry, file_entry["name"], os.path.join(dirpath, file_entry["name"]), file_entry["type"],
+			file_entry["stem"], file_entry["mtime"])
+		if "text" in file_entry:
+			alias_file_entry["text"] = file_entry["text"]
+		alias_entry["files"].append(alias_file_entry)
+	return alias_entry
+
+def get_dir_ancestry(root_index, dirpath):
+	# get the identities of the indexed directories above a directory and how far below the root it is
+	identities = set()
+	depth = 0
+	parent_dir = dirpath
+	while parent_dir != root_index["path"]:
+		next_parent_dir = os.path.dirname(parent_dir)
+		if next_parent_dir == parent_dir:
+			break
+		parent_dir = next_parent_dir
+		depth += 1
+		parent_entry = root_index["dirs"].get(parent_dir)
+		if parent_entry is not None and parent_entry["identity"] is not None:
+			identities.add(parent_entry["identity"])
+	return frozenset(identities), depth
+
+def scan_preview_tree(root_index, dirpath):
+	# scan a directory and every directory below it, adding them to the index
+	# symlinks are followed, but a directory that leads back to one of the directories above it is left out so a symlink loop ends,
+	# and a directory already scanned through another path isn't listed again
+	ancestors, depth = get_dir_ancestry(root_index, dirpath)
+	pending_dirs = [(dirpath, ancestors, depth)]
+	skipped_depth = False
+	while len(pending_dirs) > 0:
+		current_dir, ancestors, depth = pending_dirs.pop()
+		if depth > preview_index_max_depth:
+			skipped_depth = True
+			continue
+		try:
+			dir_stat = os.stat(current_dir)
+		except OSError:
+			continue
+		identity = get_stat_identity(dir_stat)
+		if identity is not None and identity in ancestors:
+			continue
+		original_entry = root_index["identities"].get(identity) if identity is not None else None
+		if original_entry is not None and original_entry["path"] != current_dir and root_index["dirs"].get(original_entry["path"]) is original_entry:
+			dir_entry = alias_dir_entry(original_entry, current_dir)
+		else:
+			dir_entry = scan_preview_dir(current_dir, dir_stat)
+			if dir_entry is None:
+				continue
+			if identity is not None:
+				root_index["identities"][identity] = dir_entry
+		root_index["dirs"][current_dir] = dir_entry
+		if identity is not None:
+			ancestors = ancestors | {identity}
+		# add the subdirectories in reverse so they are scanned in the order they were listed (the first path to a directory is the one scanned)
+		pending_dirs.extend((os.path.join(current_dir, subdir), ancestors, depth + 1) for subdir in reversed(dir_entry["subdirs"])
+							if os.path.join(current_dir, subdir) not in root_index["dirs"])
+	if skipped_depth:
+		print(f"SD Model Preview didn't look for previews more than {preview_index_max_depth} folders below {root_index['path']}")
+
+def rebuild_preview_lookups(root_index):
+	# put the directories back in the order os.walk would visit them and rebuild the lookup tables from the file entries
+	ordered_dirs = []
+	visited_dirs = set()
+	pending_dirs = [root_index["path"]]
+	while len(pending_dirs) > 0:
+		current_dir = pending_dirs.pop()
+		dir_entry = root_index["dirs"].get(current_dir)
+		if dir_entry is None or current_dir in visited_dirs:
+			continue
+		visited_dirs.add(current_dir)
+		ordered_dirs.append(dir_entry)
+		# add the subdirectories in reverse so they come off the stack in the order they were listed
+		pending_dirs.extend(os.path.join(current_dir, subdir) for subdir in reversed(dir_entry["subdirs"]))
+
+	strict_lookup = {}
+	# the folders each model is listed in by an index.txt file, index files are only read when their folder is scanned
+	# so a changed index.txt (checked by its modified time) is picked up by scanning its folder again and rebuilding this
+	index_lookup = {}
+	# the first directory reached for each (device, inode), any other path to it is an alias that reuses its scan
+	identity_lookup = {}
+	# every folder that has a folder with that name in its path (the folder itself or any folder above it) for folder matching
+	folder_lookup = {}
+	for dir_order, dir_entry in enumerate(ordered_dirs):
+		dir_entry["order"] = dir_order
+		if dir_entry["identity"] is not None:
+			identity_lookup.setdefault(dir_entry["identity"], dir_entry)
+		for directory in set(dir_entry["directories"]):
+			folder_lookup.setdefault(directory, []).append(dir_entry)
+		if dir_entry["index_models"] is not None:
+			# the models of each folder's index.txt as a set for quick membership checks
+			dir_entry["index_model_set"] = set(dir_entry["index_models"])
+			for model in dir_entry["index_model_set"]:
+				index_lookup.setdefault(model, []).append(dir_entry)
+		for file_order, file_entry in enumerate(dir_entry["files"]):
+			file_entry["order"] = (dir_order, file_order)
+			# only images can use the {model}.preview.{number} forms, every other type must be exactly {model}.{extension}
+			strict_keys = file_entry["strict_names"] if file_entry["type"] == "img" else {file_entry["stem"]}
+			for name in strict_keys:
+				strict_lookup.setdefault(name, []).append(file_entry)
+
+	# forget directories that can no longer be reached from the root
+	for dirpath in list(root_index["dirs"].keys()):
+		if dirpath not in visited_dirs:
+			del root_index["dirs"][dirpath]
+
+	# swap in the new lookups all at once so a preview being built at the same time sees a consistent index
+	root_index["ordered_dirs"] = ordered_dirs
+	root_index["strict"] = strict_lookup
+	root_index["index"] = index_lookup
+	root_index["folders"] = folder_lookup
+	root_index["identities"] = identity_lookup
+	root_index["loose"] = {}
+	root_index["generation"] += 1
+
+def create_root_index(path):
+	# an empty index for a root, filled in by build_preview_index or read back from the catalog
+	return {
+		"path": path,
+		"dirs": {},
+		"ordered_dirs": [],
+		"strict": {},
+		"index": {},
+		"folders": {},
+		"identities": {},
+		"loose": {},
+		# incremented every time the contents of the index change
+		"generation": 0,
+		"checked": time.monotonic(),
+	}
+
+@timing_span("preview_index_build")
+def build_preview_index(path):
+	# walk the root once and record every preview file found
+	root_index = create_root_index(path)
+	scan_preview_tree(root_index, path)
+	rebuild_preview_lookups(root_index)
+	return root_index
+
+@timing_span("preview_index_check")
+def update_preview_index(root_index):
+	# compare the modified times recorded for each directory and rescan only the directories that have changed
+	# returns True if anything in the index changed
+	changed = False
+	if root_index["path"] not in root_index["dirs"]:
+		# the root didn't exist the last time it was checked, see if it has been created since
+		if get_mtime(root_index["path"]) is not None:
+			scan_preview_tree(root_index, root_index["path"])
+			changed = True
+	for dirpath, dir_entry in list(root_index["dirs"].items()):
+		mtime = get_mtime(dirpath)
+		if mtime is not None and mtime == dir_entry["mtime"] and \
+			(dir_entry["index_path"] is None or get_mtime(dir_entry["index_path"]) == dir_entry["index_mtime"]) and \
+			all(file_entry["mtime"] == get_mtime(file_entry["path"]) for file_entry in dir_entry["files"] if file_entry["type"] == "tags"):
+			# nothing in this directory changed
+			# (editing a file doesn't change the modified time of its directory, so index.txt and tags files are checked on their own)
+			continue
+		changed = True
+		# files or subdirectories were added, removed, renamed, or edited so scan the directory again
+		new_dir_entry = scan_preview_dir(dirpath) if mtime is not None else None
+		if new_dir_entry is None:
+			# the directory was removed
+			del root_index["dirs"][dirpath]
+			continue
+		root_index["dirs"][dirpath] = new_dir_entry
+		# scan any subdirectories that are new
+		for subdir in new_dir_entry["subdirs"]:
+			if os.path.join(dirpath, subdir) not in root_index["dirs"]:
+				scan_preview_tree(root_index, os.path.join(dirpath, subdir))
+	if changed:
+		rebuild_preview_lookups(root_index)
+	return changed
+
+def get_preview_index(path, force_check=False):
+	# get the index for a root, building it the first time it is requested and checking it for changes after that
+	with preview_index_lock:
+		root_lock = preview_index_root_locks.setdefault(path, threading.Lock())
+	with root_lock:
+		root_index = preview_index.get(path)
+		if root_index is None:
+			root_index = build_preview_index(path)
+			preview_index[path] = root_index
+		elif force_check or time.monotonic() - root_index["checked"] >= preview_index_check_interval:
+			update_preview_index(root_index)
+			root_index["checked"] = time.monotonic()
+		return root_index
+
+def seed_preview_index(path, root_index):
+	# use an index read from the catalog for a root that hasn't been indexed yet
+	# only the directories that changed since the catalog was built are scanned again
+	# returns False if the root was already indexed
+	with preview_index_lock:
+		root_lock = preview_index_root_locks.setdefault(path, threading.Lock())
+	with root_lock:
+		if path in preview_index:
+			return False
+		update_preview_index(root_index)
+		root_index["checked"] = time.monotonic()
+		preview_index[path] = root_index
+		return True
+
+def check_preview_index(paths):
+	# check the roots for changed directories right away instead of waiting for the check interval
+	for path in paths:
+		get_preview_index(path, force_check=True)
+
+def get_preview_index_generation(paths, force_check=False):
+	# get a value that changes whenever the index of any of the given roots changes
+	return tuple((path, get_preview_index(path, force_check)["generation"]) for path in paths)
+
+def find_loose_preview_files(root_index, model_name, remember=True):
+	# loose matching only requires the model name to show up somewhere in the file name, remember the result for each name
+	# (unless `remember` is False, for names that don't come from the model lists)
+	loose_lookup = root_index["loose"]
+	found_files = loose_lookup.get(model_name)
+	if found_files is None:
+		found_files = [file_entry for dir_entry in root_index["ordered_dirs"] for file_entry in dir_entry["files"]
+					   if model_name in file_entry["stem"]]
+		if remember:
+			loose_lookup[model_name] = found_files
+	return found_files
+
+def get_file_identity(file_entry):
+	# the same file reached through different paths (a symlinked directory) has the same identity
+	identity = file_entry["dir"]["identity"]
+	return (identity, file_entry["name"]) if identity is not None else file_entry["path"]
+
+def is_file_entry_in_directory(parent_dir, file_entry):
+	# is_in_directory for a file in the index, the answer is the same for every file in a directory so it is only worked out once
+	# (the directory entry is replaced when the directory changes, which starts the answers over)
+	dir_answers = file_entry["dir"]["in_directory"]
+	answer = dir_answers.get(parent_dir)
+	if answer is None:
+		answer = is_in_directory(parent_dir, file_entry["path"])
+		dir_answers[parent_dir] = answer
+	return answer
+
+@timing_span("find_preview_files")
+def find_preview_files(model_name, paths, matching_mode, remember=True):
+	# get the preview files for a model from the index as a list of (file entry, is generic) in the order they should be used
+	# a generic file is one that matched through an index.txt file and is only used if no specific file is found
+	# `remember` is passed on to find_loose_preview_files
+	found_files = []
+	# support the ability to check multiple paths
+	for path in paths:
+		root_index = get_preview_index(path)
+		if matching_mode == "Strict":
+			found_files.extend((file_entry, False) for file_entry in sorted(root_index["strict"].get(model_name, []), key=lambda entry: entry["order"]))
+		elif matching_mode == "Folder":
+			# use a folder name matching that only requires the model name to show up somewhere in the folder path not the file name
+			for dir_entry in root_index["folders"].get(model_name, []):
+				found_files.extend((file_entry, False) for file_entry in dir_entry["files"])
+		elif matching_mode == "Index":
+			strict_entries = root_index["strict"].get(model_name, [])
+			strict_files = set(id(file_entry) for file_entry in strict_entries)
+			# only the folders with a file strictly named after the model or an index.txt listing it can have its previews
+			relevant_dirs = {id(dir_entry): dir_entry for dir_entry in root_index["index"].get(model_name, [])}
+			relevant_dirs.update((id(file_entry["dir"]), file_entry["dir"]) for file_entry in strict_entries)
+			for dir_entry in sorted(relevant_dirs.values(), key=lambda entry: entry["order"]):
+				if dir_entry["index_models"] is None:
+					found_files.extend((file_entry, False) for file_entry in dir_entry["files"] if id(file_entry) in strict_files)
+					continue
+				index_model_set = dir_entry["index_model_set"]
+				index_has_model = model_name in index_model_set
+				for file_entry in dir_entry["files"]:
+					# ignore preview files that strictly match any of the other models in the index file
+					if file_entry["name"].lower() == "index.txt" or \
+						any(name != model_name and name in index_model_set for name in file_entry["strict_names"]):
+						continue
+					if id(file_entry) in strict_files:
+						found_files.append((file_entry, False))
+					elif index_has_model:
+						found_files.append((file_entry, True))
+		else:
+			found_files.extend((file_entry, False) for file_entry in find_loose_preview_files(root_index, model_name, remember))
+	# a directory reachable through more than one path gives the same file more than once, only use it the first time it is found
+	unique_files = []
+	seen_files = set()
+	for file_entry, is_generic in found_files:
+		file_identity = get_file_identity(file_entry)
+		if file_identity not in seen_files:
+			seen_files.add(file_identity)
+			unique_files.append((file_entry, is_generic))
+	return unique_files
@@ -0,0 +1,17 @@
+import re
+
+def natural_order_number(s):
+	# split a string into segments of strings and ints that will be used to sort naturally
+	return [int(x) if x.isdigit() else x.lower() for x in re.split('(\d+)', s)]
+
+def clean_modelname(modelname):
+	# remove the extension and the hash if it exists at the end of the model name (this is added by a1111) and
+	# if the model name contains a path (which happens when a checkpoint is in a subdirectory) just return the model name portion
+	return re.sub(r"(?i)(\.pt|\.bin|\.ckpt|\.safetensors)?( \[[a-f0-9]{10,12}\]|\([a-f0-9]{10,12}\))?$", "", modelname).split("\\")[-1].split("/")[-1]
+
+def split_number_suffix(name):
+	# split '{anything}.{number}' into the name and the number, the number is None if the name doesn't end with one
+	base, dot, number = name.rpartition(".")
+	if dot and number.isdecimal():
+		return base, int(number)
+	return name, None
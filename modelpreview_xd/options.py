@@ -0,0 +1,33 @@
+import os
+
+# the folder of the extension, the thumbnails and caches are saved in it unless the options say otherwise
+extension_directory = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# the options the engine works with, they are the extension's settings without the model_preview_xd_ prefix
+default_options = {
+	# how preview files are matched to models, "Loose", "Strict", "Folder" or "Index"
+	"name_matching": "Loose",
+	# how the filter matches models, "Exact" or "Fuzzy"
+	"filter_mode": "Exact",
+	# show smaller copies of large preview images, and the largest width and height of the copies
+	"thumbnails": True,
+	"thumbnail_size": 512,
+	# the number of images shown before the rest of a gallery is loaded, 0 shows every image at once
+	"gallery_page_size": 24,
+	# save the images of .civitai.info previews, and the size of the folder they are saved to in megabytes
+	"cache_images_civitai_info": False,
+	"civitai_cache_size": 512,
+	# the memory used to keep previews of recently viewed models in megabytes
+	"preview_cache_size": 64,
+	# the folder the thumbnails and caches are saved in
+	"cache_directory": extension_directory,
+	# files in this folder are linked to with gradio's file= links, any others through the extension's routes (None is the current directory)
+	"webui_directory": None,
+}
+
+def get_options(**options):
+	# get the default options with the given ones changed
+	return dict(default_options, **options)
+
+def get_webui_directory(options):
+	return options["webui_directory"] if options["webui_directory"] is not None else os.getcwd()
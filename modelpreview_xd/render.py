@@ -0,0 +1,341 @@
+import csv
+import html
+import os
+import threading
+import urllib.parse
+from collections import OrderedDict
+
+from .civitai import create_civitai_info_html, get_civitai_cache_directory, preview_render_state
+from .diskcache import get_disk_cache_evictions
+from .images import get_image_info, get_thumbnail
+from .index import find_preview_files, get_mtime, get_preview_index_generation, is_file_entry_in_directory
+from .names import split_number_suffix
+from .options import get_webui_directory
+from .timing import record_bytes, timing_span
+
+# the route the extension serves preview files from that are outside of the webui directory
+preview_file_route = "/sd-model-preview-xd/file/"
+
+def get_preview_file_url(file):
+	# create a link to a preview file through the extension's route, the modified time is added so the browser can cache it until it changes
+	absolute_path = os.path.abspath(file)
+	link_path = absolute_path.replace("\\", "/")
+	if link_path.startswith("/") and not link_path.startswith("//"):
+		# the route already ends with a slash, so the one a posix path starts with is added back when the link is served
+		# a windows network path (\\server\share) keeps both of its slashes so it isn't read as a relative path
+		link_path = link_path[1:]
+	encoded_file_path = urllib.parse.quote(link_path, safe='/:')
+	# the link is relative so it works the same way as file= links if the webui is served from a subpath
+	return f'{preview_file_route.lstrip("/")}{encoded_file_path}?v={get_mtime(absolute_path)}'
+
+@timing_span("html_iframe")
+def create_html_iframe(file, is_in_a1111_dir):
+	if is_in_a1111_dir:
+		# escape special URL characters from the filename
+		encoded_file_path = urllib.parse.quote(file, safe='/:\\')
+		# create the iframe html code
+		html_code = f'<iframe class="sdmpxd-iframe" src="file={encoded_file_path}"></iframe>'
+	else:
+		# the html file isnt located in the a1111 directory so gradio can't link to it, link to it through the extension's route instead
+		html_code = f'<iframe class="sdmpxd-iframe" src="{get_preview_file_url(file)}"></iframe>'
+	return html_code
+
+def get_image_order(file, matching_mode):
+	# set default order to 0
+	order = 0
+	# if strict naming is on, search the file name for a number at the end of the file and use that for its order
+	if matching_mode == "Strict":
+		# get the file name without extension
+		file_name, file_extension = os.path.splitext(os.path.basename(file))
+		# use the number of a '{anything}.{number}' file name
+		order = split_number_suffix(file_name)[1] or 0
+	return order
+
+# the route the later pages of a gallery are loaded from
+gallery_route = "/sd-model-preview-xd/gallery"
+
+def sort_gallery_images(image_files, matching_mode):
+	# put the images in the order they are shown so each page of the gallery continues from the last one
+	return sorted(image_files, key=lambda image_file: get_image_order(image_file[0], matching_mode))
+
+@timing_span("gallery_html")
+def create_gallery_html(image_files, tags_key, model_name, offset, options):
+	# create the html for a page of images, if there are more images add a button that loads the next page
+	page_size = int(options["gallery_page_size"])
+	if page_size <= 0 or tags_key is None:
+		page_size = len(image_files)
+	page_end = offset + page_size
+	html_code = ''.join(create_html_img(file_path, is_in_a1111_dir, options) for file_path, is_in_a1111_dir in image_files[offset:page_end])
+	remaining = len(image_files) - page_end
+	if remaining > 0:
+		# the link is relative so it works if the webui is served from a subpath, the javascript also clicks the button when it is scrolled to
+		more_src = f'{gallery_route.lstrip("/")}?tab={urllib.parse.quote(tags_key)}&model={urllib.parse.quote(model_name)}&offset={page_end}'
+		html_code += f'<div class="img-container-more" style="order:2147483647"><button class="modelpreview_xd_more_button" data-more-src="{html.escape(more_src)}" onclick="mp_loadMoreImages(event)">Show {remaining} more</button></div>\n'
+	return html_code
+
+def create_html_img(file, is_in_a1111_dir, options):
+	# create the html to display an image along with its meta data
+	# get the prompt data and size from the image headers (these are cached so the image isn't read again until it changes)
+	image_info = get_image_info(file)
+	metadata = image_info["prompt"]
+
+	# show a thumbnail in the gallery and only load the full image when it is clicked on
+	thumbnail_path = get_thumbnail(file, image_info, options) if options["thumbnails"] else None
+
+	order = get_image_order(file, options["name_matching"])
+	# the size of the image lets the browser lay out the gallery before the images have loaded
+	image_attributes = 'loading="lazy" decoding="async"'
+	if image_info["width"] is not None and image_info["height"] is not None:
+		image_attributes += f' width="{image_info["width"]}" height="{image_info["height"]}"'
+
+	if is_in_a1111_dir:
+		# escape special URL characters from the filename
+		encoded_file_path = urllib.parse.quote(file, safe='/:\\')
+		image_src = f'file={encoded_file_path}'
+	else:
+		# gradio can't link to the image so link to it through the extension's route instead
+		image_src = get_preview_file_url(file)
+
+	if thumbnail_path is not None:
+		# the thumbnails are saved in the extension folder so they can always be linked to
+		encoded_thumbnail_path = urllib.parse.quote(thumbnail_path, safe='/:\\')
+		# create the html for the image, the full image is opened by imageZoomIn
+		html_code = f'<div class="img-container" style="order:{order}"><img src="file={encoded_thumbnail_path}" data-full-src="{image_src}" {image_attributes} onclick="imageZoomIn(event)" />'
+	else:
+		# create the html for the image
+		html_code = f'<div class="img-container" style="order:{order}"><img src="{image_src}" {image_attributes} onclick="imageZoomIn(event)" />'
+
+	# if the image has prompt data in the meta data also add some elements to support copying the prompt to clipboard
+	if metadata is not None and metadata.strip() != "":
+		html_code += '<div class="img-meta-ico" title="Copy Metadata" onclick="metaDataCopy(event)"></div>'
+		html_code += f'<textarea class="img-meta">{metadata}</textarea>'
+	html_code += "</div>\n"
+	# return the html code
+	return html_code
+
+@timing_span("search_and_display_previews")
+def search_and_display_previews(model_name, paths, options, source_files=None, tags_key=None):
+	# `model_name` will be the name of the model to check for preview files for
+	# `options` are the engine options (see get_options)
+	# `source_files` if given is filled with the path and modified time of each preview file used
+	# `tags_key` if given is the tab the later pages of the image gallery are loaded for
+	# an array to hold the images found and if they are in the webui directory
+	image_files = []
+	# if a text file is found
+	found_txt_file = None
+	# if a markdown file is found
+	md_file = None
+	# if a prompts file is found
+	prompts_file = None
+	# if an html file is found the iframe
+	html_file_frame = None
+	# if an civitai.info file is found the generated html
+	civitai_info_html = None
+
+	# if a text file is found
+	generic_found_txt_file = None
+	# if a markdown file is found
+	generic_md_file = None
+	# if a prompts file is found
+	generic_prompts_file = None
+	# if an html file is found the iframe
+	generic_html_file_frame = None
+	# if an civitai.info file is found the generated html
+	generic_civitai_info_html = None
+
+	# get the webui directory so we can convert absolute paths to relative paths if we need to
+	current_directory = get_webui_directory(options)
+
+	# look up the preview files for the model in the index, they are returned in the order they should be applied
+	for file_entry, is_generic in find_preview_files(model_name, paths, options["name_matching"]):
+		file_path = file_entry["path"]
+		preview_type = file_entry["type"]
+		# record the modified time before the file is read, so if it changes while being read the result is seen as out of date
+		if source_files is not None:
+			source_files.append((file_path, get_mtime(file_path)))
+		# check if the path is a subdirectory of the install directory
+		is_in_a1111_dir = is_file_entry_in_directory(current_directory, file_entry)
+		if is_generic:
+			# files matched through an index.txt file are only used if a preview file specific to the model isn't found
+			if preview_type == "html":
+				# there can only be one html file, if one was already found it is replaced
+				generic_html_file_frame = create_html_iframe(file_path, is_in_a1111_dir)
+			elif preview_type == "civitai":
+				# there can only be one civitai.info file, if one was already found it is replaced
+				generic_civitai_info_html = create_civitai_info_html(file_path, options)
+			elif preview_type == "md":
+				# there can only be one markdown file, if one was already found it is replaced
+				generic_md_file = file_path
+			elif preview_type == "prompts":
+				# there can only be one prompts file, if one was already found it is replaced
+				generic_prompts_file = file_path
+			elif preview_type == "txt":
+				# there can only be one text file, if one was already found it is replaced
+				generic_found_txt_file = file_path
+		else:
+			if preview_type == "html":
+				# there can only be one html file, if one was already found it is replaced
+				html_file_frame = create_html_iframe(file_path, is_in_a1111_dir)
+			elif preview_type == "civitai":
+				# there can only be one civitai.info file, if one was already found it is replaced
+				civitai_info_html = create_civitai_info_html(file_path, options)
+			elif preview_type == "md":
+				# there can only be one markdown file, if one was already found it is replaced
+				md_file = file_path
+			elif preview_type == "prompts":
+				# there can only be one prompts file, if one was already found it is replaced
+				prompts_file = file_path
+			elif preview_type == "txt":
+				# there can only be one text file, if one was already found it is replaced
+				found_txt_file = file_path
+		# there can be many images, even spread across the multiple paths
+		if preview_type == "img":
+			image_files.append((file_path, is_in_a1111_dir))
+
+	# if a generic preview file was found but not a specific one, use the generic one
+	if html_file_frame is None and generic_html_file_frame is not None:
+		html_file_frame = generic_html_file_frame
+	if civitai_info_html is None and generic_civitai_info_html is not None:
+		civitai_info_html = generic_civitai_info_html
+	if md_file is None and generic_md_file is not None:
+		md_file = generic_md_file
+	if prompts_file is None and generic_prompts_file is not None:
+		prompts_file = generic_prompts_file
+	if found_txt_file is None and generic_found_txt_file is not None:
+		found_txt_file = generic_found_txt_file
+
+	# if an html file was found, ignore other txt, md, or image preview files and return the html file and prompt file if available
+	if html_file_frame is not None:
+		return html_file_frame, None, prompts_file, None
+
+	# if an civitai.info file was found, ignore other txt, md, or image preview files and return the html created and prompt file if available
+	if civitai_info_html is not None:
+		return civitai_info_html, None, prompts_file, None
+
+	# if there were images found, wrap the first page of images in a container div
+	html_code_output = '<div class="img-container-set">' + create_gallery_html(sort_gallery_images(image_files, options["name_matching"]), tags_key, model_name, 0, options) + '</div>' if len(image_files) > 0 else None
+
+	# return the all preview files found
+	return html_code_output, md_file, prompts_file, found_txt_file
+
+# the rendered previews of the models that were viewed, the least recently viewed are removed when it is over the size limit
+preview_cache = OrderedDict()
+preview_cache_lock = threading.Lock()
+preview_cache_size = 0
+preview_cache_stats = {"hits": 0, "misses": 0}
+# the options that change how a preview is rendered, they are part of the key of a rendered preview
+preview_cache_options = ["name_matching", "thumbnails", "thumbnail_size", "cache_images_civitai_info", "gallery_page_size", "cache_directory", "webui_directory"]
+
+def get_preview_cache_max_size(options):
+	# the option is in megabytes
+	return int(options["preview_cache_size"]) * 1024 * 1024
+
+def get_preview_cache_key(tags_key, name, paths, options):
+	return (tags_key, name, tuple(paths), *(options[option] for option in preview_cache_options))
+
+def get_preview_cache_version(paths, options):
+	# a cached preview is out of date if the preview files in its folders or the civitai image cache changed
+	return get_preview_index_generation(paths), get_disk_cache_evictions(get_civitai_cache_directory(options))
+
+def get_cached_preview(cache_key, version):
+	# get a rendered preview if it was built from the same version of the index and its files haven't been modified since
+	global preview_cache_size
+	with preview_cache_lock:
+		entry = preview_cache.get(cache_key)
+		if entry is not None:
+			if entry["version"] == version and all(get_mtime(path) == mtime for path, mtime in entry["source_files"]):
+				preview_cache.move_to_end(cache_key)
+				preview_cache_stats["hits"] += 1
+				return entry["rendered"]
+			del preview_cache[cache_key]
+			preview_cache_size -= entry["size"]
+		preview_cache_stats["misses"] += 1
+	return None
+
+def get_rendered_preview_size(rendered):
+	# estimate the memory used by a rendered preview from the length of its text
+	html_code, md_text, txt_text, prompts = rendered
+	return sum(len(text) for text in [html_code, md_text, txt_text] if text is not None) + sum(len(prompt) for prompt in prompts or [])
+
+def cache_preview(cache_key, version, source_files, rendered, max_size):
+	# keep a rendered preview and remove the least recently viewed previews until the cache fits in max_size
+	global preview_cache_size
+	entry = {"version": version, "source_files": source_files, "rendered": rendered, "size": get_rendered_preview_size(rendered)}
+	if entry["size"] > max_size:
+		return
+	with preview_cache_lock:
+		old_entry = preview_cache.pop(cache_key, None)
+		if old_entry is not None:
+			preview_cache_size -= old_entry["size"]
+		preview_cache[cache_key] = entry
+		preview_cache_size += entry["size"]
+		while preview_cache_size > max_size:
+			_, evicted_entry = preview_cache.popitem(last=False)
+			preview_cache_size -= evicted_entry["size"]
+
+@timing_span("render_preview")
+def render_preview(name, paths, options, source_files, tags_key):
+	# get the preview data, returns the html, markdown text, text, and prompts that were found for the model
+	html_code, found_md_file, found_prompts_file, found_txt_file = search_and_display_previews(name, paths, options, source_files, tags_key)
+
+	# read the text, markdown and prompts files
+	with timing_span("read_text_files"):
+		# if a text file was found read it
+		txt_text = None
+		if found_txt_file:
+			output_text = ""
+			with open(found_txt_file, "r", encoding="utf8") as file:
+				for line in file:
+					output_text = f'{output_text}{line.strip()}\n'
+			txt_text = output_text
+	
+		# if a markdown file was found read it
+		md_text = None
+		if found_md_file:
+			with open(found_md_file, "r", encoding="utf8") as file:
+				md_text = file.read()
+
+		# if a prompt file was found read the prompts from it
+		prompts = None
+		if found_prompts_file:
+			prompts = list()
+			with open(found_prompts_file, newline='') as csvfile:
+				reader = csv.reader(csvfile)
+				for row in reader:
+					for prompt in row:
+						if prompt not in prompts:
+							prompts.append(prompt)
+
+	return html_code, md_text, txt_text, prompts
+
+def get_preview(name, paths, options, tags_key=None):
+	# get the preview of a model as (html, markdown text, text, prompts), any of which can be None if it wasn't found
+	# `name` is the model name without its extension or hash (see clean_modelname), `paths` are the model folders to search
+	# `tags_key` if given is the tab the later pages of the image gallery are loaded for
+	# use the rendered preview from the last time this model was viewed if its files haven't changed
+	with timing_span("preview_cache_lookup"):
+		cache_key = get_preview_cache_key(tags_key, name, paths, options)
+		version = get_preview_cache_version(paths, options)
+		rendered = get_cached_preview(cache_key, version)
+	if rendered is None:
+		source_files = []
+		preview_render_state.complete = True
+		rendered = render_preview(name, paths, options, source_files, tags_key)
+		if preview_render_state.complete:
+			cache_preview(cache_key, version, source_files, rendered, get_preview_cache_max_size(options))
+	return rendered
+
+def get_preview_cache_info():
+	# how well the preview cache is doing
+	with preview_cache_lock:
+		return dict(preview_cache_stats, entries=len(preview_cache), size=preview_cache_size)
+
+def get_gallery_page(model_name, paths, tags_key, offset, options):
+	# get the html for a page of images in a model's gallery, the first page is part of the preview
+	# the name comes from a request, so a loose match isn't remembered (the preview of the model already did that)
+	current_directory = get_webui_directory(options)
+	with timing_span("gallery_page"):
+		image_files = [(file_entry["path"], is_file_entry_in_directory(current_directory, file_entry)) for file_entry, _ in find_preview_files(model_name, paths, options["name_matching"], remember=False) if file_entry["type"] == "img"]
+		gallery_html = create_gallery_html(sort_gallery_images(image_files, options["name_matching"]), tags_key, model_name, offset, options)
+	record_bytes("gallery_page", len(gallery_html))
+	return gallery_html
@@ -0,0 +1,94 @@
+from .index import get_file_identity, get_preview_index
+from .names import clean_modelname
+from .timing import timing_span
+
+def get_loose_owners(stem, owners_by_name, name_lengths):
+	# get every model whose name shows up somewhere in the file name by looking up each part of the name that is the same length as a model name
+	owners = []
+	for name_length in name_lengths:
+		for start in range(0, len(stem) - name_length + 1):
+			owners.extend(owners_by_name.get(stem[start:start + name_length], []))
+	return owners
+
+def get_tag_owners(file_entry, dir_entry, owners_by_name, name_lengths, matching_mode):
+	# get the models a tags file belongs to for the matching mode
+	stem = file_entry["stem"]
+	if matching_mode == "Strict":
+		# the file must be named {model}.tags
+		return owners_by_name.get(stem, [])
+	elif matching_mode == "Folder":
+		# the file belongs to every model that has a folder named after it in the path
+		return [owner for directory in dir_entry["directories"] for owner in owners_by_name.get(directory, [])]
+	elif matching_mode == "Index":
+		index_models = dir_entry["index_models"]
+		if index_models is None or stem in dir_entry["index_model_set"]:
+			# a file named after one of the models in the index only belongs to that model, otherwise use strict naming
+			return owners_by_name.get(stem, [])
+		# any other tags file in the folder belongs to every model in the index (as well as a model it is strictly named after)
+		return owners_by_name.get(stem, []) + [owner for index_model in index_models if index_model != stem for owner in owners_by_name.get(index_model, [])]
+	else:
+		return get_loose_owners(stem, owners_by_name, name_lengths)
+
+def read_tags_file(file_entry):
+	# read the text of a tags file, keeping it with the file's entry in the preview index
+	# (the entry is replaced when the file changes, and entries read from the catalog already hold the text)
+	output_text = file_entry.get("text")
+	if output_text is None:
+		with open(file_entry["path"], "r", encoding="utf8") as file:
+			output_text = file.read()
+		file_entry["text"] = output_text
+	return output_text
+
+def get_tag_files(root_index, owners_by_name, name_lengths, matching_mode):
+	# get each tags file in the root along with the models it belongs to
+	if matching_mode == "Folder":
+		# only the folders named after a model (and the folders below them) can hold its tags files, so go straight to those
+		for name, owners in owners_by_name.items():
+			for dir_entry in root_index["folders"].get(name, []):
+				for file_entry in dir_entry["files"]:
+					if file_entry["type"] == "tags":
+						yield file_entry, owners
+		return
+	# loop through all the directories in the preview index for the path
+	for dir_entry in root_index["ordered_dirs"]:
+		# check each file to see if it is a tags file
+		for file_entry in dir_entry["files"]:
+			if file_entry["type"] == "tags":
+				yield file_entry, get_tag_owners(file_entry, dir_entry, owners_by_name, name_lengths, matching_mode)
+
+@timing_span("search_for_tags")
+def search_for_tags(model_names, model_tags, paths, matching_mode):
+	# fill `model_tags` with the text of the tags files of each model, keyed by the model names
+	# group the models by their clean name so each tags file can find the models it belongs to with a lookup
+	owners_by_name = {}
+	for model_name in model_names:
+		owners_by_name.setdefault(clean_modelname(model_name), []).append(model_name)
+	# the lengths of the model names, used to check the parts of a file name for loose matching
+	name_lengths = sorted(set(len(name) for name in owners_by_name if len(name) > 0))
+
+	found_tags = {}
+	# the tags files added to each model, so a file reached through more than one path (a symlinked directory) is only added once
+	added_files = set()
+	# support the ability to check multiple paths
+	for path in paths:
+		for file_entry, owners in get_tag_files(get_preview_index(path), owners_by_name, name_lengths, matching_mode):
+			if len(owners) == 0:
+				continue
+			# read the file once no matter how many models it belongs to
+			output_text = read_tags_file(file_entry)
+			if output_text.strip() == "":
+				continue
+			# a model can be listed more than once (for example when it is in the index and strictly named), only add the tags once
+			file_identity = get_file_identity(file_entry)
+			for model_name in dict.fromkeys(owners):
+				if (model_name, file_identity) in added_files:
+					continue
+				added_files.add((model_name, file_identity))
+				if model_name in found_tags:
+					found_tags[model_name] += f", {output_text}"
+				else:
+					found_tags[model_name] = output_text
+
+	# replace the tags all at once so a preview being built at the same time doesn't see a partial list
+	model_tags.clear()
+	model_tags.update(found_tags)
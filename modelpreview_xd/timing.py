@@ -0,0 +1,97 @@
+import contextlib
+import math
+import threading
+import time
+from collections import deque
+
+# the timings of each stage of building previews and model lists, served as json from the stats route
+timing_stats = {}
+timing_stats_lock = threading.Lock()
+# the number of recent timings of each stage kept to estimate the percentiles from
+timing_sample_limit = 1024
+# the stages timed so far for the preview or model list being built on this thread, used for the slow request log
+timing_state = threading.local()
+
+def get_timing_entry(stage):
+	# get the stats of a stage, must be called holding the stats lock
+	entry = timing_stats.get(stage)
+	if entry is None:
+		entry = {"count": 0, "total": 0.0, "max": 0.0, "bytes": 0, "samples": deque(maxlen=timing_sample_limit)}
+		timing_stats[stage] = entry
+	return entry
+
+def record_timing(stage, elapsed):
+	# add how long a stage took to its stats and to the request being timed on this thread
+	with timing_stats_lock:
+		entry = get_timing_entry(stage)
+		entry["count"] += 1
+		entry["total"] += elapsed
+		entry["max"] = max(entry["max"], elapsed)
+		entry["samples"].append(elapsed)
+	request_stages = getattr(timing_state, "stages", None)
+	if request_stages is not None:
+		request_stages[stage] = request_stages.get(stage, 0.0) + elapsed
+
+def record_bytes(stage, byte_count):
+	# add to the amount of html and text a stage sent to the browser
+	with timing_stats_lock:
+		get_timing_entry(stage)["bytes"] += byte_count
+
+@contextlib.contextmanager
+def timing_span(stage):
+	# time a stage, can be used with `with` around part of a function or as a decorator around the whole function
+	start = time.perf_counter()
+	try:
+		yield
+	finally:
+		record_timing(stage, time.perf_counter() - start)
+
+def label_request(label):
+	# name what the request being timed on this thread is for (like the model being previewed) in the slow request log
+	timing_state.label = label
+
+@contextlib.contextmanager
+def timed_request(stage, get_slow_threshold=None):
+	# time a preview or model list and log the time of each of its stages if it was slower than the threshold
+	# `get_slow_threshold` returns the threshold in milliseconds when the request finishes, 0 or None turns the log off
+	if getattr(timing_state, "stages", None) is not None:
+		# a request started from inside another one is just a stage of the outer request
+		with timing_span(stage):
+			yield
+		return
+	timing_state.stages = {}
+	timing_state.label = None
+	start = time.perf_counter()
+	try:
+		yield
+	finally:
+		elapsed = time.perf_counter() - start
+		request_stages = timing_state.stages
+		label = timing_state.label
+		timing_state.stages = None
+		record_timing(stage, elapsed)
+		threshold = get_slow_threshold() if get_slow_threshold is not None else None
+		if threshold and threshold > 0 and elapsed * 1000 >= threshold:
+			breakdown = ", ".join(f"{name} {seconds * 1000:.1f} ms" for name, seconds in sorted(request_stages.items(), key=lambda item: item[1], reverse=True))
+			print(f"SD Model Preview slow {stage}{'' if label is None else f' for {label}'}: {elapsed * 1000:.1f} ms ({breakdown or 'no stages timed'})")
+
+def get_timing_percentile(samples, percentile):
+	# the nearest rank percentile of a sorted list of timings
+	return samples[max(0, math.ceil(percentile * len(samples)) - 1)]
+
+def get_timing_stats():
+	# summarize the timings of each stage, times are in milliseconds
+	stages = {}
+	with timing_stats_lock:
+		for stage, entry in timing_stats.items():
+			samples = sorted(entry["samples"])
+			stages[stage] = {
+				"count": entry["count"],
+				"total_ms": entry["total"] * 1000,
+				"mean_ms": entry["total"] * 1000 / entry["count"] if entry["count"] > 0 else 0.0,
+				"p50_ms": get_timing_percentile(samples, 0.5) * 1000 if len(samples) > 0 else None,
+				"p95_ms": get_timing_percentile(samples, 0.95) * 1000 if len(samples) > 0 else None,
+				"max_ms": entry["max"] * 1000,
+				"bytes": entry["bytes"]
+			}
+	return stages
@@ -1,98 +1,111 @@
-import json
 import inspect
 import os
 import os.path
 import re
-import urllib
-import requests
+import threading
 import gradio as gr # type: ignore
-from modules import script_callbacks, sd_models, shared, images, scripts # type: ignore
+from modules import script_callbacks, sd_models, shared, scripts # type: ignore
 import modules.textual_inversion.textual_inversion # type: ignore
 current_extension_directory = scripts.basedir()
-from PIL import Image
 import base64
-import csv
-from io import BytesIO
-from lxml_html_clean.clean import Cleaner
+import email.utils
+import secrets
+from fastapi import Depends, HTTPException, Request
+from starlette.responses import FileResponse, Response
 
 import importlib.util
+import sys
+
+# the preview matching, indexing and rendering is done by the modelpreview_xd package in the extension folder
+# the webui puts the extension folder on the path while it loads the script, add it if the script was loaded some other way
+extension_directory_on_path = current_extension_directory in sys.path
+if not extension_directory_on_path:
+	sys.path.insert(0, current_extension_directory)
+try:
+	from modelpreview_xd import (build_choice_map, build_filter_index, check_preview_index, civitai_cache_key_pattern, civitai_cache_route,
+		clean_modelname, default_preview_catalog_path, filter_choices, find_choice, gallery_route, get_civitai_cache_directory, get_fuzzy_index, get_gallery_page, get_options,
+		get_preview, get_preview_cache_info, get_preview_index_generation, get_rendered_preview_size, get_timing_stats, label_request,
+		load_preview_catalog, natural_order_number, preview_file_route, read_disk_cache, record_bytes, search_for_tags, timed_request, timing_span)
+finally:
+	if not extension_directory_on_path:
+		sys.path.remove(current_extension_directory)
+
+# the modules of other extensions that were found, keyed by the file they were loaded from
+resolved_modules = {}
+# modules that weren't loaded by the webui so they had to be executed here, keyed the same way
+executed_modules = {}
+# the cleaned up model names of each extension's model dict, reused until the dict's keys change
+model_names_cache = {}
+
+def find_loaded_module(origin):
+	# the webui loads extension scripts under its own module names, so match the loaded modules by their file
+	origin = os.path.normcase(os.path.abspath(origin))
+	for module in list(sys.modules.values()):
+		module_file = getattr(module, "__file__", None)
+		if module_file and os.path.normcase(os.path.abspath(module_file)) == origin:
+			return module
+	return None
+
+def resolve_module(possible_modules, reload=False):
+	# get the module another extension has already loaded so its state and model lists are shared with it
+	# the module is only executed here if the webui hasn't loaded it, or if a reload is asked for
+	for module_name in possible_modules:
+		try:
+			spec = importlib.util.find_spec(module_name)
+			if not spec or not spec.origin:
+				continue
+			if not reload:
+				module = resolved_modules.get(spec.origin)
+				# the webui creates new modules when it reloads the scripts, so make sure this one is still current
+				if module is None or sys.modules.get(module.__name__) is not module:
+					module = find_loaded_module(spec.origin)
+				if module is not None:
+					resolved_modules[spec.origin] = module
+					return module
+				module = executed_modules.get(spec.origin)
+				if module is not None:
+					return module
+			module = importlib.util.module_from_spec(spec)
+			spec.loader.exec_module(module)
+			executed_modules[spec.origin] = module
+			return module
+		except:
+			pass
+	return None
 
-def import_lora_module():
+def get_model_names(models, strip_hash):
+	# get the names from an extension's model dict, without the None item and optionally without the hash
+	model_keys = tuple(models.keys())
+	cache_key = (id(models), strip_hash)
+	cached = model_names_cache.get(cache_key)
+	if cached is not None and cached[0] == model_keys:
+		return cached[1]
+	model_names = [re.sub(r'\([a-fA-F0-9]{10,12}\)$', '', model) if strip_hash else model for model in model_keys if model != "None"]
+	model_names_cache[cache_key] = (model_keys, model_names)
+	return model_names
+
+def import_lora_module(reload=False):
 	# import/update the lora module if its available
-	try:
-		spec = importlib.util.find_spec('extensions.sd-webui-additional-networks.scripts.model_util')
-		if spec:
-			additional_networks = importlib.util.module_from_spec(spec)
-			spec.loader.exec_module(additional_networks)
-		else:
-			additional_networks = None
-	except:
-		additional_networks = None
-	return additional_networks
+	return resolve_module(['extensions.sd-webui-additional-networks.scripts.model_util'], reload)
 
-def import_lora_module_builtin():
+def import_lora_module_builtin(reload=False):
 	# import/update the lora module if its available from the builtin extensions
 
 	possible_lora_modules = [
 		'extensions-builtin.Lora.lora',
 		'extensions-builtin.sd_forge_lora.lora'
 	]
-	for module in possible_lora_modules:
-		try:
-			spec = importlib.util.find_spec(module)
-			if spec:
-				additional_networks_builtin = importlib.util.module_from_spec(spec)
-				spec.loader.exec_module(additional_networks_builtin)
-				return additional_networks_builtin
-		except:
-			pass
-	return None
+	return resolve_module(possible_lora_modules, reload)
 
 
-def import_lycoris_module():
+def import_lycoris_module(reload=False):
 	# import/update the lycoris module if it's available
 
 	possible_lycoris_modules = [
 		'extensions-builtin.a1111-sd-webui-lycoris.lycoris',
 		'extensions.a1111-sd-webui-lycoris.lycoris'
 	]
-	for module in possible_lycoris_modules:
-		try:
-			spec = importlib.util.find_spec(module)
-			if spec:
-				loaded_lycoris_module = importlib.util.module_from_spec(spec)
-				spec.loader.exec_module(loaded_lycoris_module)
-				return loaded_lycoris_module
-		except:
-			pass
-
-	return None
-
-# define a global Cleaner instance with specific options for sanitization
-cleaner = Cleaner(
-    safe_attrs_only=True,  # Only allow safe attributes
-    host_whitelist=set(['www.youtube.com'])
-)
-
-def sanitize_html(html_content):
-    # check if the HTML content is empty, if so we dont have to do anything, return an empty string
-    if html_content is None or not html_content.strip():
-        return ""
-
-    # check if the entire HTML string is surrounded in comment tags (This is done by some civitai extensions)
-    if html_content.strip().startswith('<!--') and html_content.strip().endswith('-->'):
-        # Remove the comment tags
-        html_content = html_content.strip()[4:-3].strip()
-
-    try:
-        # clean the HTML content using the global Cleaner instance
-        cleaned_html = cleaner.clean_html(html_content)
-    except Exception as e:
-        # if there is an error cleaning the HTML, return "Unable to parse HTML"
-        return "Unable to parse HTML"
-
-	# return the cleaned HTML
-    return cleaned_html
+	return resolve_module(possible_lycoris_modules, reload)
 
 embedding_db = None
 
@@ -106,38 +119,6 @@ lycoris_module = import_lycoris_module()
 refresh_symbol = '🔄'
 update_symbol = '↙️'
 
-html_ext_pattern = r'html'
-civitai_ext_pattern = r'civitai.info'
-md_ext_pattern = r'md'
-txt_ext_pattern = r'txt'
-tags_ext_pattern = r'tags'
-prompts_ext_pattern = r'(?:prompt|prompts)'
-img_ext_pattern = r'(?:png|jpg|jpeg|webp|jxk|avif)'
-all_ext_pattern = r'(?:' + html_ext_pattern\
-				  + r'|' + civitai_ext_pattern\
-				  + r'|' + md_ext_pattern\
-				  + r'|' + txt_ext_pattern\
-				  + r'|' + tags_ext_pattern\
-				  + r'|' + prompts_ext_pattern\
-				  + r'|' + img_ext_pattern\
-				  + r')'
-
-def is_in_directory(parent_dir, child_path):
-	# get the directory of the child path
-	child_dir = os.path.dirname(child_path)
-
-	# get the absolute paths of both directories
-	parent_dir = os.path.abspath(os.path.realpath(parent_dir))
-	child_dir = os.path.abspath(os.path.realpath(child_dir))
-
-	# return false if either directory is not a valid directory
-	if not os.path.isdir(parent_dir) or not os.path.isdir(child_dir):
-		return False
-
-	# get the common prefix of the paths to see if the child dir is in the parent
-	common_prefix = os.path.commonprefix([parent_dir, child_dir])
-	return common_prefix == parent_dir and child_dir != parent_dir
-
 def is_dir_in_list(dir_list, check_dir):
 	# Convert all directories in the list to absolute paths
 	dir_list = [os.path.abspath(d) for d in dir_list]
@@ -149,15 +130,6 @@ def is_dir_in_list(dir_list, check_dir):
 			return True
 	return False
 
-def natural_order_number(s):
-	# split a string into segments of strings and ints that will be used to sort naturally
-	return [int(x) if x.isdigit() else x.lower() for x in re.split('(\d+)', s)]
-
-def clean_modelname(modelname):
-	# remove the extension and the hash if it exists at the end of the model name (this is added by a1111) and
-	# if the model name contains a path (which happens when a checkpoint is in a subdirectory) just return the model name portion
-	return re.sub(r"(?i)(\.pt|\.bin|\.ckpt|\.safetensors)?( \[[a-f0-9]{10,12}\]|\([a-f0-9]{10,12}\))?$", "", modelname).split("\\")[-1].split("/")[-1]
-
 # keep a copy of the choices to give control to user when to refresh
 checkpoint_choices = []
 embedding_choices = []
@@ -172,73 +144,77 @@ tags = {
 	"lycoris": {}
 }
 
-def search_for_tags(model_names, model_tags, paths):
-	model_tags.clear()
-	general_tag_pattern = re.compile(r'^.*(?i:\.tags)$')
-
-	# support the ability to check multiple paths
-	for path in paths:
-		# loop through all files in the path and any subdirectories
-		for dirpath, dirnames, filenames in os.walk(path, followlinks=True):
-			# get a list of all parent directories
-			directories = dirpath.split(os.path.sep)
-
-			index_models = []
-			if shared.opts.model_preview_xd_name_matching == "Index":
-				index_txt_filename = next((filename for filename in filenames if filename.lower() == "index.txt"), None)
-				if index_txt_filename is not None:
-					index_txt_path = os.path.join(dirpath, index_txt_filename)
-					output_text = ""
-					with open(index_txt_path, "r", encoding="utf8") as file:
-						output_text = file.read()
-					index_models = [model.strip() for model in output_text.replace(",", "\n").splitlines()]
-
-			# check each file to see if it is a preview file
-			for filename in filenames:
-				file_path = os.path.join(dirpath, filename)
-				if general_tag_pattern.match(filename):
-					for model_name in model_names:
-						clean_model_name = clean_modelname(model_name)
-
-						# if we are not using folder match mode look for files normally otherwise we are using folder match mode so make sure at least one parent directory is equal to the name of the model
-						if shared.opts.model_preview_xd_name_matching == "Folder" and clean_model_name not in directories:
-							continue
-
-						index_has_model = False
-						index_models_pattern = None
-						if shared.opts.model_preview_xd_name_matching == "Index":
-							index_has_model = clean_model_name in index_models
-							filtered_index_models = [re.escape(model) for model in index_models if model != clean_model_name]
-							if len(filtered_index_models) > 0:
-								index_models_pattern = re.compile(r'^(?:' + r'|'.join(filtered_index_models) + r')(?i:\.' + tags_ext_pattern + r')$')
-								if index_models_pattern.match(filename):
-									continue
-
-						if shared.opts.model_preview_xd_name_matching == "Strict" or (not index_has_model and shared.opts.model_preview_xd_name_matching == "Index"):
-							tag_pattern = re.compile(r'^' + re.escape(clean_model_name) + r'(?i:\.' + tags_ext_pattern + r')$')
-						elif shared.opts.model_preview_xd_name_matching == "Folder" or (index_has_model and shared.opts.model_preview_xd_name_matching == "Index"):
-							tag_pattern = re.compile(r'^.*(?i:\.' + tags_ext_pattern + r')$')
-						else:
-							tag_pattern = re.compile(r'^.*' + re.escape(clean_model_name) + r'.*(?i:\.' + tags_ext_pattern + r')$')
-
-						if tag_pattern.match(filename):
-							output_text = ""
-							with open(file_path, "r", encoding="utf8") as file:
-								output_text = file.read()
-							if output_text.strip() != "":
-								if model_name in model_tags:
-									model_tags[model_name] += f", {output_text}"
-								else:
-									model_tags[model_name] = output_text
+# the version of the preview index the tags for each tab were collected from
+tags_generations = {}
+# the token index of the model names and tags of each tab that the filter textbox is answered from
+filter_indexes = {}
+# the choices of each tab by their cleaned up name, used to select the model a card was clicked for
+choice_maps = {}
+
+def get_preview_options():
+	# the settings the preview engine uses, read each time so changes to the settings are used right away
+	return get_options(
+		name_matching=shared.opts.model_preview_xd_name_matching,
+		filter_mode=shared.opts.model_preview_xd_filter_mode,
+		thumbnails=shared.opts.model_preview_xd_thumbnails,
+		thumbnail_size=shared.opts.model_preview_xd_thumbnail_size,
+		gallery_page_size=shared.opts.model_preview_xd_gallery_page_size,
+		cache_images_civitai_info=shared.opts.model_preview_xd_cache_images_civitai_info,
+		civitai_cache_size=shared.opts.model_preview_xd_civitai_cache_size,
+		preview_cache_size=shared.opts.model_preview_xd_preview_cache_size,
+		cache_directory=current_extension_directory
+	)
 
+def get_slow_request_threshold():
+	return shared.opts.model_preview_xd_slow_request_threshold
+
+def collect_tags(tags_key, model_names, paths):
+	# collect the tags for a tab and remember which version of the preview index they came from
+	tags_generations[tags_key] = get_preview_index_generation(paths)
+	search_for_tags(model_names, tags[tags_key], paths, shared.opts.model_preview_xd_name_matching)
+	# index the names and tags the filter searches
+	with timing_span("filter_index"):
+		filter_indexes[tags_key] = build_filter_index(model_names, tags[tags_key])
+		choice_maps[tags_key] = build_choice_map(model_names)
+		if shared.opts.model_preview_xd_filter_mode == "Fuzzy":
+			get_fuzzy_index(model_names, tags[tags_key], filter_indexes[tags_key])
+
+def build_fuzzy_indexes():
+	# build the fuzzy index of each model list that was already collected, so the first fuzzy filter doesn't have to
+	for tags_key, filter_index in list(filter_indexes.items()):
+		with timing_span("filter_index"):
+			get_fuzzy_index(filter_index["choices"], tags[tags_key], filter_index)
+
+def on_filter_mode_change():
+	# the lists collected while the filter was exact don't have a fuzzy index yet, build them in the background
+	if shared.opts.model_preview_xd_filter_mode == "Fuzzy":
+		threading.Thread(target=build_fuzzy_indexes, name="sd-model-preview-xd-fuzzy-index", daemon=True).start()
+
+def get_model_choices(tags_key):
+	# get the current list of choices for a tab
+	return {
+		"checkpoints": checkpoint_choices,
+		"embeddings": embedding_choices,
+		"hypernetworks": hypernetwork_choices,
+		"loras": lora_choices,
+		"lycoris": lycoris_choices
+	}[tags_key]
+
+def refresh_changed_tags(tags_key, paths):
+	# collect the tags for a tab again if any preview files changed since they were last collected
+	if tags_key in tags_generations and get_preview_index_generation(paths) != tags_generations[tags_key]:
+		collect_tags(tags_key, get_model_choices(tags_key), paths)
+
+@timed_request("list_all_models", get_slow_request_threshold)
 def list_all_models():
 	global checkpoint_choices
 	# gets the list of checkpoints
 	model_list = sd_models.checkpoint_tiles()
 	checkpoint_choices = sorted(model_list, key=natural_order_number)
-	search_for_tags(checkpoint_choices, tags["checkpoints"], get_checkpoints_dirs())
+	collect_tags("checkpoints", checkpoint_choices, get_checkpoints_dirs())
 	return checkpoint_choices
 
+@timed_request("list_all_embeddings", get_slow_request_threshold)
 def list_all_embeddings():
 	global embedding_choices, embedding_db
 	# Embeddings may not have been loaded yet. (Fixes empty embeddings list on startup) -n15g
@@ -253,17 +229,19 @@ def list_all_embeddings():
 	list = [x for x in embedding_db.word_embeddings.keys()]
 	list.extend([x for x in embedding_db.skipped_embeddings.keys()])
 	embedding_choices = sorted(list, key=natural_order_number)
-	search_for_tags(embedding_choices, tags["embeddings"], get_embedding_dirs())
+	collect_tags("embeddings", embedding_choices, get_embedding_dirs())
 	return embedding_choices
 
+@timed_request("list_all_hypernetworks", get_slow_request_threshold)
 def list_all_hypernetworks():
 	global hypernetwork_choices
 	# get the list of hyperlinks
 	list = [x for x in shared.hypernetworks.keys()]
 	hypernetwork_choices = sorted(list, key=natural_order_number)
-	search_for_tags(hypernetwork_choices, tags["hypernetworks"], get_hypernetwork_dirs())
+	collect_tags("hypernetworks", hypernetwork_choices, get_hypernetwork_dirs())
 	return hypernetwork_choices
 
+@timed_request("list_all_loras", get_slow_request_threshold)
 def list_all_loras():
 	global lora_choices, additional_networks, additional_networks_builtin
 	# create an empty set for lora models
@@ -272,28 +250,21 @@ def list_all_loras():
 	# import/update the lora module
 	additional_networks = import_lora_module()
 	if additional_networks is not None:
-		# copy the list of models
-		loras_list = additional_networks.lora_models.copy()
-		# remove the None item from the list
-		loras_list.pop("None", None)
-		# remove hash from model
-		loras_list = [re.sub(r'\([a-fA-F0-9]{10,12}\)$', '', model) for model in loras_list.keys()]
-		loras.update(loras_list)
+		# get the names of the models without the hash
+		loras.update(get_model_names(additional_networks.lora_models, True))
 
 	# import/update the builtin lora module
 	additional_networks_builtin = import_lora_module_builtin()
 	if additional_networks_builtin is not None:
-		# copy the list of models
-		loras_list = additional_networks_builtin.available_loras.copy()
-		# remove the None item from the list
-		loras_list.pop("None", None)
-		loras.update(loras_list.keys())
+		# get the names of the models
+		loras.update(get_model_names(additional_networks_builtin.available_loras, False))
 
 	# return the list
 	lora_choices = sorted(loras, key=natural_order_number)
-	search_for_tags(lora_choices, tags["loras"], get_lora_dirs())
+	collect_tags("loras", lora_choices, get_lora_dirs())
 	return lora_choices
 
+@timed_request("list_all_lycorii", get_slow_request_threshold)
 def list_all_lycorii():
 	global lycoris_choices, lycoris_module
 	# create an empty set for lycoris models
@@ -302,554 +273,149 @@ def list_all_lycorii():
 	# import/update the lycoris module
 	lycoris_module = import_lycoris_module()
 	if lycoris_module is not None:
-		# copy the list of models
-		lycorii_list = lycoris_module.available_lycos.copy()
-		# remove the None item from the list
-		lycorii_list.pop("None", None)
-		# remove hash from model
-		lycorii_list = [re.sub(r'\([a-fA-F0-9]{10,12}\)$', '', lyco) for lyco in lycorii_list.keys()]
-		lycorii.update(lycorii_list)
+		# get the names of the models without the hash
+		lycorii.update(get_model_names(lycoris_module.available_lycos, True))
 
 	# return the list
 	lycoris_choices = sorted(lycorii, key=natural_order_number)
-	search_for_tags(lycoris_choices, tags["lycoris"], get_lycoris_dirs())
+	collect_tags("lycoris", lycoris_choices, get_lycoris_dirs())
 	return lycoris_choices
 
 def refresh_models(choice = None, filter = None):
-	global checkpoint_choices
-	# update the choices for the checkpoint list
-	checkpoint_choices = list_all_models()
+	# check the preview files for changes now so new or removed files are picked up
+	check_preview_index(get_checkpoints_dirs())
+	# update the choices for the checkpoint list, if the tab hasn't been used yet it is built when it is
+	if not refresh_catalog("checkpoints", list_all_models):
+		return gr.Dropdown.update(), *show_model_preview(choice)
 	return filter_models(filter), *show_model_preview(choice)
 
 def refresh_embeddings(choice = None, filter = None):
-	global embedding_choices
-	# update the choices for the embeddings list
-	embedding_choices = list_all_embeddings()
+	# check the preview files for changes now so new or removed files are picked up
+	check_preview_index(get_embedding_dirs())
+	# update the choices for the embeddings list, if the tab hasn't been used yet it is built when it is
+	if not refresh_catalog("embeddings", list_all_embeddings):
+		return gr.Dropdown.update(), *show_embedding_preview(choice)
 	return filter_embeddings(filter), *show_embedding_preview(choice)
 
 def refresh_hypernetworks(choice = None, filter = None):
-	global hypernetwork_choices
-	# update the choices for the hypernetworks list
-	hypernetwork_choices = list_all_hypernetworks()
+	# check the preview files for changes now so new or removed files are picked up
+	check_preview_index(get_hypernetwork_dirs())
+	# update the choices for the hypernetworks list, if the tab hasn't been used yet it is built when it is
+	if not refresh_catalog("hypernetworks", list_all_hypernetworks):
+		return gr.Dropdown.update(), *show_hypernetwork_preview(choice)
 	return filter_hypernetworks(filter), *show_hypernetwork_preview(choice)
 
 def refresh_loras(choice = None, filter = None):
-	global lora_choices
-	# update the choices for the lora list
-	lora_choices = list_all_loras()
+	# check the preview files for changes now so new or removed files are picked up
+	check_preview_index(get_lora_dirs())
+	# update the choices for the lora list, if the tab hasn't been used yet it is built when it is
+	if not refresh_catalog("loras", list_all_loras):
+		return gr.Dropdown.update(), *show_lora_preview(choice)
 	return filter_loras(filter), *show_lora_preview(choice)
 
 def refresh_lycorii(choice = None, filter = None):
-	global lycoris_choices
-	# update the choices for the lycoris list
-	lycoris_choices = list_all_lycorii()
+	# check the preview files for changes now so new or removed files are picked up
+	check_preview_index(get_lycoris_dirs())
+	# update the choices for the lycoris list, if the tab hasn't been used yet it is built when it is
+	if not refresh_catalog("lycoris", list_all_lycorii):
+		return gr.Dropdown.update(), *show_lycoris_preview(choice)
 	return filter_lycorii(filter), *show_lycoris_preview(choice)
 
-def filter_choices(choices, filter, tags_obj):
-	filtered_choices = choices
-	if filter is not None and filter.strip() != "":
-		# filter the choices based on the provided filter string
-		filter_tags = [tag.strip().lower() for tag in filter.split(",")]
-		filtered_choices = [choice for choice in filtered_choices if
-							all(tag in tags_obj.get(choice, '').lower() for tag in filter_tags) or
-							all(tag in choice.lower() for tag in filter_tags)]
-	return filtered_choices
-
 def filter_models(filter=None):
-	filtered_checkpoint_choices = filter_choices(checkpoint_choices, filter, tags["checkpoints"])
+	# build the list the first time it is needed
+	ensure_catalog("checkpoints", list_all_models)
+	# make sure the tags are up to date with the preview files before filtering on them
+	refresh_changed_tags("checkpoints", get_checkpoints_dirs())
+	filtered_checkpoint_choices = filter_choices(checkpoint_choices, filter, tags["checkpoints"], filter_indexes.get("checkpoints"), shared.opts.model_preview_xd_filter_mode)
 	return gr.Dropdown.update(choices=filtered_checkpoint_choices)
 
 def filter_embeddings(filter=None):
-	filtered_embedding_choices = filter_choices(embedding_choices, filter, tags["embeddings"])
+	# build the list the first time it is needed
+	ensure_catalog("embeddings", list_all_embeddings)
+	# make sure the tags are up to date with the preview files before filtering on them
+	refresh_changed_tags("embeddings", get_embedding_dirs())
+	filtered_embedding_choices = filter_choices(embedding_choices, filter, tags["embeddings"], filter_indexes.get("embeddings"), shared.opts.model_preview_xd_filter_mode)
 	return gr.Dropdown.update(choices=filtered_embedding_choices)
 
 def filter_hypernetworks(filter=None):
-	filtered_hypernetwork_choices = filter_choices(hypernetwork_choices, filter, tags["hypernetworks"])
+	# build the list the first time it is needed
+	ensure_catalog("hypernetworks", list_all_hypernetworks)
+	# make sure the tags are up to date with the preview files before filtering on them
+	refresh_changed_tags("hypernetworks", get_hypernetwork_dirs())
+	filtered_hypernetwork_choices = filter_choices(hypernetwork_choices, filter, tags["hypernetworks"], filter_indexes.get("hypernetworks"), shared.opts.model_preview_xd_filter_mode)
 	return gr.Dropdown.update(choices=filtered_hypernetwork_choices)
 
 def filter_loras(filter=None):
-	filtered_lora_choices = filter_choices(lora_choices, filter, tags["loras"])
+	# build the list the first time it is needed
+	ensure_catalog("loras", list_all_loras)
+	# make sure the tags are up to date with the preview files before filtering on them
+	refresh_changed_tags("loras", get_lora_dirs())
+	filtered_lora_choices = filter_choices(lora_choices, filter, tags["loras"], filter_indexes.get("loras"), shared.opts.model_preview_xd_filter_mode)
 	return gr.Dropdown.update(choices=filtered_lora_choices)
 
 def filter_lycorii(filter=None):
-	filtered_lycoris_choices = filter_choices(lycoris_choices, filter, tags["lycoris"])
+	# build the list the first time it is needed
+	ensure_catalog("lycoris", list_all_lycorii)
+	# make sure the tags are up to date with the preview files before filtering on them
+	refresh_changed_tags("lycoris", get_lycoris_dirs())
+	filtered_lycoris_choices = filter_choices(lycoris_choices, filter, tags["lycoris"], filter_indexes.get("lycoris"), shared.opts.model_preview_xd_filter_mode)
 	return gr.Dropdown.update(choices=filtered_lycoris_choices)
 
 def update_checkpoint(name):
+	# build the list the first time it is needed so the name can be matched to a choice
+	ensure_catalog("checkpoints", list_all_models)
 	# update the selected preview for checkpoint tab
-	new_choice = find_choice(checkpoint_choices, name)
+	new_choice = find_choice(checkpoint_choices, name, choice_maps.get("checkpoints"))
 	return new_choice, *show_model_preview(new_choice)
 
 def update_embedding(name):
+	# build the list the first time it is needed so the name can be matched to a choice
+	ensure_catalog("embeddings", list_all_embeddings)
 	# update the selected preview for embedding tab
-	new_choice = find_choice(embedding_choices, name)
+	new_choice = find_choice(embedding_choices, name, choice_maps.get("embeddings"))
 	return new_choice, *show_embedding_preview(new_choice)
 
 def update_hypernetwork(name):
+	# build the list the first time it is needed so the name can be matched to a choice
+	ensure_catalog("hypernetworks", list_all_hypernetworks)
 	# update the selected preview for hypernetwork tab
-	new_choice = find_choice(hypernetwork_choices, name)
+	new_choice = find_choice(hypernetwork_choices, name, choice_maps.get("hypernetworks"))
 	return new_choice, *show_hypernetwork_preview(new_choice)
 
 def update_lora(name):
+	# build the list the first time it is needed so the name can be matched to a choice
+	ensure_catalog("loras", list_all_loras)
 	# update the selected preview for lora tab
-	new_choice = find_choice(lora_choices, name)
+	new_choice = find_choice(lora_choices, name, choice_maps.get("loras"))
 	return new_choice, *show_lora_preview(new_choice)
 
 def update_lycorii(name):
+	# build the list the first time it is needed so the name can be matched to a choice
+	ensure_catalog("lycoris", list_all_lycorii)
 	# update the selected preview for LyCORIS tab
-	new_choice = find_choice(lycoris_choices, name)
+	new_choice = find_choice(lycoris_choices, name, choice_maps.get("lycoris"))
 	return new_choice, *show_lycoris_preview(new_choice)
 
-def find_choice(list, name):
-	# clean the name from the list and match a choice to the model
-	# TODO there could be name collisions here that may need to be handled in the future.
-	for choice in list:
-		cleaned_name = clean_modelname(choice)
-		if cleaned_name == name:
-			return choice
-	return name
-
-def create_html_iframe(file, is_in_a1111_dir):
-	if is_in_a1111_dir:
-		# escape special URL characters from the filename
-		encoded_file_path = urllib.parse.quote(file, safe='/:\\')
-		# create the iframe html code
-		html_code = f'<iframe class="sdmpxd-iframe" src="file={encoded_file_path}"></iframe>'
-	else:
-		html_code = ""
-		# the html file isnt located in the a1111 directory so load the html file as a base64 string instead of linking to it
-		with open(file, 'rb') as html_file:
-			html_data = base64.b64encode(html_file.read()).decode()
-			html_code = f'<iframe class="sdmpxd-iframe" src="data:text/html;charset=UTF-8;base64,{html_data}"></iframe>'
-	return html_code
-
-def extract_civitai_image_key(url):
-    pattern = r"https?://(?:image(?:cache)?\.civitai\.com)/xG1nkqKTMzGDvpLrqFT7WA/([a-f0-9-]+)"
-    match = re.match(pattern, url)
-    if match:
-        return match.group(1)
-    return None
-
-def convert_image_to_base64(url):
-	# Only cache the image if setting is on
-	if not shared.opts.model_preview_xd_cache_images_civitai_info:
-		return url
-
-	# Get the image key from the URL
-	image_key = extract_civitai_image_key(url)
-
-	if image_key is None:
-		# Can't find the image key, the given url isn't in an expected form, just return the input URL
-		return url
-
-	# Construct the cache directory path
-	cache_directory = os.path.join(current_extension_directory, 'civit_cache')
-	
-	# Check if the cache directory exists, if not, create it
-	if not os.path.exists(cache_directory):
-		os.makedirs(cache_directory)
-	
-	# Construct the image path within the cache directory
-	image_path = os.path.join(cache_directory, image_key)
-	
-	# Check if the image file already exists in the cache directory
-	if os.path.isfile(image_path):
-		# If it exists, read the base64 data from the file
-		with open(image_path, "r") as f:
-			base64_data_uri = f.read()
-		f.close()
-		# Return the cached uri
-		return base64_data_uri
-	else:
-		# If the image file doesn't exist in the cache directory, download it
-		response = requests.get(url)
-
-		# Check if the request was successful
-		if response.status_code == 200:
-			image_data = response.content
-		else:
-			# If not successful, return the input URL
-			return url
+# the types of files the route will serve, this includes the files a saved web page links to
+preview_file_route_types = {
+	".html": "text/html",
+	".png": "image/png",
+	".jpg": "image/jpeg",
+	".jpeg": "image/jpeg",
+	".webp": "image/webp",
+	".avif": "image/avif",
+	".jxl": "image/jxl",
+	".gif": "image/gif",
+	".svg": "image/svg+xml",
+	".css": "text/css",
+	".js": "text/javascript",
+	".woff": "font/woff",
+	".woff2": "font/woff2",
+}
 
-		try:
-			# Attempt to open the image using PIL
-			image = Image.open(BytesIO(image_data))
-			# Encode the image data to base64
-			base64_image = base64.b64encode(image_data).decode('utf-8')
-		except Image.UnidentifiedImageError:
-			# If the image format is not recognized, return the input URL
-			return url
-
-		# Determine the image format
-		if image.format:
-			image_format = image.format
-		else:
-			image_format = "PNG"
-
-		# Construct the base64 data URI
-		base64_data_uri = f"data:image/{image_format};base64,{base64_image}"
-
-		# Write the base64 data to a file in the cache directory
-		with open(image_path, "w") as f:
-			f.write(base64_data_uri)
-		f.close
-
-		print(f"SD Model Preview caching image {image_path}")
-
-		return base64_data_uri
-
-def create_civitai_info_html(file):
-	# initialize the info object
-	data = {}
-
-	# read the civitai.info file
-	if os.path.isfile(file):
-		with open(file, 'r') as f:
-			data = json.load(f)
-		f.close()
-
-	# Sanitize the HTML content of the description properties
-	data['description'] = sanitize_html(data.get('description', ''))
-	if 'model' in data:
-		data['model']['description'] = sanitize_html(data['model'].get('description', ''))
-
-	# build the html
-	civitai_info_html = [f"""<div class='civitai-info'>
-	<h1 id="ci-name">{data.get('name','')}</h1>
-	<ul>
-    <li><strong>ID:</strong> <span id="ci-id">{data.get('id','')}</span></li>
-    <li><strong>Model ID:</strong> <a id="ci-modelId" href="https://civitai.com/models/{data.get('modelId','')}" target="_blank">{data.get('modelId','')}</a></li>
-    <li><strong>Created At:</strong> <span id="ci-createdAt">{data.get('createdAt','')}</span></li>
-    <li><strong>Updated At:</strong> <span id="ci-updatedAt">{data.get('updatedAt','')}</span></li>
-    <li><strong>Base Model:</strong> <span id="ci-baseModel">{data.get('baseModel','')}</span></li>
-	<li><strong>Trained Words:</strong> <span id="ci-trainedWords">{"None Specified" if (not data.get('trainedWords',None) or len(data.get('trainedWords',[])) == 0) else "<ul><li>" + "</li><li>".join(data.get('trainedWords',[])) + "</li></ul>"}</span></li>
-    <li><strong>Early Access Time Frame:</strong> <span id="ci-earlyAccessTimeFrame">{data.get('earlyAccessTimeFrame','')}</span></li>
-    </ul>
-	<details open>
-		<summary><strong>Description:</strong></summary>
-    	<div id="ci-description" class="description">{data.get('description','')}</div>
-	</details>
-	<details>
-  		<summary><strong>Stats:</strong></summary>
-		<ul>
-			<li><strong>Download Count:</strong> <span id="ci-downloadCount">{data.get('stats',{}).get('downloadCount','')}</span></li>
-			<li><strong>Rating Count:</strong> <span id="ci-ratingCount"{data.get('stats',{}).get('ratingCount','')}></span></li>
-			<li><strong>Rating:</strong> <span id="ci-rating">{data.get('stats',{}).get('rating','')}</span></li>
-		</ul>
-	</details>
-	<details>
-  		<summary><strong>Model Information:</strong></summary>
-		<ul>
-			<li><strong>Name:</strong> <span id="ci-modelName">{data.get('model',{}).get('name','')}</span></li>
-			<li><strong>Type:</strong> <span id="ci-modelType">{data.get('model',{}).get('type','')}</span></li>
-			<li><strong>NSFW:</strong> <span id="ci-modelNsfw">{data.get('model',{}).get('nsfw','')}</span></li>
-			<li><strong>POI:</strong> <span id="ci-modelPoi">{data.get('model',{}).get('poi','')}</span></li>
-			<li><strong>Description:</strong> <div id="ci-modelDescription" class="description">{data.get('model',{}).get('description','')}</div></li>
-		</ul>
-	</details>
-	<details>
-		<summary><strong>Files:</strong></summary>
-	"""]
-
-	for i, data_file in enumerate(data.get('files',[])):
-		civitai_info_html.append(f"""<details>
-			<summary><strong id="ci-fileName-{i}">{data_file.get('name','')}</strong></summary>
-			<ul>
-				<li><strong>ID:</strong> <span id="ci-fileId-{i}">{data_file.get('id','')}</span></li>
-				<li><strong>Size (KB):</strong> <span id="ci-fileSizeKB-{i}">{data_file.get('sizeKB','')}</span></li>
-				<li><strong>Type:</strong> <span id="ci-fileType-{i}">{data_file.get('type','')}</span></li>
-				<li><strong>Format:</strong> <span id="ci-fileFormat-{i}">{data_file.get('metadata',{}).get('format','')}</span></li>
-				<li><strong>Fp:</strong> <span id="ci-fileFp-{i}">{data_file.get('metadata',{}).get('fp','')}</span></li>
-				<li><strong>Size:</strong> <span id="ci-fileSize-{i}">{data_file.get('metadata',{}).get('size','')}</span></li>
-				<li><strong>Pickle Scan Result:</strong> <span id="ci-pickleScanResult-{i}">{data_file.get('pickleScanResult','')}</span></li>
-				<li><strong>Pickle Scan Message:</strong> <span id="ci-pickleScanMessage-{i}">{data_file.get('pickleScanMessage','')}</span></li>
-				<li><strong>Virus Scan Result:</strong> <span id="ci-virusScanResult-{i}">{data_file.get('virusScanResult','')}</span></li>
-				<li><strong>Scanned At:</strong> <span id="ci-scannedAt-{i}">{data_file.get('scannedAt','')}</span></li>
-				<li><strong>Download URL:</strong> <a id="ci-downloadUrl-{i}" href="{data_file.get('downloadUrl','')}" target="_blank">{data_file.get('downloadUrl','')}</a></li>
-			</ul>
-		</details>
-		""")
-
-	civitai_info_html.append("""</details>
-		<br>
-		<div id="ci-images" class="img-container-set">
-		""")
-	
-	for i, image in enumerate(data.get('images',[])):
-
-		# Get the meta data object from the image
-		meta_data = image.get('meta', None)
-
-		# Initialize html meta list as not found incase its empty
-		meta_list_items = "<li>No Meta Data Found</li>"
-
-		image_url = convert_image_to_base64(image.get('url',''))
-
-		civitai_info_html.append(f"""<div class='img-prop-container'><div class='img-container'>
-			<img id="ci-image-{i}" src="{image_url}" onclick="imageZoomIn(event)" />
-			""")
-
-		# if there is prompt/meta data
-		if meta_data:
-			# Create the HTML list of all the meta data keys
-			meta_list_items = "\n".join([f"<li><strong>{key}:</strong> {meta_data.get(key,'')}</li>" for key in meta_data])
-
-			# Build the meta data string that will be copied when you press the copy button
-			meta_tags = list(meta_data.keys())
-			meta_out = []
-			if "prompt" in meta_tags:
-				meta_out.append(f"{image['meta']['prompt']}\n")
-			if "negativePrompt" in meta_tags:
-				meta_out.append(f"Negative prompt: {image['meta']['negativePrompt']}\n")
-			for i, tag in enumerate(meta_tags):
-				if tag == "cfgScale":
-					# Add the cfgScale meta data to the output string
-					meta_out.append(f"CFG scale: {image['meta']['cfgScale']}, ")
-				elif tag != "prompt" and tag != "negativePrompt" and tag != "resources" and tag != "hashes":
-					# Add the other meta data to the output string, convert the tag to Proper case
-					meta_out.append(re.sub(r'\b\w', lambda x: x.group(0).upper(), tag, count=1) + ": " + str(image['meta'][tag]) + ", ")
-			# Remove any trailing commas or whitespace
-			meta_out_string = "".join(meta_out).rstrip(", ")
-
-			# Add the button and an invisible textarea that will let you copy the meta data as a prompt
-			if meta_out_string.strip() != "":
-				civitai_info_html.append('<div class="img-meta-ico" title="Copy Metadata" onclick="metaDataCopy(event)"></div>')
-				civitai_info_html.append(f'<textarea class="img-meta">{meta_out_string}</textarea>')
-
-		civitai_info_html.append(f"""</div>
-			<details class='img-properties-list'>
-				<summary><strong>Properties:</strong></summary>
-				<ul>
-					<li><strong>URL:</strong> <a id="ci-image-URL-{i}" href="{image.get('url','')}" target="_blank">{image.get('url','')}</a></li>
-					<li><strong>NSFW:</strong> <span id="ci-image-nsfw-{i}">{image.get('nsfw','')}</span></li>
-					<li><strong>Meta:</strong>
-						<ul id="ci-image-meta-{i}">
-							{meta_list_items}
-						</ul>
-					</li>
-				</ul>
-			</details>
-		</div>
-		""")
-
-	civitai_info_html.append("</div></div>")
-	return "".join(civitai_info_html)
-
-def create_html_img(file, is_in_a1111_dir):
-	# create the html to display an image along with its meta data
-	image = Image.open(file)
-	# load the image to memory (needed for getting the meta data)
-	image.load()
-	# get the prompt data
-	metadata, _ = images.read_info_from_image(image)
-
-	# set default order to 0
-	order = 0
-	# if strict naming is on, search the file name for a number at the end of the file and use that for its order
-	if shared.opts.model_preview_xd_name_matching == "Strict":
-		# get the file name without extension
-		file_name, file_extension = os.path.splitext(os.path.basename(file))
-		# search for '{anything}.{number}' in the file name and return the number
-		image_number = re.search(".*\.(\d+)$", file_name)
-		order = int(image_number.group(1)) if image_number else 0
-
-	if is_in_a1111_dir:
-		# escape special URL characters from the filename
-		encoded_file_path = urllib.parse.quote(file, safe='/:\\')
-		# create the html for the image
-		html_code = f'<div class="img-container" style="order:{order}"><img src=file={encoded_file_path} onclick="imageZoomIn(event)" />'
-	else:
-		# linking to the image wont work so convert it to a base64 byte string
-		with open(file, "rb") as img_file:
-			img_data = base64.b64encode(img_file.read()).decode()
-		# create the html for the image
-		html_code = f'<div class="img-container" style="order:{order}"><img src="data:image/{image.format};base64,{img_data}" onclick="imageZoomIn(event)" />'
-
-	# if the image has prompt data in the meta data also add some elements to support copying the prompt to clipboard
-	if metadata is not None and metadata.strip() != "":
-		html_code += '<div class="img-meta-ico" title="Copy Metadata" onclick="metaDataCopy(event)"></div>'
-		html_code += f'<textarea class="img-meta">{metadata}</textarea>'
-	html_code += "</div>\n"
-	# return the html code
-	return html_code
-
-def search_and_display_previews(model_name, paths):
-	html_generic_pattern = re.compile(r'^.*(?i:\.' + html_ext_pattern + r')$')
-	civitai_generic_pattern = re.compile(r'^.*(?i:\.' + civitai_ext_pattern + r')$')
-	md_generic_pattern = re.compile(r'^.*(?i:\.' + md_ext_pattern + r')$')
-	txt_generic_pattern = re.compile(r'^.*(?i:\.' + txt_ext_pattern + r')$')
-	prompts_generic_pattern = re.compile(r'^.*(?i:\.' + prompts_ext_pattern + r')$')
-	img_generic_pattern = re.compile(r'^.*(?i:\.' + img_ext_pattern + r')$')
-	# create patters for the supported preview file types
-	# `model_name` will be the name of the model to check for preview files for
-	if shared.opts.model_preview_xd_name_matching == "Strict" or shared.opts.model_preview_xd_name_matching == "Index":
-		# strict naming is intended to avoid name collision between 'checkpoint1000' and 'checkpoint10000'.
-		# Using a loose naming rule preview files for 'checkpoint10000' would show up for 'checkpoint1000'
-		# The rules for strict naming are:
-		# HTML previews should follow {model}.html example 'checkpoint1000.html'
-		html_pattern = re.compile(r'^' + re.escape(model_name) + r'(?i:\.' + html_ext_pattern+ r')$')
-		# Civitai info files should follow {model}.civitai.info
-		civitai_pattern = re.compile(r'^' + re.escape(model_name) + r'(?i:\.' + civitai_ext_pattern+ r')$')
-		# Markdown previews should follow {model}.md example 'checkpoint1000.md'
-		md_pattern = re.compile(r'^' + re.escape(model_name) + r'(?i:\.' + md_ext_pattern+ r')$')
-		# Prompt lists should follow {model}.prompt example 'checkpoint1000.prompt'
-		prompts_pattern = re.compile(r'^' + re.escape(model_name) + r'(?i:\.' + prompts_ext_pattern + r')$')
-		# Text files previews should follow {model}.txt example 'checkpoint1000.txt'
-		txt_pattern = re.compile(r'^' + re.escape(model_name) + r'(?i:\.' + txt_ext_pattern+ r')$')
-		# Images previews should follow {model}.{extension} or {model}.preview.{extension} or {model}.{number}.{extension} or {model}.preview.{number}.{extension}
-		# example 1 'checkpoint1000.png'
-		# example 2 'checkpoint1000.preview.jpg'
-		# example 3 'checkpoint1000.1.jpeg'
-		# example 4 'checkpoint1000.preview.1.webp'
-		img_pattern = re.compile(r'^' + re.escape(model_name) + r'(?i:(?:\.preview)?(?:\.\d+)?\.' + img_ext_pattern + r')$')
-	elif shared.opts.model_preview_xd_name_matching == "Folder":
-		# use a folder name matching that only requires the model name to show up somewhere in the folder path not the file name name
-		html_pattern = html_generic_pattern
-		civitai_pattern = civitai_generic_pattern
-		md_pattern = md_generic_pattern
-		txt_pattern = txt_generic_pattern
-		prompts_pattern = prompts_generic_pattern
-		img_pattern = img_generic_pattern
-	else:
-		# use a loose name matching that only requires the model name to show up somewhere in the file name
-		html_pattern = re.compile(r'^.*' + re.escape(model_name) + r'.*(?i:\.' + html_ext_pattern + r')$')
-		civitai_pattern = re.compile(r'^.*' + re.escape(model_name) + r'.*(?i:\.' + civitai_ext_pattern + r')$')
-		md_pattern = re.compile(r'^.*' + re.escape(model_name) + r'.*(?i:\.' + md_ext_pattern + r')$')
-		txt_pattern = re.compile(r'^.*' + re.escape(model_name) + r'.*(?i:\.' + txt_ext_pattern + r')$')
-		prompts_pattern = re.compile(r'^.*' + re.escape(model_name) + r'.*(?i:\.' + prompts_ext_pattern + r')$')
-		img_pattern = re.compile(r'^.*' + re.escape(model_name) + r'.*(?i:\.' + img_ext_pattern + r')$')
-	
-	# an array to hold the image html code
-	html_code_list = []
-	# if a text file is found
-	found_txt_file = None
-	# if a markdown file is found
-	md_file = None
-	# if a prompts file is found
-	prompts_file = None
-	# if an html file is found the iframe
-	html_file_frame = None
-	# if an civitai.info file is found the generated html
-	civitai_info_html = None
-
-	# if a text file is found
-	generic_found_txt_file = None
-	# if a markdown file is found
-	generic_md_file = None
-	# if a prompts file is found
-	generic_prompts_file = None
-	# if an html file is found the iframe
-	generic_html_file_frame = None
-	# if an civitai.info file is found the generated html
-	generic_civitai_info_html = None
-
-	# get the current directory so we can convert absolute paths to relative paths if we need to
-	current_directory = os.getcwd()
-
-	# support the ability to check multiple paths
-	for path in paths:
-		# loop through all files in the path and any subdirectories
-		for dirpath, dirnames, filenames in os.walk(path, followlinks=True):
-			# get a list of all parent directories
-			directories = dirpath.split(os.path.sep)
-			# if we are not using folder match mode look for files normally otherwise we are using folder match mode so make sure at least one parent directory is equal to the name of the model
-			if shared.opts.model_preview_xd_name_matching != "Folder" or (shared.opts.model_preview_xd_name_matching == "Folder" and model_name in directories):
-				# sort the file names using a natural sort algorithm
-				sorted_filenames = sorted(filenames, key=natural_order_number)
-				# if we are using index matching mode check to see if there is an index file, if there is read it and compile a regex that matches all the models listed in the file to use later
-				index_has_model = False
-				index_models_pattern = None
-				if shared.opts.model_preview_xd_name_matching == "Index":
-					index_txt_filename = next((filename for filename in sorted_filenames if filename.lower() == "index.txt"), None)
-					if index_txt_filename is not None:
-						index_txt_path = os.path.join(dirpath, index_txt_filename)
-						output_text = ""
-						with open(index_txt_path, "r", encoding="utf8") as file:
-							output_text = file.read()
-						index_models = [model.strip() for model in output_text.replace(",", "\n").splitlines()]
-						index_has_model = model_name in index_models
-						index_models = [re.escape(model) for model in index_models if model != model_name]
-						if len(index_models) > 0:
-							index_models_pattern = re.compile(r'^(?:' + r'|'.join(index_models) + r')(?i:(?:\.preview)?(?:\.\d+)?\.' + all_ext_pattern + r')$')
-				# check each file to see if it is a preview file
-				for filename in sorted_filenames:
-					file_path = os.path.join(dirpath, filename)
-					# check if the path is a subdirectory of the install directory
-					is_in_a1111_dir = is_in_directory(current_directory, file_path)
-					img_file = None
-					# if we are using index matching, find all preview files that match the regex compiled earlier
-					if shared.opts.model_preview_xd_name_matching == "Index":
-						if (index_models_pattern is not None and index_models_pattern.match(filename)) or filename.lower() == "index.txt":
-							# ignore preview files that strictly match any of the other models in the index file
-							continue
-						if index_has_model:
-							if html_generic_pattern.match(filename):
-								# there can only be one html file, if one was already found it is replaced
-								generic_html_file_frame = create_html_iframe(file_path, is_in_a1111_dir)
-							if civitai_generic_pattern.match(filename):
-								# there can only be one civitai.info file, if one was already found it is replaced
-								generic_civitai_info_html = create_civitai_info_html(file_path)
-							if md_generic_pattern.match(filename):
-								# there can only be one markdown file, if one was already found it is replaced
-								generic_md_file = file_path
-							if prompts_generic_pattern.match(filename):
-								# there can only be one prompts file, if one was already found it is replaced
-								generic_prompts_file = file_path
-							if img_generic_pattern.match(filename):
-								# there can be many images, even spread across the multiple paths
-								img_file = file_path
-							if txt_generic_pattern.match(filename):
-								# there can only be one text file, if one was already found it is replaced
-								generic_found_txt_file = file_path
-					# perform the normal file matching rules for the matching mode determined at the beginning of this function
-					if html_pattern.match(filename):
-						# there can only be one html file, if one was already found it is replaced
-						html_file_frame = create_html_iframe(file_path, is_in_a1111_dir)
-					if civitai_pattern.match(filename):
-						# there can only be one civitai.info file, if one was already found it is replaced
-						civitai_info_html = create_civitai_info_html(file_path)
-					if md_pattern.match(filename):
-						# there can only be one markdown file, if one was already found it is replaced
-						md_file = file_path
-					if prompts_pattern.match(filename):
-						# there can only be one prompts file, if one was already found it is replaced
-						prompts_file = file_path
-					if img_pattern.match(filename):
-						# there can be many images, even spread across the multiple paths
-						img_file = file_path
-					if txt_pattern.match(filename):
-						# there can only be one text file, if one was already found it is replaced
-						found_txt_file = file_path
-					
-					# if this file was an image file append the image to the html code list
-					if img_file is not None:
-						html_code_list.append(create_html_img(img_file, is_in_a1111_dir))
-	
-	# if a generic preview file was found but not a specific one, use the generic one
-	if html_file_frame is None and generic_html_file_frame is not None:
-		html_file_frame = generic_html_file_frame
-	if civitai_info_html is None and generic_civitai_info_html is not None:
-		civitai_info_html = generic_civitai_info_html
-	if md_file is None and generic_md_file is not None:
-		md_file = generic_md_file
-	if prompts_file is None and generic_prompts_file is not None:
-		prompts_file = generic_prompts_file
-	if found_txt_file is None and generic_found_txt_file is not None:
-		found_txt_file = generic_found_txt_file
-
-	# if an html file was found, ignore other txt, md, or image preview files and return the html file and prompt file if available
-	if html_file_frame is not None:
-		return html_file_frame, None, prompts_file, None
-
-	# if an civitai.info file was found, ignore other txt, md, or image preview files and return the html created and prompt file if available
-	if civitai_info_html is not None:
-		return civitai_info_html, None, prompts_file, None
-
-	# if there were images found, wrap the images in a container div
-	html_code_output = '<div class="img-container-set">' + ''.join(html_code_list) + '</div>' if len(html_code_list) > 0 else None
-
-	# return the all preview files found
-	return html_code_output, md_file, prompts_file, found_txt_file
+range_header_pattern = re.compile(r'^bytes=(\d*)-(\d*)$')
+# the route the timings of each stage are served from
+timing_stats_route = "/sd-model-preview-xd/stats"
 
 def get_checkpoints_dirs():
 	# create list of directories
@@ -959,6 +525,7 @@ def show_lycoris_preview(modelname=None):
 	# get preview for a LyCORIS
 	return show_preview(modelname, get_lycoris_dirs(), "lycoris")
 
+@timed_request("show_preview", get_slow_request_threshold)
 def show_preview(modelname, paths, tags_key):
 	if modelname is None or len(modelname) == 0 or paths is None or len(paths) == 0:
 		txt_update = gr.Textbox.update(value=None, visible=False)
@@ -968,45 +535,35 @@ def show_preview(modelname, paths, tags_key):
 		html_update = gr.HTML.update(value='', visible=False)
 		tags_html = gr.HTML.update(value='', visible=False)
 		return prompts_list_update, prompts_button_update, txt_update, md_update, html_update, tags_html
+	label_request(modelname)
 	
+	# make sure the tags are up to date with the preview files
+	with timing_span("refresh_tags"):
+		refresh_changed_tags(tags_key, paths)
+
 	# remove the hash if exists, the extension, and if the string is a path just return the file name
 	name = clean_modelname(modelname)
-	# get the preview data
-	html_code, found_md_file, found_prompts_file, found_txt_file = search_and_display_previews(name, paths)
+	rendered = get_preview(name, paths, get_preview_options(), tags_key)
+	html_code, md_text, txt_text, prompts = rendered
 	preview_html = '' if html_code is None else html_code
+	record_bytes("show_preview", get_rendered_preview_size(rendered))
 
 	# if a text file was found update the gradio text element
-	if found_txt_file:
-		output_text = ""
-		with open(found_txt_file, "r", encoding="utf8") as file:
-			for line in file:
-				output_text = f'{output_text}{line.strip()}\n'
-		txt_update = gr.Textbox.update(value=output_text, visible=True)
+	if txt_text is not None:
+		txt_update = gr.Textbox.update(value=txt_text, visible=True)
 	else:
 		txt_update = gr.Textbox.update(value=None, visible=False)
 	
 	# if a markdown file was found update the gradio markdown element
-	if found_md_file:
-		output_text = ""
-		with open(found_md_file, "r", encoding="utf8") as file:
-			output_text = file.read()
-		md_update = gr.Textbox.update(value=output_text, visible=True)
+	if md_text is not None:
+		md_update = gr.Textbox.update(value=md_text, visible=True)
 	else:
 		md_update = gr.Textbox.update(value=None, visible=False)
 
 	# if a prompt file was found update the gradio prompts list
-	if found_prompts_file:
-		prompts: list[str] = list()
-		try:
-			with open(found_prompts_file, newline='') as csvfile:
-				reader = csv.reader(csvfile)
-				for row in reader:
-					for prompt in row:
-						if prompt not in prompts:
-							prompts.append(prompt)
-		finally:
-			prompts_list_update = gr.CheckboxGroup.update(visible=True, choices=prompts, value=prompts)
-			prompts_button_update = gr.Button.update(visible=True)
+	if prompts is not None:
+		prompts_list_update = gr.CheckboxGroup.update(visible=True, choices=list(prompts), value=list(prompts))
+		prompts_button_update = gr.Button.update(visible=True)
 	else:
 		prompts_list_update = gr.CheckboxGroup.update(visible=False)
 		prompts_button_update = gr.Button.update(visible=False)
@@ -1018,7 +575,7 @@ def show_preview(modelname, paths, tags_key):
 		html_update = gr.HTML.update(value='', visible=False)
 
 	# if nothing was found display a message that nothing was found
-	if found_txt_file is None and found_md_file is None and (html_code is None or len(html_code) == 0):
+	if txt_text is None and md_text is None and (html_code is None or len(html_code) == 0):
 		html_update = gr.HTML.update(value="<span style='margin-left: 1em;'>No Preview Found</span>", visible=True)
 
 	# get the tags from the tags object and create a span for them
@@ -1029,9 +586,108 @@ def show_preview(modelname, paths, tags_key):
 		tags_html = gr.HTML.update(value='', visible=False)
 	return prompts_list_update, prompts_button_update, txt_update, md_update, html_update, tags_html
 
-def create_tab(tab_label, tab_id_key, list_choices, show_preview_fn, filter_fn, refresh_fn, update_selected_fn):
+# the state of the catalogs (model lists and tags), a catalog is only built when its tab is first used
+# a catalog without a status hasn't been needed yet, "pending" is waiting on the background worker
+# and "failed" couldn't be built and is tried again the next time it is needed
+catalog_status = {}
+catalog_status_lock = threading.Lock()
+# each catalog has its own lock so it is only built once when it is requested from more than one place
+catalog_locks = {}
+catalog_labels = {
+	"checkpoints": "Checkpoints",
+	"embeddings": "Embeddings",
+	"hypernetworks": "Hypernetwork",
+	"loras": "Lora",
+	"lycoris": "LyCORIS"
+}
+
+def is_catalog_ready(tags_key):
+	with catalog_status_lock:
+		return catalog_status.get(tags_key) == "ready"
+
+def ensure_catalog(tags_key, list_fn):
+	# build a catalog the first time it is needed, if it is already being built wait for that to finish instead
+	with catalog_status_lock:
+		if catalog_status.get(tags_key) == "ready":
+			return
+		catalog_lock = catalog_locks.setdefault(tags_key, threading.Lock())
+	with catalog_lock:
+		with catalog_status_lock:
+			if catalog_status.get(tags_key) == "ready":
+				return
+			catalog_status[tags_key] = "indexing"
+		try:
+			list_fn()
+			status = "ready"
+		except Exception as e:
+			print(f"SD Model Preview unable to build the {catalog_labels[tags_key]} list: {e}")
+			# the next time the list is needed it is built again (for example once the extension it needs has loaded)
+			status = "failed"
+		with catalog_status_lock:
+			catalog_status[tags_key] = status
+
+def refresh_catalog(tags_key, list_fn):
+	# list the models of a catalog again, a catalog that hasn't been needed yet is left to be built when it is
+	with catalog_status_lock:
+		if tags_key not in catalog_status:
+			return False
+		catalog_lock = catalog_locks.setdefault(tags_key, threading.Lock())
+	with catalog_lock:
+		list_fn()
+		with catalog_status_lock:
+			catalog_status[tags_key] = "ready"
+	return True
+
+def load_preview_catalog_dirs():
+	# seed the preview index from the catalog written by `python -m modelpreview_xd.build_catalog` if there is one
+	# so only the folders that changed since it was built are scanned instead of every model folder
+	paths = dict.fromkeys(get_checkpoints_dirs() + get_embedding_dirs() + get_hypernetwork_dirs() + get_lora_dirs() + get_lycoris_dirs())
+	loaded = load_preview_catalog(default_preview_catalog_path, paths)
+	if loaded > 0:
+		print(f"SD Model Preview read {loaded} model folders from the preview catalog")
+
+def build_catalogs(catalog_builders):
+	# build the catalogs one after another, this runs on a background thread
+	load_preview_catalog_dirs()
+	for tags_key, list_fn in catalog_builders:
+		ensure_catalog(tags_key, list_fn)
+
+def start_catalog_worker(catalog_builders):
+	# start building the catalogs in the background so the ui doesn't have to wait for them
+	with catalog_status_lock:
+		for tags_key, _ in catalog_builders:
+			catalog_status.setdefault(tags_key, "pending")
+	threading.Thread(target=build_catalogs, args=(catalog_builders,), name="sd-model-preview-xd-indexing", daemon=True).start()
+
+def get_indexing_status_html():
+	# show which catalogs are still being built, the data-indexing attribute tells the javascript to keep polling
+	with catalog_status_lock:
+		pending_labels = [catalog_labels[tags_key] for tags_key, status in catalog_status.items() if status in ("pending", "indexing")]
+		failed_labels = [catalog_labels[tags_key] for tags_key, status in catalog_status.items() if status == "failed"]
+	status_html = ''
+	if len(pending_labels) > 0:
+		status_html += f'<div class="modelpreview_xd_indexing" data-indexing="true">Indexing model previews: {", ".join(pending_labels)}&hellip;</div>'
+	if len(failed_labels) > 0:
+		status_html += f'<div class="modelpreview_xd_indexing">Unable to list the models: {", ".join(failed_labels)}, they will be listed again when you open or filter the list</div>'
+	return status_html
+
+def poll_catalogs(catalog_filters, *filters):
+	# called by the javascript, updates the status and fills in the model lists that are ready
+	# lists that haven't been built are left alone so polling doesn't build them
+	status_html = get_indexing_status_html()
+	status_update = gr.HTML.update(value=status_html, visible=status_html != '')
+	list_updates = [filter_fn(filter) if is_catalog_ready(tags_key) else gr.Dropdown.update() for (tags_key, filter_fn), filter in zip(catalog_filters, filters)]
+	return status_update, *list_updates
+
+def open_catalog(tags_key, filter_fn, filter):
+	# fill in the model list the first time its dropdown is used, after that the list is already up to date
+	if is_catalog_ready(tags_key):
+		return gr.Dropdown.update()
+	return filter_fn(filter)
+
+def create_tab(tab_label, tab_id_key, tags_key, list_choices, show_preview_fn, filter_fn, refresh_fn, update_selected_fn):
 	# create a tab for model previews
-	with gr.Tab(tab_label, elem_id=f"model_preview_xd_{tab_label.lower()}_tab", elem_classes="model_preview_xd_tab"):
+	with gr.Tab(tab_label, elem_id=f"model_preview_xd_{tab_label.lower()}_tab", elem_classes="model_preview_xd_tab") as tab:
 		with gr.Row(elem_id=f"{tab_id_key}_modelpreview_xd_control_row", elem_classes="modelpreview_xd_control_row"):
 			list = gr.Dropdown(label="Model", choices=list_choices, interactive=True, elem_id=f"{tab_id_key}_mp2_preview_model_list", elem_classes="mp2_preview_model_list")
 			filter_input = gr.Textbox(label="Filter", value="", elem_id=f"{tab_id_key}_modelpreview_xd_filter_text", elem_classes="modelpreview_xd_filter_text")
@@ -1115,6 +771,31 @@ def create_tab(tab_label, tab_id_key, list_choices, show_preview_fn, filter_fn,
 		_js="(x) => copyToClipboard(x)",
 	)
 
+	# the model list is built when the tab is opened or the dropdown is focused, older versions of gradio don't have these events
+	if hasattr(tab, "select"):
+		tab.select(
+			fn=filter_fn,
+			inputs=[
+				filter_input,
+			],
+			outputs=[
+				list,
+			]
+		)
+	if hasattr(list, "focus"):
+		list.focus(
+			fn=lambda filter: open_catalog(tags_key, filter_fn, filter),
+			inputs=[
+				filter_input,
+			],
+			outputs=[
+				list,
+			]
+		)
+
+	# return the components the interface needs to fill in the model list once it has been built
+	return list, filter_input
+
 def on_ui_tabs():
 	global additional_networks, additional_networks_builtin
 	# import/update the lora module
@@ -1130,46 +811,231 @@ def on_ui_tabs():
 
 		gr.HTML(elem_id='modelpreview_xd_setting', value='<script id="modelpreview_xd_setting_json" type="application/json">{ "LimitSize": ' + ( "true" if limitHeight else "false" ) + ', "ColumnView": ' + ( "true" if columnView else "false" ) + ' }</script>', visible=False)
 
+		# build the list for the first tab in the background, the other lists are built when their tab is first opened
+		start_catalog_worker([("checkpoints", list_all_models)])
+
+		# show the indexing status, the hidden button is clicked by the javascript to check on it
+		status_html = get_indexing_status_html()
+		indexing_status = gr.HTML(value=status_html, visible=status_html != '', elem_id="modelpreview_xd_indexing_status")
+		with gr.Row(elem_classes="modelpreview_xd_hidden_ui"):
+			indexing_poll_button = gr.Button(elem_id="modelpreview_xd_indexing_poll")
+
+		# the catalog, dropdown, filter textbox, and filter function of each tab
+		catalog_tabs = []
+
 		# create a tab for the checkpoint previews
-		create_tab("Checkpoints", "cp",
-				list_all_models(),
+		model_list, filter_input = create_tab("Checkpoints", "cp", "checkpoints",
+				checkpoint_choices,
 				show_model_preview,
 				filter_models,
 				refresh_models,
 				update_checkpoint)
-		create_tab("Embeddings", "em",
-				list_all_embeddings(),
+		catalog_tabs.append(("checkpoints", model_list, filter_input, filter_models))
+		model_list, filter_input = create_tab("Embeddings", "em", "embeddings",
+				embedding_choices,
 				show_embedding_preview,
 				filter_embeddings,
 				refresh_embeddings,
 				update_embedding)
-		create_tab("Hypernetwork", "hn",
-				list_all_hypernetworks(),
+		catalog_tabs.append(("embeddings", model_list, filter_input, filter_embeddings))
+		model_list, filter_input = create_tab("Hypernetwork", "hn", "hypernetworks",
+				hypernetwork_choices,
 				show_hypernetwork_preview,
 				filter_hypernetworks,
 				refresh_hypernetworks,
 				update_hypernetwork)
+		catalog_tabs.append(("hypernetworks", model_list, filter_input, filter_hypernetworks))
 
 		# create a tab for the lora previews if the module was loaded
 		if additional_networks is not None or additional_networks_builtin is not None:
-			create_tab("Lora", "lo",
-						list_all_loras(),
+			model_list, filter_input = create_tab("Lora", "lo", "loras",
+						lora_choices,
 						show_lora_preview,
 						filter_loras,
 						refresh_loras,
 						update_lora)
+			catalog_tabs.append(("loras", model_list, filter_input, filter_loras))
 
 		# create a tab for the LyCORIS previews if the module was loaded
 		if lycoris_module is not None:
-			create_tab("LyCORIS", "ly",
-					   list_all_lycorii(),
+			model_list, filter_input = create_tab("LyCORIS", "ly", "lycoris",
+					   lycoris_choices,
 					   show_lycoris_preview,
 					   filter_lycorii,
 					   refresh_lycorii,
 					   update_lycorii)
+			catalog_tabs.append(("lycoris", model_list, filter_input, filter_lycorii))
+
+		indexing_poll_button.click(
+			fn=lambda *filters: poll_catalogs([(tags_key, filter_fn) for tags_key, _, _, filter_fn in catalog_tabs], *filters),
+			inputs=[filter_input for _, _, filter_input, _ in catalog_tabs],
+			outputs=[indexing_status, *[model_list for _, model_list, _, _ in catalog_tabs]]
+		)
 	
 	return (modelpreview_interface, "Model​ Previews", "modelpreview_xd_interface"),
 
+def get_preview_file_roots():
+	# get the paths of every directory the route is allowed to serve files from
+	directories = get_checkpoints_dirs() + get_embedding_dirs() + get_hypernetwork_dirs() + get_lora_dirs() + get_lycoris_dirs()
+	# include the real path of each directory too in case a model directory is a symlink
+	return [os.path.abspath(directory) for directory in directories] + [os.path.realpath(directory) for directory in directories]
+
+def is_servable_preview_file(file_path):
+	# only serve files with a whitelisted extension that are inside one of the model directories
+	if os.path.splitext(file_path)[1].lower() not in preview_file_route_types or not os.path.isfile(file_path):
+		return False
+	for root in get_preview_file_roots():
+		try:
+			# compare with normcase so a drive letter or folder in a different case on windows still matches
+			if os.path.normcase(os.path.commonpath([root, file_path])) == os.path.normcase(root):
+				return True
+		except ValueError:
+			# the paths are on different drives
+			pass
+	return False
+
+def serve_preview_file(request: Request, path: str):
+	# serve a preview file that is outside of the webui directory with caching and range support
+	if not os.path.isabs(path):
+		# the leading slash is removed from posix paths when the link is created
+		path = "/" + path
+	# normalize the path so '..' can't be used to leave the model directories
+	file_path = os.path.abspath(path)
+	if not is_servable_preview_file(file_path):
+		return Response(status_code=404)
+
+	file_stat = os.stat(file_path)
+	etag = f'"{file_stat.st_mtime_ns:x}-{file_stat.st_size:x}"'
+	headers = {
+		"ETag": etag,
+		"Last-Modified": email.utils.formatdate(file_stat.st_mtime, usegmt=True),
+		# links include the modified time of the file so the browser can keep its copy until the link changes
+		"Cache-Control": "private, max-age=86400",
+		"Accept-Ranges": "bytes",
+		# run html previews in a sandbox so their scripts can't reach into the webui, the same as the base64 iframes used to
+		# every file gets the sandbox since an svg, js, or css file opened on its own would otherwise run in the webui's origin
+		# (the header only applies to a file opened as a page, images, scripts, and styles used by a preview load the same)
+		"Content-Security-Policy": "sandbox allow-scripts allow-popups allow-popups-to-escape-sandbox",
+		# don't let the browser guess a different (scriptable) type than the one sent
+		"X-Content-Type-Options": "nosniff",
+	}
+	media_type = preview_file_route_types[os.path.splitext(file_path)[1].lower()]
+
+	# answer conditional requests without sending the file again
+	if_none_match = request.headers.get("if-none-match")
+	if if_none_match is not None:
+		if etag in [tag.strip() for tag in if_none_match.split(",")] or if_none_match.strip() == "*":
+			return Response(status_code=304, headers=headers)
+	elif request.headers.get("if-modified-since") is not None:
+		try:
+			if int(file_stat.st_mtime) <= email.utils.parsedate_to_datetime(request.headers["if-modified-since"]).timestamp():
+				return Response(status_code=304, headers=headers)
+		except (TypeError, ValueError):
+			pass
+
+	# send part of the file if a single byte range was asked for (and the file hasn't changed if If-Range was sent)
+	range_match = range_header_pattern.match(request.headers.get("range", ""))
+	if_range = request.headers.get("if-range")
+	if range_match and (range_match.group(1) != "" or range_match.group(2) != "") and (if_range is None or if_range == etag or if_range == headers["Last-Modified"]):
+		start, end = range_match.group(1), range_match.group(2)
+		if start == "":
+			# a suffix range asks for the last n bytes
+			start = max(file_stat.st_size - int(end), 0)
+			end = file_stat.st_size - 1
+		else:
+			start = int(start)
+			end = min(int(end), file_stat.st_size - 1) if end != "" else file_stat.st_size - 1
+		if start >= file_stat.st_size or start > end:
+			headers["Content-Range"] = f"bytes */{file_stat.st_size}"
+			return Response(status_code=416, headers=headers)
+		with open(file_path, "rb") as file:
+			file.seek(start)
+			content = file.read(end - start + 1)
+		headers["Content-Range"] = f"bytes {start}-{end}/{file_stat.st_size}"
+		return Response(content=content if request.method != "HEAD" else b"", status_code=206, headers=headers, media_type=media_type)
+
+	return FileResponse(file_path, headers=headers, media_type=media_type)
+
+def serve_civitai_image(key: str):
+	# serve an image from the civitai.info image cache
+	if not civitai_cache_key_pattern.match(key):
+		return Response(status_code=404)
+	data_path, metadata = read_disk_cache(get_civitai_cache_directory(get_preview_options()), key)
+	if data_path is None:
+		return Response(status_code=404)
+	# a key always refers to the same image so the browser can keep it
+	return FileResponse(data_path, media_type=metadata.get("content_type", "image/png"), headers={"Cache-Control": "private, max-age=31536000, immutable"})
+
+def get_gallery_dirs(tags_key):
+	# get the model directories of a tab
+	dirs_fn = {
+		"checkpoints": get_checkpoints_dirs,
+		"embeddings": get_embedding_dirs,
+		"hypernetworks": get_hypernetwork_dirs,
+		"loras": get_lora_dirs,
+		"lycoris": get_lycoris_dirs
+	}.get(tags_key)
+	return None if dirs_fn is None else dirs_fn()
+
+def serve_gallery_page(tab: str, model: str, offset: int = 0):
+	# serve the html for the next page of images in a model's gallery
+	paths = get_gallery_dirs(tab)
+	if paths is None or len(paths) == 0 or offset < 0:
+		return Response(status_code=404)
+	# only the models listed in the tab have a gallery, any other name (or an empty one, which loosely matches every file) is refused
+	choice_map = choice_maps.get(tab)
+	if model == "" or choice_map is None or model not in choice_map["names"]:
+		return Response(status_code=404)
+	gallery_html = get_gallery_page(model, paths, tab, offset, get_preview_options())
+	return Response(content=gallery_html, media_type="text/html", headers={"Cache-Control": "no-store"})
+
+def serve_timing_stats():
+	# serve the timings of each stage along with how well the preview cache is doing
+	return {"stages": get_timing_stats(), "preview_cache": get_preview_cache_info()}
+
+def has_api_credentials(request):
+	# check the request for the user and password of the webui's api (--api-auth user:password,user2:password2)
+	api_auth = getattr(shared.cmd_opts, "api_auth", None)
+	scheme, _, encoded_credentials = request.headers.get("authorization", "").partition(" ")
+	if not api_auth or scheme.lower() != "basic":
+		return False
+	try:
+		user, _, password = base64.b64decode(encoded_credentials).decode("utf8").partition(":")
+	except (ValueError, UnicodeDecodeError):
+		return False
+	for credentials in api_auth.split(","):
+		api_user, _, api_password = credentials.strip().partition(":")
+		if secrets.compare_digest(user.encode("utf8"), api_user.encode("utf8")) and secrets.compare_digest(password.encode("utf8"), api_password.encode("utf8")):
+			return True
+	return False
+
+def create_login_check(app):
+	# the routes are added to the webui's app directly so they aren't behind the gradio login, check it the same way gradio does
+	# gradio's /user route gives the user logged in with the cookies of a request (the cookie names change between gradio versions)
+	get_current_user = next((route.endpoint for route in app.routes if getattr(route, "path", None) == "/user"), None)
+	def check_login(request: Request):
+		if getattr(app, "auth", None) is None and not getattr(shared.cmd_opts, "gradio_auth", None) and not getattr(shared.cmd_opts, "gradio_auth_path", None):
+			# there is no login to the webui, so the routes are as open as the ui itself
+			return
+		if get_current_user is not None and get_current_user(request) is not None:
+			return
+		if has_api_credentials(request):
+			return
+		raise HTTPException(status_code=401, detail="Not authenticated")
+	return check_login
+
+def on_app_started(demo, app):
+	# only serve the routes to callers that are logged in to the webui when it has a login
+	dependencies = [Depends(create_login_check(app))]
+	# register the route used to link to preview files that are outside of the webui directory
+	app.add_api_route(preview_file_route + "{path:path}", serve_preview_file, methods=["GET", "HEAD"], dependencies=dependencies)
+	# register the route used to link to cached images from .civitai.info previews
+	app.add_api_route(civitai_cache_route + "{key}", serve_civitai_image, methods=["GET", "HEAD"], dependencies=dependencies)
+	# register the route the later pages of image galleries are loaded from
+	app.add_api_route(gallery_route, serve_gallery_page, methods=["GET"], dependencies=dependencies)
+	# register the route the timings of each stage are served from
+	app.add_api_route(timing_stats_route, serve_timing_stats, methods=["GET"], dependencies=dependencies)
+
 def on_ui_settings():
 	section = ('model_preview_xd', "Model Preview XD")
 	shared.opts.add_option("model_preview_xd_name_matching", shared.OptionInfo("Loose", "Name matching rule for preview files", gr.Radio, {"choices": ["Loose", "Strict", "Folder", "Index"]}, section=section).info("Requires UI Reload").html("""
@@ -1199,9 +1065,17 @@ def on_ui_settings():
 	<li><strong>Folder</strong> - Use folder name matching. Will look for a folder within your model directory that matches your model's name (case sensitive) and will show any preview files found within that folder or any subfolders of that folder. If your model is named <strong>'mymodel.ckpt'</strong> all preview files located in <strong>'/mymodel/'</strong> will be shown.</li>
 	<li><strong>Index</strong> - If a folder contains a file <strong>'index.txt'</strong> that lists model names, any preview files in that folder regardless of name will be associated with each model in the index file. This allows you to share preview files among a number of models. This matching mode will also match any file named similar to the <strong>'Strict'</strong> matching mode to allow you to still specify preview files for specific models.</li>
 </ul>"""))
+	shared.opts.add_option("model_preview_xd_filter_mode", shared.OptionInfo("Exact", "Filter mode", gr.Radio, {"choices": ["Exact", "Fuzzy"]}, onchange=on_filter_mode_change, section=section).info("Exact lists the models whose name or tags contain every comma separated filter. Fuzzy lists the 50 closest matches to the filter, best first, so typos and word order don't matter."))
 	shared.opts.add_option("model_preview_xd_limit_sizing", shared.OptionInfo(True, "Limit the height of previews to the height of the browser window", section=section).info(".html preview files are always limited regardless of this setting. Requires UI Reload"))
 	shared.opts.add_option("model_preview_xd_column_view", shared.OptionInfo(False, "Column view", section=section).info("This is only recommended if you use .txt files. Left column will have model select, .txt and .prompt preview data. Right column will have preview images and .md preview data, or .civitai.info preview data or .html preview data. Requires UI Reload"))
+	shared.opts.add_option("model_preview_xd_thumbnails", shared.OptionInfo(True, "Show thumbnails of preview images", section=section).info("Large preview images are shown as smaller copies saved to the extension folder. The full image is loaded when you click on it."))
+	shared.opts.add_option("model_preview_xd_thumbnail_size", shared.OptionInfo(512, "Maximum width and height of thumbnails", gr.Slider, {"minimum": 128, "maximum": 2048, "step": 64}, section=section))
+	shared.opts.add_option("model_preview_xd_gallery_page_size", shared.OptionInfo(24, "Number of preview images to show before loading more", gr.Slider, {"minimum": 0, "maximum": 200, "step": 1}, section=section).info("The next images are loaded when you scroll to the end of the gallery. Set to 0 to show every image at once."))
 	shared.opts.add_option("model_preview_xd_cache_images_civitai_info", shared.OptionInfo(False, "Cache images from .civitai.info previews", section=section).info("Saves files to extension folder."))
+	shared.opts.add_option("model_preview_xd_civitai_cache_size", shared.OptionInfo(512, "Maximum size of the .civitai.info image cache (MB)", gr.Number, {"precision": 0}, section=section).info("The least recently viewed images are removed when the cache is full."))
+	shared.opts.add_option("model_preview_xd_slow_request_threshold", shared.OptionInfo(0, "Log previews and model lists that take longer than this (ms)", gr.Number, {"precision": 0}, section=section).info(f"Prints how long each stage took to the console. Set to 0 to turn off. The timings of every stage are served as json from {timing_stats_route}"))
+	shared.opts.add_option("model_preview_xd_preview_cache_size", shared.OptionInfo(64, "Maximum memory used to keep previews of recently viewed models (MB)", gr.Number, {"precision": 0}, section=section).info("Set to 0 to render the preview every time a model is selected."))
 
 script_callbacks.on_ui_settings(on_ui_settings)
-script_callbacks.on_ui_tabs(on_ui_tabs)
\ No newline at end of file
+script_callbacks.on_ui_tabs(on_ui_tabs)
+script_callbacks.on_app_started(on_app_started)
\ No newline at end of file